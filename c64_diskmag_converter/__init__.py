@@ -1,4 +1,10 @@
 from c64_diskmag_converter.corpus import *
+from c64_diskmag_converter.lookup_tables import *
+from c64_diskmag_converter.manifest import *
+from c64_diskmag_converter.decode_cache import *
+from c64_diskmag_converter.metadata_index import *
+from c64_diskmag_converter.text_index import *
+from c64_diskmag_converter.text_export import *
 from c64_diskmag_converter.diskmag import *
 from c64_diskmag_converter.text_processing import *
 from c64_diskmag_converter.xml_markup_creator import *
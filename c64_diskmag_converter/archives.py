@@ -0,0 +1,113 @@
+import hashlib
+import os
+import zipfile
+from pathlib import Path
+from typing import List, Optional, Tuple
+from c64_diskmag_converter.lookup_tables import file_hash
+
+
+ARCHIVE_EXTENSION = '.zip'
+IMAGE_EXTENSION = '.d64'
+
+
+def split_archive_path(path: str) -> Optional[Tuple[str, str]]:
+    """
+    Splits the path of a disk image inside a ZIP archive. Such paths continue the path
+    of the archive with the path of the member, e.g. corpus/Magazine/Issue.zip/disk1.d64
+    :param path: Path to a disk image
+    :return: Path to the archive and name of the member, None if the image is not part of an archive
+    """
+    parts = Path(path).parts
+    for index, part in enumerate(parts[:-1]):
+        if part.lower().endswith(ARCHIVE_EXTENSION):
+            archive = os.path.join(*parts[:index + 1])
+            if os.path.isfile(archive):
+                return archive, '/'.join(parts[index + 1:])
+    return None
+
+
+def archive_images(archive: str) -> List[str]:
+    """
+    Lists the disk images inside a ZIP archive
+    :param archive: Path to the archive
+    :return: Paths of the disk images, see split_archive_path
+    """
+    try:
+        with zipfile.ZipFile(archive) as zip_file:
+            names = zip_file.namelist()
+    except (OSError, zipfile.BadZipFile):
+        return []
+    return [os.path.join(archive, *name.split('/')) for name in names
+            if name.lower().endswith(IMAGE_EXTENSION) and not name.endswith('/')]
+
+
+def read_member(archive: str, member: str) -> bytes:
+    with zipfile.ZipFile(archive) as zip_file:
+        return zip_file.read(member)
+
+
+def image_names(path: str) -> Tuple[str, str]:
+    """
+    Derives magazine and issue from the location of a disk image. Images in the directory
+    layout magazine/issue/image.d64 are named after their directories, images inside
+    an archive magazine/issue.zip are named after the archive and its directory
+    :param path: Path to the disk image
+    :return: Magazine and issue
+    """
+    archive_path = split_archive_path(path)
+    if archive_path is None:
+        return Path(path).parent.parent.name, Path(path).parent.name
+    archive = Path(archive_path[0])
+    return archive.parent.name, archive.stem
+
+
+def sibling_images(path: str) -> int:
+    """
+    Counts the disk images in the directory or archive directory of a disk image, including the image itself
+    :param path: Path to the disk image
+    :return: Number of disk images
+    """
+    archive_path = split_archive_path(path)
+    if archive_path is None:
+        return len(list(Path(path).parent.glob(f'*{IMAGE_EXTENSION}')))
+    archive, member = archive_path
+    directory = os.path.dirname(os.path.join(archive, *member.split('/')))
+    return sum(1 for image in archive_images(archive) if os.path.dirname(image) == directory)
+
+
+def tei_path_for(disk_image: str) -> str:
+    """
+    Locates the TEI file of a disk image. The TEI files of images inside an archive
+    are written to a directory next to the archive, which is named like the archive
+    :param disk_image: Path to the disk image
+    :return: Path to the TEI file
+    """
+    archive_path = split_archive_path(disk_image)
+    if archive_path is None:
+        return f'{os.path.splitext(disk_image)[0]}.xml'
+    archive, member = archive_path
+    return os.path.join(os.path.splitext(archive)[0], f'{os.path.splitext(member.split("/")[-1])[0]}.xml')
+
+
+def image_stat(disk_image: str) -> Tuple[int, int]:
+    """
+    Returns size and modification time of a disk image, for images inside an archive
+    the modification time of the archive is used
+    :param disk_image: Path to the disk image
+    :return: Size in bytes and modification time in nanoseconds
+    """
+    archive_path = split_archive_path(disk_image)
+    if archive_path is None:
+        stat = os.stat(disk_image)
+        return stat.st_size, stat.st_mtime_ns
+    archive, member = archive_path
+    with zipfile.ZipFile(archive) as zip_file:
+        size = zip_file.getinfo(member).file_size
+    return size, os.stat(archive).st_mtime_ns
+
+
+def image_hash(disk_image: str) -> str:
+    archive_path = split_archive_path(disk_image)
+    if archive_path is None:
+        return file_hash(disk_image)
+    return hashlib.sha256(read_member(*archive_path)).hexdigest()
@@ -0,0 +1,167 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+from c64_diskmag_converter.d64_reader import D64Reader
+from c64_diskmag_converter.diskmag import DiskmagC64
+from c64_diskmag_converter.lookup_tables import load_issue_index
+from c64_diskmag_converter.synthetic import build_corpus
+from c64_diskmag_converter.text_processing import (ENCODING_MAPPING, byte_histogram, check_entropy, decode_with_encoding,
+                                                   encoding_scores, insert_newlines, replace_custom_umlauts)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(__file__),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def time_stage(function: Callable, inputs: List, repeat: int, size: Callable = len) -> Dict[str, float]:
+    """
+    Times a function on every input. The fastest of several rounds is reported
+    :param function: Function which is called with one input at a time
+    :param inputs: Inputs of the function
+    :param repeat: Number of rounds
+    :param size: Function returning the size of an input in bytes
+    :return: Timings of the stage
+    """
+    rounds = []
+    for _ in range(repeat):
+        durations = []
+        for item in inputs:
+            start = time.perf_counter()
+            function(item)
+            durations.append(time.perf_counter() - start)
+        rounds.append(durations)
+    durations = min(rounds, key=sum)
+    total = sum(durations)
+    total_bytes = sum(size(item) for item in inputs)
+    return {'calls': len(inputs),
+            'total_seconds': total,
+            'mean_seconds': total / len(inputs) if inputs else 0.0,
+            'median_seconds': statistics.median(durations) if durations else 0.0,
+            'bytes': total_bytes,
+            'bytes_per_second': total_bytes / total if total else 0.0}
+
+
+def read_image(path: str) -> List[bytes]:
+    with D64Reader.from_path(path) as reader:
+        return [reader.read(entry) for entry in reader.entries()]
+
+
+def classify(content: bytes):
+    histogram = byte_histogram(content)
+    entropy = check_entropy(content, histogram)
+    scores = encoding_scores(content, histogram)
+    return entropy, scores.index(max(scores)), max(scores)
+
+
+def run_benchmark(workdir: str, num_images: int, seed: int, repeat: int, char_threshold: float) -> dict:
+    issues = sorted(load_issue_index())[:max(1, num_images // 2)]
+    corpus = build_corpus(workdir, num_images, seed=seed, issues=issues)
+    images = sorted(corpus)
+    contents = [content for image in images for content in read_image(image) if content]
+    text_files = []
+    for content in contents:
+        entropy, encoding, ratio = classify(content)
+        if entropy < 7 and ratio >= char_threshold:
+            text_files.append((content, encoding))
+    texts = [decode_with_encoding(content, encoding) for content, encoding in text_files]
+    umlaut_texts = [replace_custom_umlauts(text)[0] for text in texts]
+    text_size = lambda text: len(text.encode('utf-8'))
+
+    stages = {'read': time_stage(read_image, images, repeat, size=os.path.getsize),
+              'classify': time_stage(classify, contents, repeat),
+              'decode': time_stage(lambda text_file: decode_with_encoding(*text_file), text_files, repeat,
+                                   size=lambda text_file: len(text_file[0])),
+              'umlauts': time_stage(replace_custom_umlauts, texts, repeat, size=text_size),
+              'newlines': time_stage(insert_newlines, umlaut_texts, repeat, size=text_size)}
+
+    convert = lambda image: DiskmagC64(image).convert_to_tei(char_threshold)
+    stages['tei'] = time_stage(convert, images, repeat, size=os.path.getsize)
+    # Memory is traced in a separate round, since tracing slows down the conversion
+    tracemalloc.start()
+    for image in images:
+        convert(image)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    num_files = sum(len(files) for files in corpus.values())
+    tei_seconds = stages['tei']['total_seconds']
+    return {'revision': git_revision(),
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'platform': platform.platform(),
+            'parameters': {'images': num_images, 'seed': seed, 'repeat': repeat, 'char_threshold': char_threshold,
+                           'encodings': [encoding[1] for encoding in ENCODING_MAPPING.values()]},
+            'stages': stages,
+            'end_to_end': {'images': num_images,
+                           'files': num_files,
+                           'text_files': len(texts),
+                           'seconds': tei_seconds,
+                           'images_per_second': num_images / tei_seconds if tei_seconds else 0.0,
+                           'files_per_second': num_files / tei_seconds if tei_seconds else 0.0,
+                           'peak_traced_memory_bytes': peak_memory}}
+
+
+def compare(results: dict, baseline: dict) -> str:
+    """
+    Formats the change of every stage relative to a previous run
+    :param results: Results of the current run
+    :param baseline: Results of a previous run
+    :return: Table with one row per stage
+    """
+    lines = [f'{"stage":10} {"baseline s":>12} {"current s":>12} {"ratio":>8}']
+    for stage, timings in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if not previous:
+            continue
+        ratio = timings['total_seconds'] / previous['total_seconds'] if previous['total_seconds'] else float('nan')
+        lines.append(f'{stage:10} {previous["total_seconds"]:12.4f} {timings["total_seconds"]:12.4f} {ratio:8.2f}')
+    return '\n'.join(lines)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks every conversion stage on synthetic D64 images')
+    parser.add_argument('--images', type=int, default=20, help='Number of synthetic disk images')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic corpus')
+    parser.add_argument('--repeat', type=int, default=3, help='Rounds per stage, the fastest is reported')
+    parser.add_argument('--threshold', type=float, default=0.4,
+                        help='Minimal proportion of alphabetic characters for text files')
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON file with the results')
+    parser.add_argument('--compare', default=None, help='Results of a previous run to compare with')
+    parser.add_argument('--workdir', default=None, help='Directory for the synthetic corpus, temporary if not given')
+    args = parser.parse_args(argv)
+
+    if args.workdir:
+        results = run_benchmark(args.workdir, args.images, args.seed, args.repeat, args.threshold)
+    else:
+        with tempfile.TemporaryDirectory(prefix='c64_diskmag_benchmark_') as workdir:
+            results = run_benchmark(workdir, args.images, args.seed, args.repeat, args.threshold)
+    with open(args.output, 'w', encoding='utf-8') as output:
+        json.dump(results, output, indent=2)
+
+    for stage, timings in results['stages'].items():
+        print(f'{stage:10} {timings["calls"]:6d} calls {timings["total_seconds"]:10.4f} s '
+              f'{timings["bytes_per_second"] / 1e6:10.2f} MB/s')
+    end_to_end = results['end_to_end']
+    print(f'end to end {end_to_end["images_per_second"]:.2f} images/s, {end_to_end["files_per_second"]:.2f} files/s, '
+          f'peak traced memory {end_to_end["peak_traced_memory_bytes"] / 1e6:.1f} MB')
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as baseline:
+            print(compare(results, json.load(baseline)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+import itertools
+import json
+import os
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from c64_diskmag_converter.archives import ARCHIVE_EXTENSION, IMAGE_EXTENSION, archive_images
+
+
+CATALOG_NAME = 'corpus_catalog.json'
+# Increase when the structure of the persisted catalog changes
+CATALOG_VERSION = 1
+
+
+@dataclass
+class CatalogImage:
+    path: str
+    magazine: str
+    issue: str
+    is_partial: bool
+    part: Optional[int] = None
+
+
+def base_filename(issue: str) -> str:
+    return issue.lower().replace('.', '_').replace(' ', '_')
+
+
+def natural_key(path: str) -> Tuple[bool, int, str]:
+    """
+    Sorts disk images by the number at the end of their name, e.g. disk2 before disk10,
+    images without a number follow in the order of their names
+    :param path: Path to the disk image
+    :return: Sort key
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    digits = re.search(r'\d+$', name)
+    return digits is None, int(digits.group()) if digits else 0, name
+
+
+def number_images(paths: List[str], issue: str) -> Dict[str, int]:
+    """
+    Numbers the disk images of an issue. Images which are already named like renamed_image
+    keep their number, the other images get the free numbers in natural order
+    :param paths: Paths to the disk images of the issue
+    :param issue: Name of the issue
+    :return: Part number per disk image
+    """
+    named = re.compile(rf'{re.escape(base_filename(issue))}_([1-9]\d*)')
+    parts = {}
+    for path in paths:
+        match = named.fullmatch(os.path.splitext(os.path.basename(path))[0])
+        if match:
+            parts[path] = int(match.group(1))
+    taken = set(parts.values())
+    free = (number for number in itertools.count(1) if number not in taken)
+    for path in sorted((path for path in paths if path not in parts), key=natural_key):
+        parts[path] = next(free)
+    return parts
+
+
+def renamed_image(image: CatalogImage) -> str:
+    """
+    Names a disk image after its issue directory, partial images are numbered
+    :param image: Disk image of the catalog
+    :return: New path of the disk image
+    """
+    directory = os.path.dirname(image.path)
+    suffix = f'_{image.part}' if image.is_partial else ''
+    return os.path.join(directory, f'{base_filename(os.path.basename(directory))}{suffix}{IMAGE_EXTENSION}')
+
+
+class CorpusCatalog:
+    """
+    Listing of the disk images of a corpus, created with a single scandir pass over the directory tree.
+    Every directory is stored with its modification time and every archive with its size and modification
+    time, so that a later scan only lists the directories and archives which changed since
+    """
+    def __init__(self, corpus_path: str, directories: Optional[Dict[str, dict]] = None,
+                 archives: Optional[Dict[str, dict]] = None):
+        self.corpus_path = corpus_path
+        self.directories = directories or {}
+        self.archives = archives or {}
+        self.images = self.collect_images()
+        self.by_path = {image.path: image for image in self.images}
+
+    @classmethod
+    def load(cls, corpus_path: str) -> Optional['CorpusCatalog']:
+        try:
+            with open(os.path.join(corpus_path, CATALOG_NAME), encoding='utf-8') as catalog_file:
+                data = json.load(catalog_file)
+        except (OSError, json.JSONDecodeError):
+            return None
+        if data.get('version') != CATALOG_VERSION:
+            return None
+        return cls(corpus_path, data['directories'], data['archives'])
+
+    def save(self):
+        path = os.path.join(self.corpus_path, CATALOG_NAME)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as catalog_file:
+                json.dump({'version': CATALOG_VERSION, 'directories': self.directories, 'archives': self.archives},
+                          catalog_file, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError:
+            # A read-only corpus is scanned completely every time
+            pass
+
+    @classmethod
+    def scan(cls, corpus_path: str, persist: bool = True) -> 'CorpusCatalog':
+        """
+        Lists the disk images of a corpus, reusing the listings of unchanged directories and archives
+        :param corpus_path: Root directory of the corpus
+        :param persist: Load the previous catalog and save the new one in the corpus root
+        :return: Catalog of the corpus
+        """
+        previous = cls.load(corpus_path) if persist else None
+        previous_directories = previous.directories if previous else {}
+        previous_archives = previous.archives if previous else {}
+        directories = {}
+        archives = {}
+        pending = ['']
+        while pending:
+            relative = pending.pop()
+            path = os.path.join(corpus_path, *relative.split('/')) if relative else corpus_path
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            listing = previous_directories.get(relative)
+            if not listing or listing['mtime_ns'] != mtime_ns:
+                listing = cls.list_directory(path, mtime_ns)
+            directories[relative] = listing
+            pending.extend(f'{relative}/{name}' if relative else name for name in listing['directories'])
+
+            for name in listing['archives']:
+                archive = f'{relative}/{name}' if relative else name
+                try:
+                    stat = os.stat(os.path.join(path, name))
+                except OSError:
+                    continue
+                snapshot = previous_archives.get(archive)
+                if not snapshot or snapshot['size'] != stat.st_size or snapshot['mtime_ns'] != stat.st_mtime_ns:
+                    archive_path = os.path.join(path, name)
+                    members = [os.path.relpath(image, archive_path).replace(os.sep, '/')
+                               for image in archive_images(archive_path)]
+                    snapshot = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'members': sorted(members)}
+                archives[archive] = snapshot
+
+        catalog = cls(corpus_path, directories, archives)
+        if persist:
+            catalog.save()
+        return catalog
+
+    @staticmethod
+    def list_directory(path: str, mtime_ns: int) -> dict:
+        images, archives, subdirectories = [], [], []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # Hidden entries are skipped like by glob
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_dir():
+                    subdirectories.append(entry.name)
+                elif entry.name.endswith(IMAGE_EXTENSION):
+                    images.append(entry.name)
+                elif entry.name.endswith(ARCHIVE_EXTENSION):
+                    archives.append(entry.name)
+        return {'mtime_ns': mtime_ns, 'images': sorted(images), 'archives': sorted(archives),
+                'directories': sorted(subdirectories)}
+
+    def collect_images(self) -> List[CatalogImage]:
+        # Disk images of the same directory or archive directory with their magazine and issue, see image_names
+        groups = []
+        for relative, listing in self.directories.items():
+            directory = os.path.join(self.corpus_path, *relative.split('/')) if relative else self.corpus_path
+            names = (Path(directory).parent.name, Path(directory).name)
+            groups.append((names, [os.path.join(directory, name) for name in listing['images']]))
+        for relative, snapshot in self.archives.items():
+            archive = os.path.join(self.corpus_path, *relative.split('/'))
+            names = (Path(archive).parent.name, Path(archive).stem)
+            members = {}
+            for member in snapshot['members']:
+                members.setdefault(os.path.dirname(member), []).append(os.path.join(archive, *member.split('/')))
+            groups.extend((names, paths) for paths in members.values())
+
+        images = []
+        for (magazine, issue), paths in groups:
+            is_partial = len(paths) > 1
+            parts = number_images(paths, issue) if is_partial else {}
+            for path in paths:
+                images.append(CatalogImage(path=path, magazine=magazine, issue=issue, is_partial=is_partial,
+                                           part=parts.get(path)))
+        return sorted(images, key=lambda image: image.path)
+
+    @property
+    def files(self) -> List[str]:
+        return [image.path for image in self.images]
+
+    def issues(self) -> Dict[Tuple[str, str], List[CatalogImage]]:
+        """
+        Groups the disk images by magazine and issue
+        :return: Disk images per magazine and issue
+        """
+        issues = {}
+        for image in self.images:
+            issues.setdefault((image.magazine, image.issue), []).append(image)
+        return issues
+
+    def rename_plan(self) -> List[Tuple[str, str]]:
+        """
+        Plans the renaming of the disk images after their issue directories, see number_images.
+        Images inside archives and images which are already named after their issue keep their names
+        :return: Old and new path of every disk image whose name changes
+        """
+        archive_prefixes = tuple(os.path.join(self.corpus_path, *archive.split('/')) + os.sep
+                                 for archive in self.archives)
+        plan = []
+        for image in self.images:
+            if archive_prefixes and image.path.startswith(archive_prefixes):
+                continue
+            new_path = renamed_image(image)
+            if new_path != image.path:
+                plan.append((image.path, new_path))
+        return plan
@@ -0,0 +1,267 @@
+import argparse
+import json
+import os
+import sys
+from dataclasses import asdict
+from typing import List, Optional, Tuple
+from c64_diskmag_converter.corpus import Corpus
+from c64_diskmag_converter.decode_cache import DECODE_CACHE_SIZE
+from c64_diskmag_converter.text_export import EXPORT_FORMATS, RECORDS_PER_FILE, TextExportWriter
+from c64_diskmag_converter.server import DEFAULT_PORT, ConversionService, create_server
+from c64_diskmag_converter.text_index import TextIndex
+
+# SQLite in WAL mode does not work on network file systems, see DecodeCache
+CACHE_PATH_HELP = ('Decode cache database, by default decode_cache.sqlite in the corpus root. Sharded runs only '
+                   'use a decode cache if this is given, e.g. a path on a disk local to the machine')
+
+def parse_shard(value: str) -> Tuple[int, int]:
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'Shard must be given as i/N, got {value!r}')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f'Shard index must be between 0 and N-1, got {value!r}')
+    return index, count
+
+
+def write_report(path: str, records: List[dict]):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as report:
+        for record in records:
+            report.write(json.dumps(record, ensure_ascii=False) + '\n')
+    os.replace(tmp_path, path)
+
+
+def read_report(path: str) -> List[dict]:
+    with open(path, encoding='utf-8') as report:
+        return [json.loads(line) for line in report if line.strip()]
+
+
+def summarize(records: List[dict]) -> str:
+    skipped = sum(1 for record in records if record['skipped'])
+    failed = sum(1 for record in records if not record['success'])
+    converted = len(records) - skipped - failed
+    return f'{len(records)} disk images: {converted} converted, {skipped} up to date, {failed} failed'
+
+
+def convert(args: argparse.Namespace) -> int:
+    corpus = Corpus(args.name, args.corpus_path)
+    writer = None
+    if args.export:
+        writer = TextExportWriter(args.export, args.format, args.compression, args.records_per_file, args.shard)
+    results = corpus.convert_files_to_tei(args.threshold,
+                                          workers=args.workers,
+                                          # Skipped images would be missing from the export
+                                          incremental=not args.full and writer is None,
+                                          shard=args.shard,
+                                          profile=args.profile is not None,
+                                          decode_cache=not args.no_cache,
+                                          cache_size=int(args.cache_size * (1 << 20)),
+                                          cache_path=args.cache_path,
+                                          text_index=not args.no_text_index,
+                                          ngram_size=args.ngrams,
+                                          export=writer)
+    if writer is not None:
+        writer.close()
+    if args.profile:
+        corpus.export_stats(args.profile)
+    records = []
+    for result in results:
+        record = asdict(result)
+        # Profiling statistics and file metadata are stored separately
+        del record['stats'], record['files'], record['tokens'], record['texts']
+        record['image'] = os.path.relpath(result.path, args.corpus_path).replace(os.sep, '/')
+        record['shard'] = '/'.join(map(str, args.shard)) if args.shard else None
+        records.append(record)
+    report = args.report
+    if report is None:
+        report = f'conversion_report.{args.shard[0]}-of-{args.shard[1]}.jsonl' if args.shard else 'conversion_report.jsonl'
+    write_report(report, records)
+    print(summarize(records), file=sys.stderr)
+    return 0
+
+
+def merge(args: argparse.Namespace) -> int:
+    merged = {}
+    for path in args.reports:
+        for record in read_report(path):
+            merged[record['image']] = record
+    records = [merged[image] for image in sorted(merged)]
+    write_report(args.output, records)
+    print(summarize(records), file=sys.stderr)
+    if args.corpus_path:
+        count = Corpus(args.name, args.corpus_path).merge_shards(args.shards)
+        print(f'Merged the indexes of {count} shards', file=sys.stderr)
+    return 0
+
+
+def triage(args: argparse.Namespace) -> int:
+    corpus = Corpus(args.name, args.corpus_path)
+    rows = corpus.triage(args.threshold, workers=args.workers, sample_size=args.sample, shard=args.shard)
+    report = args.report
+    if report is None:
+        report = f'triage_report.{args.shard[0]}-of-{args.shard[1]}.jsonl' if args.shard else 'triage_report.jsonl'
+    write_report(report, rows)
+    counts = {}
+    for row in rows:
+        filetype = row.get('filetype', 'Fehler')
+        counts[filetype] = counts.get(filetype, 0) + 1
+    print(', '.join(f'{count} {filetype}' for filetype, count in sorted(counts.items())), file=sys.stderr)
+    return 0
+
+
+def search(args: argparse.Namespace) -> int:
+    with TextIndex.for_corpus(args.corpus_path, args.shard) as text_index:
+        if args.fragment:
+            results = text_index.search_fragment(args.query, args.limit)
+        else:
+            results = text_index.search(args.query, match_all=not args.any, limit=args.limit)
+    for result in results:
+        print(f'{result["hits"]:6d}  {result["image"]}#{result["xml_id"]}  {result["filename"]}')
+    return 0
+
+
+def export(args: argparse.Namespace) -> int:
+    corpus = Corpus(args.name, args.corpus_path)
+    paths, errors = corpus.export_texts(args.output_dir, args.threshold,
+                                        workers=args.workers,
+                                        shard=args.shard,
+                                        export_format=args.format,
+                                        compression=args.compression,
+                                        records_per_file=args.records_per_file,
+                                        decode_cache=not args.no_cache,
+                                        cache_path=args.cache_path)
+    for image, error in errors.items():
+        print(f'{image}: {error}', file=sys.stderr)
+    print(f'{len(paths)} files written, {len(errors)} disk images failed', file=sys.stderr)
+    return 0
+
+
+def add_export_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help='Format of the exported files')
+    parser.add_argument('--compression', default=None,
+                        help='gzip, bz2 or xz for JSON lines, a codec like snappy or zstd for Parquet')
+    parser.add_argument('--records-per-file', type=int, default=RECORDS_PER_FILE,
+                        help='Maximal number of extracted files per exported file')
+
+
+def serve(args: argparse.Namespace) -> int:
+    service = ConversionService(args.workers, args.queue, args.threshold, args.timeout)
+    server = create_server(service, args.host, args.port, args.socket)
+    address = args.socket or f'http://{args.host}:{args.port}'
+    print(f'Serving on {address} with {args.workers} workers', file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='c64-diskmag-converter',
+                                     description='Converts Commodore 64 diskmag images to TEI')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    convert_parser = subparsers.add_parser('convert', help='Convert the disk images of a corpus')
+    convert_parser.add_argument('corpus_path', help='Root directory of the corpus')
+    convert_parser.add_argument('--threshold', type=float, default=0.4,
+                                help='Minimal proportion of alphabetic characters for text files')
+    convert_parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    convert_parser.add_argument('--shard', type=parse_shard, default=None, metavar='i/N',
+                                help='Convert only shard i of N, counted from 0')
+    convert_parser.add_argument('--full', action='store_true',
+                                help='Convert all disk images, even if they are up to date')
+    convert_parser.add_argument('--report', default=None,
+                                help='JSON lines report, by default conversion_report[.i-of-N].jsonl')
+    convert_parser.add_argument('--no-cache', action='store_true',
+                                help='Decode every file, even if an identical file was decoded before')
+    convert_parser.add_argument('--cache-size', type=float, default=DECODE_CACHE_SIZE / (1 << 20), metavar='MB',
+                                help='Size limit of the decode cache')
+    convert_parser.add_argument('--cache-path', default=None, metavar='PATH', help=CACHE_PATH_HELP)
+    convert_parser.add_argument('--no-text-index', action='store_true',
+                                help='Do not update the full-text index of the extracted texts')
+    convert_parser.add_argument('--ngrams', type=int, default=None, metavar='N',
+                                help='Index the character n-grams of the vocabulary for fragment search')
+    convert_parser.add_argument('--profile', default=None, metavar='PATH',
+                                help='Record timings of every conversion stage and write them as JSON')
+    convert_parser.add_argument('--export', default=None, metavar='DIR',
+                                help='Export the texts and metadata of the extracted files as well, implies --full')
+    add_export_arguments(convert_parser)
+    convert_parser.add_argument('--name', default='deutschsprachige Diskettenmagazine', help='Name of the corpus')
+    convert_parser.set_defaults(func=convert)
+
+    triage_parser = subparsers.add_parser('triage', help='Classify the files of a corpus without converting them')
+    triage_parser.add_argument('corpus_path', help='Root directory of the corpus')
+    triage_parser.add_argument('--threshold', type=float, default=0.4,
+                               help='Minimal proportion of alphabetic characters for text files')
+    triage_parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    triage_parser.add_argument('--sample', type=int, default=None, metavar='BYTES',
+                               help='Classify only the first bytes of larger files')
+    triage_parser.add_argument('--shard', type=parse_shard, default=None, metavar='i/N',
+                               help='Classify only shard i of N, counted from 0')
+    triage_parser.add_argument('--report', default=None,
+                               help='JSON lines report, by default triage_report[.i-of-N].jsonl')
+    triage_parser.add_argument('--name', default='deutschsprachige Diskettenmagazine', help='Name of the corpus')
+    triage_parser.set_defaults(func=triage)
+
+    export_parser = subparsers.add_parser('export', help='Export the texts and metadata of a corpus without TEI')
+    export_parser.add_argument('corpus_path', help='Root directory of the corpus')
+    export_parser.add_argument('output_dir', help='Directory of the exported files')
+    export_parser.add_argument('--threshold', type=float, default=0.4,
+                               help='Minimal proportion of alphabetic characters for text files')
+    export_parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    export_parser.add_argument('--shard', type=parse_shard, default=None, metavar='i/N',
+                               help='Export only shard i of N, counted from 0')
+    export_parser.add_argument('--no-cache', action='store_true',
+                               help='Decode every file, even if an identical file was decoded before')
+    export_parser.add_argument('--cache-path', default=None, metavar='PATH', help=CACHE_PATH_HELP)
+    add_export_arguments(export_parser)
+    export_parser.add_argument('--name', default='deutschsprachige Diskettenmagazine', help='Name of the corpus')
+    export_parser.set_defaults(func=export)
+
+    search_parser = subparsers.add_parser('search', help='Search the full-text index of a converted corpus')
+    search_parser.add_argument('corpus_path', help='Root directory of the corpus')
+    search_parser.add_argument('query', help='Words which are searched')
+    search_parser.add_argument('--any', action='store_true', help='Find files with any of the words')
+    search_parser.add_argument('--fragment', action='store_true', help='Find words containing the query')
+    search_parser.add_argument('--limit', type=int, default=50, help='Maximal number of results')
+    search_parser.add_argument('--shard', type=parse_shard, default=None, metavar='i/N',
+                               help='Search the index of shard i of N')
+    search_parser.set_defaults(func=search)
+
+    serve_parser = subparsers.add_parser('serve', help='Convert disk images on request with warm worker processes')
+    serve_parser.add_argument('--host', default='127.0.0.1', help='Host name of the HTTP server')
+    serve_parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='Port of the HTTP server')
+    serve_parser.add_argument('--socket', default=None, metavar='PATH',
+                              help='Listen on a Unix socket instead of a TCP port')
+    serve_parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+    serve_parser.add_argument('--queue', type=int, default=16,
+                              help='Number of requests waiting for a worker before requests are rejected')
+    serve_parser.add_argument('--threshold', type=float, default=0.4,
+                              help='Minimal proportion of alphabetic characters for text files')
+    serve_parser.add_argument('--timeout', type=float, default=None, metavar='SECONDS',
+                              help='Maximal duration of a conversion')
+    serve_parser.set_defaults(func=serve)
+
+    merge_parser = subparsers.add_parser('merge', help='Merge the reports of several shards')
+    merge_parser.add_argument('reports', nargs='+', help='Reports written by convert')
+    merge_parser.add_argument('--output', default='conversion_report.jsonl', help='Merged report')
+    merge_parser.add_argument('--corpus-path', default=None,
+                              help='Merge the metadata and full-text indexes of the shards in this corpus as well')
+    merge_parser.add_argument('--shards', type=int, default=None, metavar='N',
+                              help='Total number of shards, found from the index files if not given')
+    merge_parser.add_argument('--name', default='deutschsprachige Diskettenmagazine', help='Name of the corpus')
+    merge_parser.set_defaults(func=merge)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
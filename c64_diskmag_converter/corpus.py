@@ -1,7 +1,116 @@
-import glob
+import json
 import os
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from contextlib import nullcontext
+from typing import Dict, List, Optional, Tuple
 from tqdm import tqdm
+from c64_diskmag_converter import profiling
+from c64_diskmag_converter.catalog import CorpusCatalog
+from c64_diskmag_converter.decode_cache import DECODE_CACHE_SIZE, DecodeCache
 from c64_diskmag_converter.diskmag import DiskmagC64
+from c64_diskmag_converter.manifest import ConversionManifest, shard_counts
+from c64_diskmag_converter.metadata_index import METADATA_INDEX_NAME, MetadataIndex, index_name
+from c64_diskmag_converter.text_export import RECORDS_PER_FILE, TextExportWriter, text_record
+from c64_diskmag_converter.text_index import TEXT_INDEX_NAME, TextIndex, text_index_name
+
+
+@dataclass
+class ConversionResult:
+    path: str
+    success: bool
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    skipped: bool = False
+    stats: Optional[dict] = None
+    files: Optional[List[dict]] = None
+    tokens: Optional[List[Dict[str, int]]] = None
+    texts: Optional[List[dict]] = None
+
+
+def convert_disk_image(disk_image: str, char_threshold: float, profile: bool = False,
+                       cache_path: Optional[str] = None, export: bool = False, count_tokens: bool = False,
+                       is_partial: Optional[bool] = None, part: Optional[int] = None) -> ConversionResult:
+    """
+    Converts a single disk image to TEI and reports the outcome
+    :param disk_image: Path to the disk image
+    :param char_threshold: Minimal proportion of alphabetic characters for text files
+    :param profile: Record timings and size measures of every conversion stage
+    :param cache_path: SQLite database with the decode results of previously converted files
+    :param export: Return the decoded files with their texts for the text export, see text_export
+    :param count_tokens: Return the token counts of the decoded files for the full-text index
+    :param is_partial: Whether the disk image is one of several images of an issue, looked up if not given
+    :param part: Number of the disk image within its issue, see CatalogImage
+    :return: Result record of the conversion
+    """
+    start = time.perf_counter()
+    with profiling.profile_image(disk_image) if profile else nullcontext() as stats:
+        try:
+            with DecodeCache(cache_path) if cache_path else nullcontext() as decode_cache:
+                diskmag = DiskmagC64(disk_image, decode_cache, is_partial, keep_texts=export,
+                                     count_tokens=count_tokens, part=part)
+                error = diskmag.convert_to_tei(char_threshold)
+        except Exception as e:
+            error = f'Error accessing disk image: {str(e)}'
+    return ConversionResult(path=disk_image,
+                            success=error is None,
+                            error=error,
+                            elapsed=time.perf_counter() - start,
+                            stats=stats,
+                            files=diskmag.file_records if error is None else None,
+                            tokens=diskmag.file_tokens if error is None else None,
+                            texts=[text_record(metadata, disk_image, diskmag.diskmag, diskmag.issue)
+                                   for metadata in diskmag.file_texts] if export and error is None else None)
+
+
+def export_disk_image(disk_image: str, char_threshold: float, cache_path: Optional[str] = None,
+                      is_partial: Optional[bool] = None,
+                      part: Optional[int] = None) -> Tuple[str, List[dict], Optional[str]]:
+    """
+    Decodes the files of a single disk image for the text export without writing TEI
+    :param disk_image: Path to the disk image
+    :param char_threshold: Minimal proportion of alphabetic characters for text files
+    :param cache_path: SQLite database with the decode results of previously converted files
+    :param is_partial: Whether the disk image is one of several images of an issue, looked up if not given
+    :param part: Number of the disk image within its issue, see CatalogImage
+    :return: Path to the disk image, records of its files, see text_export.text_record, and an error message
+    """
+    try:
+        with DecodeCache(cache_path) if cache_path else nullcontext() as decode_cache:
+            diskmag = DiskmagC64(disk_image, decode_cache, is_partial, part=part)
+            if not diskmag.directory:
+                return disk_image, [], 'Error reading the directory of the disk image'
+            records = [text_record(metadata, disk_image, diskmag.diskmag, diskmag.issue)
+                       for metadata in diskmag.file_metadata(char_threshold)]
+    except Exception as e:
+        return disk_image, [], f'Error accessing disk image: {str(e)}'
+    return disk_image, records, None
+
+
+def triage_disk_image(disk_image: str, char_threshold: float, sample_size: Optional[int] = None,
+                      is_partial: Optional[bool] = None,
+                      part: Optional[int] = None) -> Tuple[str, List[dict], Optional[str]]:
+    """
+    Classifies the files of a single disk image, see DiskmagC64.triage
+    :param disk_image: Path to the disk image
+    :param char_threshold: Minimal proportion of alphabetic characters for text files
+    :param sample_size: Only the first bytes of larger files are classified if given
+    :param is_partial: Whether the disk image is one of several images of an issue, looked up if not given
+    :param part: Number of the disk image within its issue, see CatalogImage
+    :return: Path to the disk image, classification of its files and an error message
+    """
+    try:
+        diskmag = DiskmagC64(disk_image, is_partial=is_partial, part=part)
+        if not diskmag.directory:
+            return disk_image, [], 'Error reading the directory of the disk image'
+        rows = diskmag.triage(char_threshold, sample_size)
+    except Exception as e:
+        return disk_image, [], f'Error accessing disk image: {str(e)}'
+    for row in rows:
+        row.update(magazine=diskmag.diskmag, issue=diskmag.issue)
+    return disk_image, rows, None
 
 
 class Corpus:
@@ -11,43 +120,313 @@ class Corpus:
         self.corpus_name = corpus_name
         self.corpus_path = corpus_path
         self.files = self.get_files()
+        self.stats = None
 
     def get_files(self):
-        file_paths = []
-        pattern = '.d64'
-        files = glob.glob(os.path.join(self.corpus_path, '**', f'*{pattern}'), recursive=True)
-        file_paths.extend(files)
-        return sorted(file_paths)
-
-    def rename_files(self):
-        pattern = '.d64'
-        files = list(filter(lambda x: x.endswith(pattern), self.files))
-        counts = {}
-        for file in files:
-            directory = os.path.dirname(file)
-            counts[directory] = counts.get(directory, 0) + 1
-
-        for directory, count in counts.items():
-            if count > 1:
-                dir_files = glob.glob(os.path.join(directory, '**', f'*{pattern}'), recursive=True)
-                for i, file in enumerate(dir_files):
-                    ext = os.path.splitext(os.path.basename(file))[1]
-                    current_dir = os.path.basename(os.path.basename(os.path.dirname(file)))
-                    new_base_filename = current_dir.lower().replace('.', '_').replace(' ', '_')
-                    new_filename = f"{new_base_filename}_{i + 1}{ext}"
-                    os.rename(file, os.path.join(directory, new_filename))
-            else:
-                dir_files = glob.glob(os.path.join(directory, '**', f'*{pattern}'), recursive=True)
-                for file in dir_files:
-                    ext = os.path.splitext(os.path.basename(file))[1]
-                    current_dir = os.path.basename(os.path.basename(os.path.dirname(file)))
-                    new_base_filename = current_dir.lower().replace('.', '_').replace(' ', '_')
-                    new_filename = f'{new_base_filename}{ext}'
-                    os.rename(file, os.path.join(directory, new_filename))
+        self.catalog = CorpusCatalog.scan(self.corpus_path)
+        return self.catalog.files
+
+    def shard_files(self, index: int, count: int) -> List[str]:
+        """
+        Selects the disk images of one shard. The assignment depends only on the path
+        relative to the corpus root, so it is the same on every machine and does not
+        change for existing images when new images are added
+        :param index: Number of the shard, starting with 0
+        :param count: Total number of shards
+        :return: Disk images of the shard in the order of the corpus files
+        """
+        if not 0 <= index < count:
+            raise ValueError(f'Invalid shard {index}/{count}')
+        return [file for file in self.files
+                if zlib.crc32(os.path.relpath(file, self.corpus_path).replace(os.sep, '/').encode('utf-8')) % count == index]
+
+    def rename_files(self, dry_run: bool = False) -> List[Tuple[str, str]]:
+        """
+        Renames the disk images after their issue directories, the images of issues
+        with several disk images are numbered. Images inside archives keep their names
+        :param dry_run: Only plan the renaming without changing any file
+        :return: Old and new path of every renamed disk image
+        """
+        plan = self.catalog.rename_plan()
+        if dry_run:
+            return plan
+        sources = {old for old, _ in plan}
+        for _, new in plan:
+            if os.path.exists(new) and new not in sources:
+                raise ValueError(f'Cannot rename disk image, {new} already exists')
+        # Images are moved to temporary names first, so that swapped names do not overwrite each other
+        temporary = [(old, os.path.join(os.path.dirname(old), f'.{os.path.basename(old)}.rename'), new)
+                     for old, new in plan]
+        for old, tmp, _ in temporary:
+            os.rename(old, tmp)
+        for _, tmp, new in temporary:
+            os.rename(tmp, new)
 
         self.files = self.get_files()
+        return plan
+
+    def convert_files_to_tei(self, char_threshold: float,
+                             workers: int = 1,
+                             incremental: bool = True,
+                             shard: Optional[Tuple[int, int]] = None,
+                             profile: bool = False,
+                             decode_cache: bool = True,
+                             cache_size: int = DECODE_CACHE_SIZE,
+                             cache_path: Optional[str] = None,
+                             text_index: bool = True,
+                             ngram_size: Optional[int] = None,
+                             export: Optional[TextExportWriter] = None) -> List[ConversionResult]:
+        """
+        Converts all disk images of the corpus to TEI. Converted images are recorded
+        in the conversion manifest in the corpus root, so that later runs only convert
+        images whose content, position within their issue, threshold, lookup tables
+        or converter version changed.
+        The metadata of every extracted file is collected in the metadata index, see metadata_index,
+        and its tokens in the full-text index, see text_index
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :param workers: Number of worker processes, the images are converted serially if 1
+        :param incremental: Skip images which are up to date according to the manifest
+        :param shard: Index and total number of shards, only the images of this shard are converted
+        :param profile: Record timings and size measures of every conversion stage, see export_stats
+        :param decode_cache: Reuse the decode results of identical files from the decode cache, see decode_cache_path
+        :param cache_size: Size limit of the decode cache in bytes
+        :param cache_path: Path to the decode cache database, e.g. on a disk local to the machine of a shard
+        :param text_index: Update the full-text index of the extracted texts
+        :param ngram_size: Index the character n-grams of the vocabulary with this size, see TextIndex
+        :param export: Writer to which the decoded files of the converted images are written, see export_texts.
+        Skipped images are not exported, so a complete export requires incremental=False
+        :return: Result records in the order of the corpus files
+        """
+        files = self.shard_files(*shard) if shard else self.files
+        manifest = ConversionManifest(self.corpus_path, char_threshold, shard, self.catalog)
+        index_path = os.path.join(self.corpus_path, index_name(shard))
+        index = MetadataIndex.load(index_path)
+        indexed = index.images
+        tokens_index = TextIndex.for_corpus(self.corpus_path, shard, ngram_size) if text_index else None
+        if tokens_index is not None:
+            indexed &= tokens_index.images
+        results = {}
+        pending = []
+        for disk_image in files:
+            if incremental and manifest.is_current(disk_image) and manifest.key(disk_image) in indexed:
+                results[disk_image] = ConversionResult(path=disk_image, success=True, skipped=True)
+            else:
+                pending.append(disk_image)
+
+        cache_path = self.decode_cache_path(decode_cache, cache_path, cache_size, shard)
+        records = {}
+        args = (char_threshold, profile, cache_path, export is not None, tokens_index is not None)
+        conversions = self._map(convert_disk_image, pending, workers, args)
+        for result in tqdm(conversions, total=len(pending), unit='disk_images', desc='Converting disk images to TEI'):
+            results[result.path] = result
+            if result.success:
+                manifest.record(result.path)
+                image = manifest.key(result.path)
+                records[image] = [{**record, 'image': image} for record in result.files]
+                MetadataIndex.append(index_path, image, records[image])
+                if tokens_index is not None:
+                    tokens_index.replace_image(image, records[image], result.tokens)
+                if export is not None:
+                    export.write({**record, 'image': image} for record in result.texts)
+        manifest.compact(files)
+        kept = [manifest.key(disk_image) for disk_image in files if results[disk_image].skipped]
+        index.replace_images(records, kept).save(index_path)
+        if tokens_index is not None:
+            tokens_index.retain(kept + list(records))
+            tokens_index.close()
+        if cache_path:
+            with DecodeCache(cache_path, cache_size) as cache:
+                cache.evict()
+        if profile:
+            images = [results[disk_image].stats for disk_image in files if results[disk_image].stats]
+            self.stats = {'totals': profiling.aggregate(images), 'images': images}
+        return [results[disk_image] for disk_image in files]
+
+    def merge_shards(self, count: Optional[int] = None) -> int:
+        """
+        Combines the metadata and full-text indexes written by the shards of a distributed conversion
+        into the indexes of the whole corpus, which are read by metadata_index, query_files and search.
+        The indexes of the whole corpus are replaced
+        :param count: Total number of shards, found from the index files if not given
+        :return: Total number of shards
+        """
+        if count is None:
+            counts = set(shard_counts(self.corpus_path, METADATA_INDEX_NAME)) | \
+                set(shard_counts(self.corpus_path, TEXT_INDEX_NAME))
+            if len(counts) != 1:
+                raise ValueError(f'Cannot determine the number of shards, found indexes for {sorted(counts) or "none"}')
+            count = counts.pop()
+        shards = [(index, count) for index in range(count)]
+
+        index_path = os.path.join(self.corpus_path, index_name())
+        MetadataIndex.merge(self.metadata_index(shard) for shard in shards).save(index_path)
+
+        text_path = os.path.join(self.corpus_path, text_index_name())
+        tmp_path = f'{text_path}.{os.getpid()}.tmp'
+        shard_paths = [os.path.join(self.corpus_path, text_index_name(shard)) for shard in shards]
+        with TextIndex(tmp_path) as merged:
+            for shard_path in shard_paths:
+                if not os.path.exists(shard_path):
+                    continue
+                with TextIndex(shard_path) as shard_index:
+                    if merged.ngram_size is None and shard_index.ngram_size:
+                        merged.set_ngram_size(shard_index.ngram_size)
+                    merged.merge(shard_index)
+            merged.connection.execute('PRAGMA journal_mode=DELETE')
+        # A write-ahead log of the replaced database must not be applied to the merged one
+        for suffix in ('-wal', '-shm'):
+            if os.path.exists(text_path + suffix):
+                os.remove(text_path + suffix)
+        os.replace(tmp_path, text_path)
+        return count
+
+    def metadata_index(self, shard: Optional[Tuple[int, int]] = None) -> MetadataIndex:
+        """
+        Loads the metadata index written by convert_files_to_tei
+        :param shard: Index and total number of shards, the index of the whole corpus if not given
+        :return: Metadata index, empty if the corpus was not converted yet
+        """
+        return MetadataIndex.load(os.path.join(self.corpus_path, index_name(shard)))
+
+    def query_files(self, columns: Optional[List[str]] = None, **conditions) -> List[dict]:
+        """
+        Looks up the extracted files of the corpus in the metadata index
+        :param columns: Columns of the returned rows, all columns if not given
+        :param conditions: Conditions per column, e.g. filetype='Textdokument' or magazine=['Magic Disk 64']
+        :return: One dictionary per extracted file
+        """
+        return self.metadata_index().select(columns, **conditions)
+
+    def text_index(self, shard: Optional[Tuple[int, int]] = None) -> TextIndex:
+        """
+        Opens the full-text index written by convert_files_to_tei
+        :param shard: Index and total number of shards, the index of the whole corpus if not given
+        :return: Full-text index, which should be closed after use
+        """
+        return TextIndex.for_corpus(self.corpus_path, shard)
+
+    def search(self, query: str, match_all: bool = True, limit: Optional[int] = None) -> List[dict]:
+        """
+        Finds the extracted files which contain the words of a query
+        :param query: Words which are searched, case is ignored
+        :param match_all: Only return files which contain every word, otherwise any word
+        :param limit: Maximal number of results
+        :return: Files with magazine, issue, disk image, xml:id and number of occurrences
+        """
+        with self.text_index() as text_index:
+            return text_index.search(query, match_all, limit)
+
+    def decode_cache_path(self, decode_cache: bool, cache_path: Optional[str], cache_size: int,
+                          shard: Optional[Tuple[int, int]] = None) -> Optional[str]:
+        """
+        Creates the decode cache database before the workers open it. By default the cache is kept in
+        the corpus root. Sharded conversions run on several machines, which usually share the corpus over
+        a network file system, where the SQLite database in WAL mode cannot be used, see DecodeCache.
+        Therefore shards only use a decode cache if its path is given, e.g. on a disk local to the machine
+        :param decode_cache: Whether the decode cache is used at all
+        :param cache_path: Path to the database, the corpus root is used if not given
+        :param cache_size: Size limit of the decode cache in bytes
+        :param shard: Index and total number of shards
+        :return: Path to the database, None if no decode cache is used
+        """
+        if not decode_cache or (shard is not None and cache_path is None):
+            return None
+        if cache_path is None:
+            cache = DecodeCache.for_corpus(self.corpus_path, cache_size)
+        else:
+            cache = DecodeCache(cache_path, cache_size)
+        with cache:
+            return cache.path
+
+    def export_stats(self, stats_path: str):
+        """
+        Writes the statistics of the last profiled conversion as JSON
+        :param stats_path: Path to the JSON file
+        """
+        if self.stats is None:
+            raise ValueError('No statistics available, convert the corpus with profile=True first')
+        with open(stats_path, 'w', encoding='utf-8') as stats_file:
+            json.dump(self.stats, stats_file, indent=2, ensure_ascii=False)
+
+    def export_texts(self, output_dir: str, char_threshold: float,
+                     workers: int = 1,
+                     shard: Optional[Tuple[int, int]] = None,
+                     export_format: str = 'jsonl',
+                     compression: Optional[str] = None,
+                     records_per_file: int = RECORDS_PER_FILE,
+                     decode_cache: bool = True,
+                     cache_size: int = DECODE_CACHE_SIZE,
+                     cache_path: Optional[str] = None) -> Tuple[List[str], Dict[str, str]]:
+        """
+        Exports the decoded files of the corpus with their texts and metadata without writing TEI.
+        The records are written as soon as an image is decoded, in the order of completion
+        :param output_dir: Directory of the exported files
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :param workers: Number of worker processes, the images are decoded serially if 1
+        :param shard: Index and total number of shards, only the images of this shard are exported
+        :param export_format: jsonl or parquet, see TextExportWriter
+        :param compression: gzip, bz2 or xz for JSON lines, a Parquet codec for Parquet
+        :param records_per_file: Maximal number of records per exported file
+        :param decode_cache: Reuse the decode results of identical files from the decode cache, see decode_cache_path
+        :param cache_size: Size limit of the decode cache in bytes
+        :param cache_path: Path to the decode cache database, e.g. on a disk local to the machine of a shard
+        :return: Paths of the exported files and error messages of the images which could not be read
+        """
+        files = self.shard_files(*shard) if shard else self.files
+        cache_path = self.decode_cache_path(decode_cache, cache_path, cache_size, shard)
+        errors = {}
+        with TextExportWriter(output_dir, export_format, compression, records_per_file, shard) as writer:
+            for disk_image, records, error in tqdm(self._map(export_disk_image, files, workers, (char_threshold, cache_path)),
+                                                   total=len(files), unit='disk_images', desc='Exporting texts'):
+                image = os.path.relpath(disk_image, self.corpus_path).replace(os.sep, '/')
+                if error is not None:
+                    errors[image] = error
+                writer.write({**record, 'image': image} for record in records)
+        if cache_path:
+            with DecodeCache(cache_path, cache_size) as cache:
+                cache.evict()
+        return writer.paths, errors
+
+    def triage(self, char_threshold: float,
+               workers: int = 1,
+               sample_size: Optional[int] = None,
+               shard: Optional[Tuple[int, int]] = None) -> List[dict]:
+        """
+        Classifies every file of the corpus as text, program code or compressed data. Only the
+        directories are read and entropy and encodings are scored, no text is decoded or written
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :param workers: Number of worker processes, the images are classified serially if 1
+        :param sample_size: Only the first bytes of larger files are classified if given
+        :param shard: Index and total number of shards, only the images of this shard are classified
+        :return: One row per file in the order of the corpus files, images which cannot be read have a row without file
+        """
+        files = self.shard_files(*shard) if shard else self.files
+        results = {}
+        for disk_image, rows, error in tqdm(self._map(triage_disk_image, files, workers, (char_threshold, sample_size)),
+                                            total=len(files), unit='disk_images', desc='Classifying disk images'):
+            image = os.path.relpath(disk_image, self.corpus_path).replace(os.sep, '/')
+            if error is not None:
+                rows = [{'error': error}]
+            results[disk_image] = [{'image': image, **row} for row in rows]
+        return [row for disk_image in files for row in results[disk_image]]
 
-    def convert_files_to_tei(self, char_threshold: float):
-        for disk_image in tqdm(self.files, unit='disk_images', desc=f'Converting disk images to TEI'):
-            diskmag = DiskmagC64(disk_image)
-            diskmag.convert_to_tei(char_threshold)
+    def _map(self, function, disk_images: List[str], workers: int, args: tuple):
+        """
+        Applies a function to every disk image, in worker processes if more than one worker is used
+        :param function: Function called with the disk image, the arguments, whether the image is partial
+        and its part number from the catalog
+        :param disk_images: Paths to the disk images
+        :param workers: Number of worker processes
+        :param args: Further arguments of the function
+        :return: Generator of the results in the order of completion
+        """
+        catalog = {image.path: (image.is_partial, image.part) for image in self.catalog.images}
+        if workers <= 1:
+            for disk_image in disk_images:
+                yield function(disk_image, *args, *catalog.get(disk_image, (None, None)))
+            return
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(function, disk_image, *args, *catalog.get(disk_image, (None, None)))
+                       for disk_image in disk_images]
+            for future in as_completed(futures):
+                yield future.result()
@@ -0,0 +1,183 @@
+import mmap
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Tuple, Union
+
+
+SECTOR_SIZE = 256
+DIR_ENTRY_SIZE = 0x20
+DIR_TRACK = 18
+DIR_SECTOR = 1
+FILE_TYPES = ('DEL', 'SEQ', 'PRG', 'USR', 'REL', '???', '???', '???')
+LISTING_ENCODING = 'petscii_c64en_uc'
+FILENAME_ENCODING = 'petscii_c64en_lc'
+# Sectors per track for the 35 and 40 track variants of the D64 format
+TRACK_SECTORS = [21] * 17 + [19] * 7 + [18] * 6 + [17] * 10
+IMAGE_TRACKS = {174848: 35, 175531: 35, 196608: 40, 197376: 40}
+EXTENDED_BAM_OFFSET = 0xc0
+ALT_EXTENDED_BAM_OFFSET = 0xac
+TRACK_OFFSETS = [0]
+for sectors in TRACK_SECTORS:
+    TRACK_OFFSETS.append(TRACK_OFFSETS[-1] + sectors * SECTOR_SIZE)
+
+
+@dataclass
+class DirectoryEntry:
+    name: bytes
+    file_type: str
+    blocks: int
+    closed: bool
+    protected: bool
+    start: Tuple[int, int]
+
+    @property
+    def filename(self) -> str:
+        return self.name.decode(FILENAME_ENCODING, errors='replace')
+
+    def listing(self) -> str:
+        """
+        Formats the entry like a line of the directory listing of the Commodore 64
+        :return: Directory line with block count, quoted name and file type
+        """
+        # Control characters are shown as the equivalent PETSCII letters or symbols
+        name = bytes(c + 0x40 if c < 0x20 else c - 0x20 if 0x80 <= c < 0xa0 else c for c in self.name)
+        file_type = f'{self.file_type}<' if self.protected else self.file_type
+        closed = ' ' if self.closed else '*'
+        quoted_name = '"' + name.decode(LISTING_ENCODING, errors='replace') + '"'
+        return f'{str(self.blocks):5}{quoted_name:18}{closed}{file_type}'
+
+
+class D64Reader:
+    """
+    Read-only access to a D64 disk image. The directory track is walked once,
+    file contents are collected by following the sector chain of each file
+    """
+    def __init__(self, buffer: Union[bytes, bytearray, mmap.mmap]):
+        self.tracks = IMAGE_TRACKS.get(len(buffer))
+        if self.tracks is None:
+            raise ValueError(f'Unsupported disk image size: {len(buffer)} bytes')
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.max_blocks = TRACK_OFFSETS[self.tracks] // SECTOR_SIZE
+
+    @classmethod
+    def from_path(cls, path: Union[str, os.PathLike]) -> 'D64Reader':
+        """
+        Memory-maps a disk image
+        :param path: Path to the disk image
+        :return: Reader of the disk image
+        """
+        with open(path, 'rb') as image:
+            buffer = mmap.mmap(image.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buffer)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def sector(self, track: int, sector: int) -> memoryview:
+        if not 1 <= track <= self.tracks:
+            raise ValueError(f'Invalid track, {track}')
+        if sector >= TRACK_SECTORS[track - 1]:
+            raise ValueError(f'Invalid sector, {track}:{sector}')
+        start = TRACK_OFFSETS[track - 1] + sector * SECTOR_SIZE
+        return self.view[start:start + SECTOR_SIZE]
+
+    def chain(self, track: int, sector: int):
+        """
+        Follows a chain of linked sectors
+        :param track: Track of the first sector
+        :param sector: Number of the first sector
+        :return: Generator of the sectors
+        """
+        for _ in range(self.max_blocks):
+            block = self.sector(track, sector)
+            yield block
+            track, sector = block[0], block[1]
+            # No view is kept while the next sector is looked up, so that an invalid link does not export the image
+            del block
+            if track == 0:
+                return
+        raise ValueError('Circular sector chain')
+
+    def entries(self) -> List[DirectoryEntry]:
+        """
+        Reads all directory entries which are not deleted
+        :return: Entries in the order of the directory
+        """
+        entries = []
+        for block in self.chain(DIR_TRACK, DIR_SECTOR):
+            for offset in range(0, SECTOR_SIZE, DIR_ENTRY_SIZE):
+                raw = block[offset:offset + DIR_ENTRY_SIZE]
+                file_type = raw[2]
+                if file_type == 0:
+                    continue
+                entries.append(DirectoryEntry(name=bytes(raw[5:0x15]).rstrip(b'\xa0'),
+                                              file_type=FILE_TYPES[file_type & 7],
+                                              blocks=int.from_bytes(raw[0x1e:0x20], 'little'),
+                                              closed=bool(file_type & 0x80),
+                                              protected=bool(file_type & 0x40),
+                                              start=(raw[3], raw[4])))
+        return entries
+
+    def read_segments(self, entry: DirectoryEntry) -> List[memoryview]:
+        """
+        Collects the data of a file without copying it
+        :param entry: Directory entry of the file
+        :return: Views of the data part of every sector of the file
+        """
+        if entry.start[0] == 0:
+            raise ValueError('File without data blocks')
+        segments = []
+        for block in self.chain(*entry.start):
+            if block[0] != 0:
+                segments.append(block[2:])
+            elif block[1] == 0:
+                raise ValueError('Invalid data size')
+            else:
+                segments.append(block[2:block[1] + 1])
+        return segments
+
+    def read(self, entry: DirectoryEntry) -> Optional[bytes]:
+        """
+        Reads the content of a file
+        :param entry: Directory entry of the file
+        :return: Content of the file or None if its sector chain is broken
+        """
+        try:
+            return b''.join(self.read_segments(entry))
+        except ValueError:
+            return None
+
+    def header(self) -> str:
+        bam = self.sector(DIR_TRACK, 0)
+        name = bytes(bam[0x90:0xa0]).rstrip(b'\xa0').decode(LISTING_ENCODING, errors='replace')
+        disk_id = bytes(bam[0xa2:0xa4]).decode(LISTING_ENCODING, errors='replace')
+        dos_info = bytes((bam[0xa5], bam[2])).decode(LISTING_ENCODING, errors='replace')
+        return f'0 "{name:16}" {disk_id} {dos_info}'
+
+    def blocks_free(self) -> int:
+        bam = self.sector(DIR_TRACK, 0)
+        free = sum(bam[4 + (track - 1) * 4] for track in range(1, min(self.tracks, 35) + 1) if track != DIR_TRACK)
+        if self.tracks > 35:
+            extended = EXTENDED_BAM_OFFSET if any(bam[EXTENDED_BAM_OFFSET:EXTENDED_BAM_OFFSET + 0x14]) \
+                else ALT_EXTENDED_BAM_OFFSET
+            free += sum(bam[extended + (track - 36) * 4] for track in range(36, self.tracks + 1))
+        return free
+
+    def directory(self, entries: Optional[List[DirectoryEntry]] = None) -> List[str]:
+        """
+        Creates the directory listing of the disk image
+        :param entries: Directory entries, read from the image if not given
+        :return: Header line, one line per file and the number of free blocks
+        """
+        if entries is None:
+            entries = self.entries()
+        return [self.header(), *(entry.listing() for entry in entries), f'{self.blocks_free()} BLOCKS FREE.']
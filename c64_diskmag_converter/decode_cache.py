@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from functools import lru_cache
+from typing import Optional, Tuple
+from c64_diskmag_converter.lookup_tables import begin_trigrams, file_hash, umlaut_trigrams
+
+
+DECODE_CACHE_NAME = 'decode_cache.sqlite'
+# Default upper bound of the stored decode results in bytes
+DECODE_CACHE_SIZE = 1 << 30
+# Increase when decode_text produces different results for the same input
+DECODE_VERSION = 1
+
+
+@lru_cache(maxsize=None)
+def decode_parameters() -> bytes:
+    """
+    Digest of every input of decode_text besides the file content and the threshold
+    :return: SHA-256 digest of the decoder version and the trigram tables
+    """
+    parameters = {'decode_version': DECODE_VERSION,
+                  'beginning_trigrams': file_hash(begin_trigrams),
+                  'umlaut_trigrams': file_hash(umlaut_trigrams)}
+    return hashlib.sha256(json.dumps(parameters, sort_keys=True).encode('utf-8')).digest()
+
+
+class DecodeCache:
+    """
+    Content-addressed store of decode_text results in an SQLite database. Identical files
+    are decoded only once, no matter on which disk image they appear. The database
+    is opened in WAL mode, so that several worker processes can read and write it at once.
+    WAL mode relies on shared memory, so all processes must run on the same machine and the
+    database must not be on a network file system.
+    Entries which were not used for the longest time are evicted when the size limit is exceeded
+    """
+    def __init__(self, path: str, max_bytes: int = DECODE_CACHE_SIZE, timeout: float = 30.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS decoded ('
+                                'key BLOB PRIMARY KEY, result TEXT NOT NULL, '
+                                'size INTEGER NOT NULL, last_used REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS decoded_last_used ON decoded (last_used)')
+
+    @classmethod
+    def for_corpus(cls, corpus_path: str, max_bytes: int = DECODE_CACHE_SIZE) -> 'DecodeCache':
+        return cls(os.path.join(corpus_path, DECODE_CACHE_NAME), max_bytes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    @staticmethod
+    def key(content: bytes, char_threshold: float) -> bytes:
+        digest = hashlib.sha256(decode_parameters())
+        digest.update(repr(float(char_threshold)).encode('ascii'))
+        digest.update(content)
+        return digest.digest()
+
+    def get(self, content: bytes, char_threshold: float) -> Optional[Tuple]:
+        """
+        Looks up the decode result of a file
+        :param content: Binary content of the file
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :return: Result of decode_text or None if the file was not decoded before
+        """
+        key = self.key(content, char_threshold)
+        try:
+            row = self.connection.execute('SELECT result FROM decoded WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE decoded SET last_used = ? WHERE key = ?', (time.time(), key))
+        except sqlite3.OperationalError:
+            # A locked or unavailable cache only costs a decoding
+            return None
+        return tuple(json.loads(row[0]))
+
+    def put(self, content: bytes, char_threshold: float, result: Tuple):
+        """
+        Stores the decode result of a file
+        :param content: Binary content of the file
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :param result: Result of decode_text
+        """
+        value = json.dumps(result, ensure_ascii=False)
+        try:
+            self.connection.execute('INSERT OR REPLACE INTO decoded (key, result, size, last_used) VALUES (?, ?, ?, ?)',
+                                    (self.key(content, char_threshold), value, len(value.encode('utf-8')), time.time()))
+        except sqlite3.OperationalError:
+            pass
+
+    def size(self) -> int:
+        return self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM decoded').fetchone()[0]
+
+    def evict(self) -> int:
+        """
+        Removes the least recently used entries until the cache fits into its size limit
+        :return: Number of removed entries
+        """
+        removed = 0
+        try:
+            self.connection.execute('BEGIN IMMEDIATE')
+            try:
+                excess = self.size() - self.max_bytes
+                if excess > 0:
+                    rows = self.connection.execute('SELECT key, size FROM decoded ORDER BY last_used')
+                    keys = []
+                    for key, size in rows:
+                        if excess <= 0:
+                            break
+                        keys.append(key)
+                        excess -= size
+                    self.connection.executemany('DELETE FROM decoded WHERE key = ?', ((key,) for key in keys))
+                    removed = len(keys)
+                self.connection.execute('COMMIT')
+            except BaseException:
+                self.connection.execute('ROLLBACK')
+                raise
+        except sqlite3.OperationalError:
+            return 0
+        return removed
@@ -1,104 +1,178 @@
 from c64_diskmag_converter.text_processing import *
 from c64_diskmag_converter.xml_markup_creator import *
-from d64 import DiskImage
-import pandas as pd
-from pathlib import Path
+from c64_diskmag_converter import profiling
+from c64_diskmag_converter.archives import image_names, read_member, sibling_images, split_archive_path, tei_path_for
+from c64_diskmag_converter.d64_reader import D64Reader
+from c64_diskmag_converter.lookup_tables import load_issue_index
+from c64_diskmag_converter.metadata_index import file_record
+from c64_diskmag_converter.text_index import token_counts
+import os
 import re
+import zipfile
+from pathlib import Path
 from lxml import etree
 
-data_dir = os.path.join(os.path.dirname(__file__), 'data')
-issues = os.path.join(data_dir, 'c64_diskmag_issues.csv')
-FIND_FILETYPES = re.compile(r'\b(PRG|DEL|SEQ|USR|REL)\b')
-ISSUES = pd.read_csv(issues, encoding='utf-8')
-
 
 class DiskmagC64:
-    def __init__(self, diskmag_path: str):
+    def __init__(self, diskmag_path: str, decode_cache: Optional[DecodeCache] = None,
+                 is_partial: Optional[bool] = None, image_bytes: Optional[bytes] = None, keep_texts: bool = False,
+                 count_tokens: bool = False, part: Optional[int] = None):
         self.path = Path(diskmag_path)
-        self.image = DiskImage(self.path)
+        self.image_bytes = image_bytes
+        self.decode_cache = decode_cache
+        self.file_records = []
+        # Token counts are only needed for the full-text index, see text_index
+        self.file_tokens = [] if count_tokens else None
+        # The decoded files are only kept for the text export, see text_export
+        self.file_texts = [] if keep_texts else None
         self.filename = self.path.stem
-        self.diskmag = self.path.parent.parent.name
-        self.issue = self.path.parent.name
-        self.record = ISSUES[ISSUES['issue_normalized'] == self.issue]
+        self.archive_path = split_archive_path(diskmag_path)
+        self.diskmag, self.issue = image_names(diskmag_path)
+        self.record = load_issue_index().get(self.issue, [])
+        with profiling.stage('read_directory'):
+            self.reader = self.open_image()
+            self.entries = self.get_entries()
+            self.directory = self.get_directory()
         self.contents = self.get_contents()
-        self.directory = self.get_directory()
-        self.is_partial = self.check_d64_files_in_parent()
+        self.is_partial = self.check_d64_files_in_parent() if is_partial is None else is_partial
         if self.is_partial:
-            self.image_number = int(self.filename[-1])
+            # The catalog numbers the images of an issue, only standalone images fall back to their name
+            self.image_number = part if part is not None else self.number_from_filename()
         else:
             self.image_number = None
 
+    def number_from_filename(self) -> Optional[int]:
+        digits = re.search(r'\d+$', self.filename)
+        return int(digits.group()) if digits else None
+
     def check_d64_files_in_parent(self):
-        parent_dir = self.path.parent
-        d64_files = list(parent_dir.glob('*.d64'))
-        return len(d64_files) > 1
+        return sibling_images(str(self.path)) > 1
 
-    def get_directory(self):
+    def open_image(self):
         try:
-            with self.image as disk_image:
-                directory = []
-                for file in disk_image.directory():
-                    try:
-                        directory.append(file)
-                    except Exception as e:
-                        directory.append(None)
-                return directory
-        except (FileNotFoundError, ValueError) as e:
+            if self.image_bytes is not None:
+                return D64Reader(self.image_bytes)
+            if self.archive_path:
+                return D64Reader(read_member(*self.archive_path))
+            return D64Reader.from_path(self.path)
+        except (FileNotFoundError, KeyError, zipfile.BadZipFile, ValueError):
             return None
 
-    def get_contents(self):
-        if not self.directory:
+    def get_entries(self):
+        if not self.reader:
             return None
         try:
-            directory = self.directory[1:-1]
-            with self.image as disk_image:
-                for index, entry in enumerate(disk_image.glob(b'*')):
-                    try:
-                        filename = entry.name.decode(encoding='petscii_c64en_lc', errors='replace')
-                        directory_entry = directory[index]
-                        if not directory_entry:
-                            file_ext = 'Unknown'
-                        else:
-                            file_ext = FIND_FILETYPES.findall(directory_entry)[0]
-                        content = disk_image.path(entry.name)
-                        content = content.open().read()
-                        if file_ext == 'PRG':
-                            content = content[2:]
-                        yield filename, file_ext, content
-                    except (ValueError, AttributeError):
-                        yield filename, file_ext, None
-        except (FileNotFoundError, ValueError):
+            return self.reader.entries()
+        except ValueError:
+            pass
+        # The traceback references the sector views, the image can only be closed once it is released
+        self.reader.close()
+        return None
+
+    def get_directory(self):
+        if self.entries is None:
             return None
+        return self.reader.directory(self.entries)
+
+    def get_contents(self):
+        if not self.directory:
+            return None
+        with self.reader as disk_image:
+            for entry in self.entries:
+                with profiling.stage('read_file'):
+                    content = disk_image.read(entry)
+                if content is not None and entry.file_type == 'PRG':
+                    content = content[2:]
+                yield entry.filename, entry.file_type, content
+
+    def file_metadata(self, char_threshold: float):
+        """
+        Decodes the files of the disk image one after another
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :return: Generator of the metadata of the files including their texts
+        """
+        for index, entry in enumerate(self.contents):
+            xml_id = index + 1
+            filename, file_ext, content = entry
+            # Profiling assigns everything until the next file is requested to this file
+            with profiling.profile_file(xml_id, filename):
+                metadata = TextMetaData.from_binary(filename=filename,
+                                                    xml_id=xml_id,
+                                                    file_ext=file_ext,
+                                                    content=content,
+                                                    char_threshold=char_threshold,
+                                                    decode_cache=self.decode_cache)
+                self.file_records.append(file_record(metadata))
+                if self.file_tokens is not None:
+                    with profiling.stage('tokenize'):
+                        self.file_tokens.append(token_counts(metadata.text, metadata.col_length))
+                if self.file_texts is not None:
+                    self.file_texts.append(metadata)
+                yield metadata
+
+    def text_divs(self, char_threshold: float):
+        """
+        Creates the div elements of the TEI body one after another
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :return: Generator of the div elements of the TEI body
+        """
+        body = etree.Element('body')
+        for metadata in self.file_metadata(char_threshold):
+            # The div is serialized while the generator is suspended
+            with profiling.stage('xml'):
+                div = attach_text_div(body, metadata)
+                yield div
+                body.remove(div)
+
+    def triage(self, char_threshold: float, sample_size: Optional[int] = None) -> List[dict]:
+        """
+        Classifies the files of the disk image by entropy and encoding without decoding them
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :param sample_size: Only the first bytes of larger files are classified if given
+        :return: One classification per file
+        """
+        rows = []
+        for index, (filename, file_ext, content) in enumerate(self.contents or []):
+            row = {'xml_id': index + 1, 'filename': filename, 'extension': file_ext,
+                   'size': len(content) if content is not None else None, 'sampled': False,
+                   'entropy': None, 'filetype': 'Beschädigte Datei', 'encoding': None, 'alpha_ratio': None}
+            if content:
+                if sample_size and len(content) > sample_size:
+                    content = content[:sample_size]
+                    row['sampled'] = True
+                entropy, filetype, encoding, alpha_ratio = classify_binary(content, char_threshold)
+                row.update(entropy=entropy, filetype=filetype, alpha_ratio=alpha_ratio,
+                           encoding=ENCODING_MAPPING[encoding][1] if encoding is not None else None)
+            rows.append(row)
+        return rows
+
+    def write_tei_file(self, xml_file: BinaryIO, char_threshold: float) -> List[Tuple[int, int]]:
+        """
+        Writes the TEI document of the disk image
+        :param xml_file: File or buffer opened in binary mode
+        :param char_threshold: Minimal proportion of alphabetic characters for text files
+        :return: Start and end byte offsets of the div of every file
+        """
+        with profiling.stage('xml_header'):
+            root = etree.Element('TEI', xmlns=TEI_NAMESPACE)
+            header = attach_header(root, self.image_number, self.diskmag, self.issue, 'Tomash Shtohryn', self.record)
+            text_elem = etree.SubElement(root, 'text')
+            front = attach_front(text_elem, self.directory)
+        return write_tei(xml_file, header, front, self.text_divs(char_threshold))
 
     def convert_to_tei(self, char_threshold: float):
-        tei_path = self.path.parent / f'{self.filename}.xml'
+        tei_path = Path(tei_path_for(str(self.path)))
         if not self.directory:
             return f'Error while creating tei file {tei_path}'
+        tmp_path = tei_path.with_name(f'.{tei_path.name}.tmp')
         try:
-            with open(tei_path, 'wb') as xml_file:
-                root = etree.Element('TEI', xmlns='http://www.tei-c.org/ns/1.0')
-                attach_header(root, self.image_number, self.diskmag, self.issue, 'Tomash Shtohryn', self.record)
-                text_elem = etree.SubElement(root, 'text')
-                attach_front(text_elem, self.directory)
-                body = etree.SubElement(text_elem, 'body')
-                for index, entry in enumerate(self.contents):
-                    xml_id = index + 1
-                    filename, file_ext, content = entry
-                    metadata = TextMetaData.from_binary(filename=filename,
-                                                        xml_id=xml_id,
-                                                        file_ext=file_ext,
-                                                        content=content,
-                                                        char_threshold=char_threshold)
-                    attach_text_div(body, metadata)
-                tree = etree.ElementTree(root)
-                etree.indent(tree)
-                xml_content = etree.tostring(tree,
-                                             pretty_print=True,
-                                             xml_declaration=True,
-                                             encoding='UTF-8',
-                                             method='xml')
-                xml_file.write(xml_content)
+            tei_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp_path, 'wb') as xml_file:
+                offsets = self.write_tei_file(xml_file, char_threshold)
+            os.replace(tmp_path, tei_path)
+            for record, (start, end) in zip(self.file_records, offsets):
+                record.update(magazine=self.diskmag, issue=self.issue, div_start=start, div_end=end)
         except Exception as e:
-            print(e, tei_path)
-            os.remove(tei_path)
+            if tmp_path.exists():
+                os.remove(tmp_path)
             return f'Error accessing disk image: {str(e)}'
@@ -0,0 +1,152 @@
+import csv
+import hashlib
+import os
+import pickle
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+
+data_dir = os.path.join(os.path.dirname(__file__), 'data')
+# Tables built with trigram_builder, e.g. for other languages, can replace the included tables
+begin_trigrams = os.environ.get('C64_DISKMAG_BEGINNING_TRIGRAMS', os.path.join(data_dir, 'beginning_trigrams.csv'))
+umlaut_trigrams = os.environ.get('C64_DISKMAG_UMLAUT_TRIGRAMS', os.path.join(data_dir, 'umlaut_trigrams.csv'))
+issues = os.path.join(data_dir, 'c64_diskmag_issues.csv')
+CACHE_DIR = os.environ.get('C64_DISKMAG_CACHE',
+                           os.path.join(os.path.expanduser('~'), '.cache', 'c64_diskmag_converter'))
+# Increase when the compiled form of the tables changes
+CACHE_FORMAT = 2
+# Strings which pandas.read_csv reads as missing values. The tables were read with pandas
+# before, so rows like the trigram 'nan' were never looked up and are skipped as well
+PANDAS_NA_VALUES = frozenset(['', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+                              '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null'])
+
+
+@dataclass
+class TrigramTable:
+    lookup: Dict[str, float]
+    keys: np.ndarray
+    logprobs: np.ndarray
+
+
+def file_hash(path: str) -> str:
+    """
+    Computes the SHA-256 hash of a file
+    :param path: Path to the file
+    :return: Hexadecimal digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pack_trigrams(first: np.ndarray, second: np.ndarray, third: np.ndarray) -> np.ndarray:
+    """
+    Packs the code points of trigrams into single integers
+    :param first: Code points of the first characters
+    :param second: Code points of the second characters
+    :param third: Code points of the third characters
+    :return: One key per trigram
+    """
+    return (first.astype(np.int64) << 42) | (second.astype(np.int64) << 21) | third.astype(np.int64)
+
+
+def read_trigram_binary(npz_path: str) -> TrigramTable:
+    """
+    Reads a trigram table in the binary form written by trigram_builder
+    :param npz_path: npz file with sorted packed trigram keys and their frequencies
+    :return: Compiled trigram table
+    """
+    with np.load(npz_path, allow_pickle=False) as data:
+        keys = data['keys']
+        frequencies = data['frequencies']
+    percentages = frequencies / frequencies.sum() if len(frequencies) else frequencies.astype(np.float64)
+    mask = (1 << 21) - 1
+    trigrams = [chr(first) + chr(second) + chr(third)
+                for first, second, third in zip((keys >> 42).tolist(), ((keys >> 21) & mask).tolist(),
+                                                (keys & mask).tolist())]
+    # Skipped like in the CSV form of the table, see compile_trigram_table
+    kept = np.array([trigram not in PANDAS_NA_VALUES for trigram in trigrams], dtype=bool)
+    lookup = {trigram: prob for trigram, prob in zip(trigrams, percentages.tolist()) if trigram not in PANDAS_NA_VALUES}
+    logprobs = np.array([np.log(prob) if prob else -100 for prob in percentages[kept].tolist()], dtype=np.float64)
+    return TrigramTable(lookup=lookup, keys=keys[kept], logprobs=logprobs)
+
+
+def compile_trigram_table(csv_path: str) -> TrigramTable:
+    """
+    Reads a trigram table and precomputes sorted trigram keys and log-probabilities
+    :param csv_path: CSV file with the columns trigram, frequency and percentage, or the binary form of the table
+    :return: Compiled trigram table
+    """
+    if csv_path.endswith('.npz'):
+        return read_trigram_binary(csv_path)
+    with open(csv_path, encoding='utf-8', newline='') as csv_file:
+        lookup = {row['trigram']: float(row['percentage']) for row in csv.DictReader(csv_file)
+                  if row['trigram'] not in PANDAS_NA_VALUES}
+    trigrams = [(trigram, prob) for trigram, prob in lookup.items() if len(trigram) == 3]
+    codes = np.array([[ord(c) for c in trigram] for trigram, _ in trigrams], dtype=np.int64).reshape(-1, 3)
+    keys = pack_trigrams(codes[:, 0], codes[:, 1], codes[:, 2])
+    logprobs = np.array([np.log(prob) if prob else -100 for _, prob in trigrams], dtype=np.float64)
+    order = np.argsort(keys, kind='stable')
+    return TrigramTable(lookup=lookup, keys=keys[order], logprobs=logprobs[order])
+
+
+def compile_issue_index(csv_path: str) -> Dict[str, List[Dict[str, Optional[str]]]]:
+    """
+    Groups the issue metadata by the normalized issue name
+    :param csv_path: CSV file with the issue metadata
+    :return: Metadata rows per normalized issue name, empty fields are None
+    """
+    index = {}
+    with open(csv_path, encoding='utf-8', newline='') as csv_file:
+        for row in csv.DictReader(csv_file):
+            row = {key: value if value else None for key, value in row.items()}
+            if row['issue_normalized']:
+                index.setdefault(row['issue_normalized'], []).append(row)
+    return index
+
+
+def load_compiled(csv_path: str, compile_table: Callable):
+    """
+    Loads the compiled form of a table from the cache, the table is compiled
+    and cached if the CSV file changed or was never compiled before
+    :param csv_path: Path to the CSV file
+    :param compile_table: Function which compiles the CSV file
+    :return: Compiled table
+    """
+    name = os.path.splitext(os.path.basename(csv_path))[0]
+    cache_path = os.path.join(CACHE_DIR, f'{name}-{CACHE_FORMAT}-{file_hash(csv_path)[:16]}.pickle')
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            return pickle.load(cache_file)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        pass
+
+    table = compile_table(csv_path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = f'{cache_path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as cache_file:
+            pickle.dump(table, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except OSError:
+        pass
+    return table
+
+
+@lru_cache(maxsize=None)
+def load_beginning_trigrams() -> TrigramTable:
+    return load_compiled(begin_trigrams, compile_trigram_table)
+
+
+@lru_cache(maxsize=None)
+def load_umlaut_trigrams() -> TrigramTable:
+    return load_compiled(umlaut_trigrams, compile_trigram_table)
+
+
+@lru_cache(maxsize=None)
+def load_issue_index() -> Dict[str, List[Dict[str, Optional[str]]]]:
+    return load_compiled(issues, compile_issue_index)
@@ -0,0 +1,155 @@
+import json
+import os
+import re
+from typing import Dict, List, Optional, Tuple
+from c64_diskmag_converter.archives import image_hash, image_stat, tei_path_for
+from c64_diskmag_converter.catalog import CorpusCatalog
+from c64_diskmag_converter.lookup_tables import begin_trigrams, file_hash, issues, umlaut_trigrams
+
+
+CONVERTER_VERSION = '0.4'
+MANIFEST_NAME = 'conversion_manifest.jsonl'
+LOOKUP_TABLES = {'beginning_trigrams': begin_trigrams,
+                 'umlaut_trigrams': umlaut_trigrams,
+                 'issues': issues}
+
+
+def shard_name(name: str, shard: Optional[Tuple[int, int]] = None) -> str:
+    """
+    Names the file which belongs to one shard of a distributed conversion
+    :param name: Name of the file for the whole corpus
+    :param shard: Index and total number of shards
+    :return: Name of the file of the shard
+    """
+    if shard is None:
+        return name
+    index, count = shard
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.shard-{index}-of-{count}{ext}'
+
+
+def shard_counts(directory: str, name: str) -> List[int]:
+    """
+    Finds the shard counts of the files which were written by the shards of distributed conversions
+    :param directory: Directory of the shard files, usually the corpus root
+    :param name: Name of the file for the whole corpus
+    :return: Sorted total numbers of shards, e.g. [4] if the shards 0 to 3 of 4 wrote files
+    """
+    stem, ext = os.path.splitext(name)
+    pattern = re.compile(rf'{re.escape(stem)}\.shard-\d+-of-(\d+){re.escape(ext)}')
+    counts = set()
+    for entry in os.listdir(directory):
+        match = pattern.fullmatch(entry)
+        if match:
+            counts.add(int(match.group(1)))
+    return sorted(counts)
+
+
+def manifest_name(shard: Optional[Tuple[int, int]] = None) -> str:
+    return shard_name(MANIFEST_NAME, shard)
+
+
+class ConversionManifest:
+    """
+    Append-only record of the disk images which were converted successfully,
+    together with every input that determines the content of the TEI file.
+    Each finished image is appended as one JSON line, so an interrupted run
+    keeps all images converted before the interruption. Every shard of a
+    distributed conversion keeps its own manifest. If a catalog is given, the
+    position of every image within its issue is recorded as well, because it
+    determines the part number in the TEI header.
+    """
+    def __init__(self, corpus_path: str, char_threshold: float, shard: Optional[Tuple[int, int]] = None,
+                 catalog: Optional[CorpusCatalog] = None):
+        self.corpus_path = corpus_path
+        self.catalog = catalog
+        self.path = os.path.join(corpus_path, manifest_name(shard))
+        self.parameters = {'converter_version': CONVERTER_VERSION,
+                           'char_threshold': char_threshold,
+                           'lookup_tables': {name: file_hash(path) for name, path in LOOKUP_TABLES.items()}}
+        self.entries = self.load()
+        self.fingerprints = {}
+
+    def load(self) -> Dict[str, dict]:
+        entries = {}
+        if not os.path.exists(self.path):
+            return entries
+        with open(self.path, 'r', encoding='utf-8') as manifest:
+            for line in manifest:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A line truncated by an interrupted run
+                    continue
+                entries[entry['image']] = entry
+        return entries
+
+    def key(self, disk_image: str) -> str:
+        return os.path.relpath(disk_image, self.corpus_path).replace(os.sep, '/')
+
+    def fingerprint(self, disk_image: str) -> dict:
+        """
+        Returns size, modification time and content hash of a disk image.
+        The hash of the previous run is reused if size and modification time are unchanged
+        :param disk_image: Path to the disk image
+        :return: Fingerprint of the disk image
+        """
+        if disk_image in self.fingerprints:
+            return self.fingerprints[disk_image]
+        size, mtime_ns = image_stat(disk_image)
+        previous = self.entries.get(self.key(disk_image))
+        if previous and previous['size'] == size and previous['mtime_ns'] == mtime_ns:
+            sha256 = previous['sha256']
+        else:
+            sha256 = image_hash(disk_image)
+        fingerprint = {'size': size, 'mtime_ns': mtime_ns, 'sha256': sha256}
+        self.fingerprints[disk_image] = fingerprint
+        return fingerprint
+
+    def position(self, disk_image: str) -> dict:
+        """
+        Looks up whether a disk image is one of several images of its issue and its part number
+        :param disk_image: Path to the disk image
+        :return: is_partial and part of the catalog, empty if no catalog is given
+        """
+        if self.catalog is None:
+            return {}
+        image = self.catalog.by_path.get(disk_image)
+        if image is None:
+            return {}
+        return {'is_partial': image.is_partial, 'part': image.part}
+
+    def is_current(self, disk_image: str) -> bool:
+        """
+        Checks whether the TEI file of a disk image was created from the same inputs
+        :param disk_image: Path to the disk image
+        :return: True if the disk image does not need to be converted again
+        """
+        entry: Optional[dict] = self.entries.get(self.key(disk_image))
+        if not entry or not os.path.exists(tei_path_for(disk_image)):
+            return False
+        # Adding or removing an image of the issue changes the part numbers of the other images
+        position = self.position(disk_image)
+        return (entry['sha256'] == self.fingerprint(disk_image)['sha256']
+                and entry['parameters'] == self.parameters
+                and all(entry.get(name) == value for name, value in position.items()))
+
+    def record(self, disk_image: str):
+        entry = {'image': self.key(disk_image), **self.fingerprint(disk_image), **self.position(disk_image),
+                 'parameters': self.parameters}
+        self.entries[entry['image']] = entry
+        with open(self.path, 'a', encoding='utf-8') as manifest:
+            manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+
+    def compact(self, disk_images: list):
+        """
+        Rewrites the manifest with one line per existing disk image
+        :param disk_images: Disk images which are currently part of the corpus
+        """
+        keys = {self.key(disk_image) for disk_image in disk_images}
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as manifest:
+            for key, entry in sorted(self.entries.items()):
+                if key in keys:
+                    manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,230 @@
+import json
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from c64_diskmag_converter.manifest import shard_name
+from c64_diskmag_converter.text_processing import TextMetaData
+
+
+METADATA_INDEX_NAME = 'metadata_index.npz'
+# Columns of the index with their data types, missing numbers are stored as NaN or -1
+COLUMNS = {'magazine': str,
+           'issue': str,
+           'image': str,
+           'filename': str,
+           'xml_id': np.int32,
+           'extension': str,
+           'filetype': str,
+           'entropy': np.float64,
+           'encoding': str,
+           'line_length': np.int32,
+           'umlaut_mapping': str,
+           'text_chars': np.int64,
+           'div_start': np.int64,
+           'div_end': np.int64}
+MISSING = {np.float64: np.nan, np.int32: -1, np.int64: -1, str: ''}
+# Rows of the images converted since the index was last saved, next to the npz file
+JOURNAL_SUFFIX = '.journal.jsonl'
+
+
+def index_name(shard: Optional[Tuple[int, int]] = None) -> str:
+    return shard_name(METADATA_INDEX_NAME, shard)
+
+
+def journal_path(path: str) -> str:
+    return f'{os.path.splitext(path)[0]}{JOURNAL_SUFFIX}'
+
+
+def file_record(metadata: TextMetaData) -> dict:
+    """
+    Collects the metadata of an extracted file which is stored in the index
+    :param metadata: Decoded file
+    :return: Row of the index without the disk image columns and the byte offsets
+    """
+    return {'filename': metadata.filename,
+            'xml_id': metadata.xml_id,
+            'extension': metadata.file_ext,
+            'filetype': metadata.filetype,
+            'entropy': metadata.entropy,
+            'encoding': metadata.encoding,
+            'line_length': metadata.col_length,
+            'umlaut_mapping': json.dumps(metadata.mapping, ensure_ascii=False) if metadata.mapping else None,
+            'text_chars': len(metadata.text) if metadata.text else None}
+
+
+class MetadataIndex:
+    """
+    Columnar index with one row per file extracted from the disk images of a corpus.
+    The columns are numpy arrays, which are stored together in a single npz file,
+    so that corpus statistics do not require parsing the TEI files. The byte offsets
+    point to the div element of the file in the TEI document of its disk image.
+    The npz file is only rewritten at the end of a conversion, the rows of every image
+    converted before are appended to a journal, so an interrupted run keeps them
+    """
+    def __init__(self, columns: Optional[Dict[str, np.ndarray]] = None):
+        if columns is None:
+            columns = self.from_records([]).columns
+        self.columns = columns
+
+    @classmethod
+    def from_records(cls, records: Iterable[dict]) -> 'MetadataIndex':
+        records = list(records)
+        columns = {}
+        for name, dtype in COLUMNS.items():
+            values = [MISSING[dtype] if record.get(name) is None else record[name] for record in records]
+            columns[name] = np.array(values, dtype=dtype)
+        return cls(columns)
+
+    @classmethod
+    def load(cls, path: str) -> 'MetadataIndex':
+        """
+        Reads an index together with the rows of its journal, an empty index is used
+        if the file is missing or has other columns
+        :param path: Path to the npz file
+        :return: Metadata index
+        """
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                index = cls({name: data[name] for name in COLUMNS})
+        except (OSError, KeyError, ValueError):
+            index = cls()
+        journal = cls.read_journal(path)
+        if journal:
+            index = index.replace_images(journal, index.images)
+        return index
+
+    @staticmethod
+    def read_journal(path: str) -> Dict[str, List[dict]]:
+        records = {}
+        try:
+            with open(journal_path(path), encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line truncated by an interrupted run
+                        continue
+                    records[entry['image']] = entry['records']
+        except OSError:
+            pass
+        return records
+
+    @staticmethod
+    def append(path: str, image: str, records: List[dict]):
+        """
+        Appends the rows of a converted disk image to the journal of an index
+        :param path: Path to the npz file
+        :param image: Path of the disk image relative to the corpus root
+        :param records: Rows of the disk image
+        """
+        with open(journal_path(path), 'a', encoding='utf-8') as journal:
+            journal.write(json.dumps({'image': image, 'records': records}, ensure_ascii=False) + '\n')
+
+    def save(self, path: str):
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as index_file:
+            np.savez(index_file, **self.columns)
+        os.replace(tmp_path, path)
+        # The journaled rows are part of the saved index now
+        if os.path.exists(journal_path(path)):
+            os.remove(journal_path(path))
+
+    @classmethod
+    def merge(cls, indexes: Iterable['MetadataIndex']) -> 'MetadataIndex':
+        """
+        Combines the indexes of the shards of a distributed conversion
+        :param indexes: Indexes of disjoint sets of disk images
+        :return: Index of all disk images
+        """
+        indexes = list(indexes)
+        if not indexes:
+            return cls()
+        columns = {name: np.concatenate([index.columns[name] for index in indexes]) for name in COLUMNS}
+        order = np.lexsort((columns['xml_id'], columns['image']))
+        return cls({name: column[order] for name, column in columns.items()})
+
+    def __len__(self) -> int:
+        return len(self.columns['image'])
+
+    @property
+    def images(self) -> set:
+        return set(np.unique(self.columns['image']).tolist())
+
+    def replace_images(self, records: Dict[str, List[dict]], keep: Iterable[str]) -> 'MetadataIndex':
+        """
+        Creates a new index in which the rows of some disk images are replaced
+        :param records: New rows per disk image
+        :param keep: Disk images whose rows are kept unless they are replaced
+        :return: Updated index
+        """
+        keep = set(keep) - set(records)
+        kept = np.isin(self.columns['image'], list(keep))
+        new = self.from_records(record for image_records in records.values() for record in image_records)
+        columns = {name: np.concatenate([self.columns[name][kept], new.columns[name]]) for name in COLUMNS}
+        order = np.lexsort((columns['xml_id'], columns['image']))
+        return MetadataIndex({name: column[order] for name, column in columns.items()})
+
+    def mask(self, **conditions) -> np.ndarray:
+        """
+        Selects the rows which fulfil all conditions. A condition is either a value,
+        a list or set of values or a function which is applied to the column
+        :param conditions: Conditions per column, e.g. filetype='Textdokument' or entropy=lambda e: e > 6
+        :return: Boolean mask of the rows
+        """
+        selected = np.ones(len(self), dtype=bool)
+        for name, condition in conditions.items():
+            column = self.columns[name]
+            if callable(condition):
+                selected &= np.asarray(condition(column), dtype=bool)
+            elif isinstance(condition, (list, tuple, set, frozenset)):
+                selected &= np.isin(column, list(condition))
+            else:
+                selected &= column == condition
+        return selected
+
+    def select(self, columns: Optional[List[str]] = None, **conditions) -> List[dict]:
+        """
+        Returns the rows which fulfil all conditions
+        :param columns: Columns of the returned rows, all columns if not given
+        :param conditions: Conditions per column, see mask
+        :return: One dictionary per row, missing values are None
+        """
+        columns = columns or list(COLUMNS)
+        selected = self.mask(**conditions)
+        values = {name: self.columns[name][selected].tolist() for name in columns}
+        missing = {name: MISSING[COLUMNS[name]] for name in columns}
+        return [{name: None if self._is_missing(values[name][row], missing[name]) else values[name][row]
+                 for name in columns}
+                for row in range(int(selected.sum()))]
+
+    @staticmethod
+    def _is_missing(value, missing) -> bool:
+        if isinstance(missing, float):
+            return value != value
+        return value == missing
+
+    def value_counts(self, column: str, **conditions) -> Dict[str, int]:
+        """
+        Counts the values of a column in the rows which fulfil all conditions
+        :param column: Column which is counted
+        :param conditions: Conditions per column, see mask
+        :return: Number of rows per value, most frequent first
+        """
+        values, counts = np.unique(self.columns[column][self.mask(**conditions)], return_counts=True)
+        order = np.argsort(-counts, kind='stable')
+        return {values[i].item(): int(counts[i]) for i in order}
+
+    def aggregate(self, column: str, by: str, function: Callable = np.mean, **conditions) -> Dict[str, float]:
+        """
+        Aggregates a numeric column per value of another column, missing values are ignored
+        :param column: Numeric column, e.g. entropy
+        :param by: Column which is grouped by, e.g. magazine
+        :param function: Aggregation function applied to the values of every group
+        :param conditions: Conditions per column, see mask
+        :return: Aggregated value per group
+        """
+        selected = self.mask(**conditions)
+        values = self.columns[column][selected]
+        valid = ~np.isnan(values) if values.dtype.kind == 'f' else values != MISSING[COLUMNS[column]]
+        groups = self.columns[by][selected]
+        return {group.item(): float(function(values[valid & (groups == group)])) for group in np.unique(groups[valid])}
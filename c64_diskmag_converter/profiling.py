@@ -0,0 +1,136 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, List, Optional
+
+
+NULL_CONTEXT = nullcontext()
+_recorder: Optional['StatsRecorder'] = None
+
+
+class StatsRecorder:
+    """
+    Collects wall time and call counts per conversion stage together with size measures.
+    Stages and measures are assigned to the file which is currently decoded,
+    or to the disk image if no file is being decoded
+    """
+    def __init__(self, image: str):
+        self.image = {'image': image, 'seconds': 0.0, 'stages': {}, 'measures': {}, 'files': []}
+        self.file: Optional[dict] = None
+
+    def target(self) -> dict:
+        return self.file if self.file is not None else self.image
+
+    def add_time(self, name: str, seconds: float):
+        stats = self.target()['stages'].setdefault(name, {'calls': 0, 'seconds': 0.0})
+        stats['calls'] += 1
+        stats['seconds'] += seconds
+
+    def add_measure(self, name: str, value: float):
+        measures = self.target()['measures']
+        measures[name] = measures.get(name, 0) + value
+
+
+class Stage:
+    __slots__ = ('recorder', 'name', 'start')
+
+    def __init__(self, recorder: StatsRecorder, name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.recorder.add_time(self.name, time.perf_counter() - self.start)
+
+
+def enabled() -> bool:
+    return _recorder is not None
+
+
+def stage(name: str):
+    """
+    Times a conversion stage, does nothing if profiling is disabled
+    :param name: Name of the stage
+    :return: Context manager
+    """
+    if _recorder is None:
+        return NULL_CONTEXT
+    return Stage(_recorder, name)
+
+
+def measure(name: str, value: float):
+    """
+    Adds a size measure to the current file or disk image, does nothing if profiling is disabled
+    :param name: Name of the measure
+    :param value: Value which is added to the measure
+    """
+    if _recorder is not None:
+        _recorder.add_measure(name, value)
+
+
+@contextmanager
+def profile_image(image: str):
+    """
+    Enables profiling for the conversion of a disk image
+    :param image: Path to the disk image
+    :return: Context manager yielding the statistics of the disk image
+    """
+    global _recorder
+    previous = _recorder
+    _recorder = StatsRecorder(image)
+    start = time.perf_counter()
+    try:
+        yield _recorder.image
+    finally:
+        _recorder.image['seconds'] = time.perf_counter() - start
+        _recorder = previous
+
+
+@contextmanager
+def _profile_file(xml_id: int, filename: str):
+    file_stats = {'xml_id': xml_id, 'filename': filename, 'seconds': 0.0, 'stages': {}, 'measures': {}}
+    _recorder.file = file_stats
+    start = time.perf_counter()
+    try:
+        yield file_stats
+    finally:
+        file_stats['seconds'] = time.perf_counter() - start
+        _recorder.image['files'].append(file_stats)
+        _recorder.file = None
+
+
+def profile_file(xml_id: int, filename: str):
+    """
+    Assigns the following stages and measures to a file of the disk image
+    :param xml_id: Number of the file in the TEI document
+    :param filename: Name of the file
+    :return: Context manager
+    """
+    if _recorder is None:
+        return NULL_CONTEXT
+    return _profile_file(xml_id, filename)
+
+
+def aggregate(images: List[dict]) -> Dict[str, dict]:
+    """
+    Sums up stages and measures of several disk images, including their files
+    :param images: Statistics of the disk images
+    :return: Totals per stage and measure
+    """
+    stages = {}
+    measures = {}
+    for image in images:
+        for stats in (image, *image['files']):
+            for name, timing in stats['stages'].items():
+                total = stages.setdefault(name, {'calls': 0, 'seconds': 0.0})
+                total['calls'] += timing['calls']
+                total['seconds'] += timing['seconds']
+            for name, value in stats['measures'].items():
+                measures[name] = measures.get(name, 0) + value
+    return {'images': len(images),
+            'files': sum(len(image['files']) for image in images),
+            'seconds': sum(image['seconds'] for image in images),
+            'stages': stages,
+            'measures': measures}
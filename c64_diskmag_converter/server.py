@@ -0,0 +1,199 @@
+import io
+import json
+import multiprocessing
+import os
+import socketserver
+import threading
+from dataclasses import asdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+from c64_diskmag_converter.diskmag import DiskmagC64
+from c64_diskmag_converter.lookup_tables import load_beginning_trigrams, load_issue_index, load_umlaut_trigrams
+
+
+DEFAULT_PORT = 8064
+# Largest request body, D64 images with error bytes have 197376 bytes
+MAX_BODY_SIZE = 1 << 20
+OUTPUT_FORMATS = {'tei': 'application/xml', 'metadata': 'application/json'}
+
+
+def warm_up():
+    """
+    Loads the lookup tables once per worker process, so that requests only pay for the conversion
+    """
+    load_beginning_trigrams()
+    load_umlaut_trigrams()
+    load_issue_index()
+
+
+def handle_conversion(disk_image: str, image_bytes: Optional[bytes], char_threshold: float,
+                      output_format: str, is_partial: Optional[bool]) -> Tuple[int, str, bytes]:
+    """
+    Converts a disk image in a worker process
+    :param disk_image: Path to the disk image, which names magazine, issue and image if the content is given
+    :param image_bytes: Content of the disk image, read from the path if not given
+    :param char_threshold: Minimal proportion of alphabetic characters for text files
+    :param output_format: tei for the TEI document, metadata for the metadata and texts of the files as JSON
+    :param is_partial: Whether the disk image is one of several images of an issue, looked up if not given
+    :return: HTTP status, content type and body of the response
+    """
+    try:
+        diskmag = DiskmagC64(disk_image, is_partial=is_partial, image_bytes=image_bytes)
+        if not diskmag.directory:
+            return 422, 'text/plain', f'Error reading the directory of {diskmag.path.name}'.encode('utf-8')
+        if output_format == 'tei':
+            if not diskmag.record:
+                # The TEI header is filled from the issue index
+                return 422, 'text/plain', f'Issue {diskmag.issue} is not part of the issue index'.encode('utf-8')
+            buffer = io.BytesIO()
+            diskmag.write_tei_file(buffer, char_threshold)
+            return 200, OUTPUT_FORMATS['tei'], buffer.getvalue()
+        files = [asdict(metadata) for metadata in diskmag.file_metadata(char_threshold)]
+        body = {'magazine': diskmag.diskmag, 'issue': diskmag.issue, 'image': diskmag.filename,
+                'directory': diskmag.directory, 'files': files}
+        return 200, OUTPUT_FORMATS['metadata'], json.dumps(body, ensure_ascii=False).encode('utf-8')
+    except Exception as e:
+        return 500, 'text/plain', f'Error accessing disk image: {str(e)}'.encode('utf-8')
+
+
+class ConversionService:
+    """
+    Pool of worker processes which are started once and keep the lookup tables loaded.
+    At most workers requests are converted at once, up to queue_size further requests
+    wait for a free worker and any request beyond is rejected. A request which timed out
+    keeps its slot until its conversion is finished
+    """
+    def __init__(self, workers: int = 1, queue_size: int = 16, char_threshold: float = 0.4,
+                 timeout: Optional[float] = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.char_threshold = char_threshold
+        self.timeout = timeout
+        self.pool = multiprocessing.Pool(processes=workers, initializer=warm_up)
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+        self.lock = threading.Lock()
+        self.active = 0
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def status(self) -> dict:
+        return {'workers': self.workers, 'queue_size': self.queue_size, 'requests': self.active,
+                'char_threshold': self.char_threshold}
+
+    def convert(self, disk_image: str, image_bytes: Optional[bytes] = None, char_threshold: Optional[float] = None,
+                output_format: str = 'tei', is_partial: Optional[bool] = None) -> Tuple[int, str, bytes]:
+        """
+        Converts a disk image in one of the worker processes
+        :param disk_image: Path to the disk image, see handle_conversion
+        :param image_bytes: Content of the disk image, read from the path if not given
+        :param char_threshold: Minimal proportion of alphabetic characters, the threshold of the service if not given
+        :param output_format: tei or metadata
+        :param is_partial: Whether the disk image is one of several images of an issue, looked up if not given
+        :return: HTTP status, content type and body of the response
+        """
+        if not self.slots.acquire(blocking=False):
+            return 503, 'text/plain', b'Too many requests, try again later'
+        with self.lock:
+            self.active += 1
+        threshold = self.char_threshold if char_threshold is None else char_threshold
+        try:
+            # The slot is held until the worker is done, even if the request timed out before
+            result = self.pool.apply_async(handle_conversion,
+                                           (disk_image, image_bytes, threshold, output_format, is_partial),
+                                           callback=self.release, error_callback=self.release)
+        except Exception:
+            self.release()
+            raise
+        try:
+            return result.get(self.timeout)
+        except multiprocessing.TimeoutError:
+            return 504, 'text/plain', b'Conversion timed out'
+
+    def release(self, _=None):
+        with self.lock:
+            self.active -= 1
+        self.slots.release()
+
+
+class ConversionRequestHandler(BaseHTTPRequestHandler):
+    """
+    GET /status reports the state of the service. POST /convert converts a disk image, which is either
+    given by the path parameter or sent as request body. The parameters format (tei or metadata),
+    threshold and partial select the output, magazine, issue and name describe a sent disk image
+    """
+    server_version = 'c64-diskmag-converter'
+
+    def address_string(self) -> str:
+        # Clients of a Unix socket have no address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def respond(self, status: int, content_type: str, body: bytes):
+        self.send_response(status)
+        self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if urlparse(self.path).path != '/status':
+            return self.respond(404, 'text/plain', b'Not found')
+        self.respond(200, 'application/json', json.dumps(self.server.service.status()).encode('utf-8'))
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/convert':
+            return self.respond(404, 'text/plain', b'Not found')
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        output_format = params.get('format', 'tei')
+        if output_format not in OUTPUT_FORMATS:
+            return self.respond(400, 'text/plain', f'Unknown format {output_format}'.encode('utf-8'))
+        try:
+            char_threshold = float(params['threshold']) if 'threshold' in params else None
+        except ValueError:
+            return self.respond(400, 'text/plain', b'Invalid threshold')
+        is_partial = params['partial'] in ('1', 'true', 'yes') if 'partial' in params else None
+
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > MAX_BODY_SIZE:
+            return self.respond(413, 'text/plain', b'Disk image too large')
+        image_bytes = self.rfile.read(length) if length else None
+        if 'path' in params:
+            disk_image = params['path']
+            image_bytes = None
+        elif image_bytes:
+            # The names of magazine, issue and image are taken from a virtual path
+            disk_image = str(Path(params.get('magazine', 'unknown'), params.get('issue', 'unknown'),
+                                  params.get('name', 'image') + '.d64'))
+            is_partial = bool(is_partial)
+        else:
+            return self.respond(400, 'text/plain', b'Either the path parameter or a disk image is required')
+        self.respond(*self.server.service.convert(disk_image, image_bytes, char_threshold, output_format, is_partial))
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def create_server(service: ConversionService, host: str = '127.0.0.1', port: int = DEFAULT_PORT,
+                  socket_path: Optional[str] = None):
+    """
+    Creates an HTTP server on localhost or on a Unix socket
+    :param service: Conversion service handling the requests
+    :param host: Host name of the TCP server
+    :param port: Port of the TCP server
+    :param socket_path: Path to a Unix socket, used instead of TCP if given
+    :return: Server, which is started with serve_forever
+    """
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = ThreadingUnixHTTPServer(socket_path, ConversionRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ConversionRequestHandler)
+        server.daemon_threads = True
+    server.service = service
+    return server
@@ -1,8 +1,11 @@
-from setuptools import setup, find_packages
+from setuptools import setup
 
 setup(
     name='c64_diskmag_converter',
     version='0.1',
-    packages=find_packages(),
+    # This file lives inside the package directory, so the package is mapped onto it explicitly
+    packages=['c64_diskmag_converter'],
+    package_dir={'c64_diskmag_converter': '.'},
     package_data={'c64_diskmag_converter': ['data/*.csv']},
+    entry_points={'console_scripts': ['c64-diskmag-converter = c64_diskmag_converter.cli:main']},
 )
\ No newline at end of file
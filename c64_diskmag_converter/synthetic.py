@@ -0,0 +1,205 @@
+import os
+import random
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from c64_diskmag_converter.d64_reader import DIR_TRACK, SECTOR_SIZE, TRACK_OFFSETS, TRACK_SECTORS
+
+
+DIR_ENTRIES_PER_SECTOR = SECTOR_SIZE // 0x20
+FILE_TYPE_CODES = {'DEL': 0, 'SEQ': 1, 'PRG': 2, 'USR': 3, 'REL': 4}
+VOCABULARY = ('der die das und ist nicht ein eine wir ihr sie auch noch schon aber oder wenn dann '
+              'Spiel Spiele Programm Programme Diskette Magazin Ausgabe Artikel Leser Redaktion Szene '
+              'Demo Gruppe Grafik Musik Computer Commodore Monat Brief Zuschrift Neuigkeiten Test '
+              'schreiben lesen spielen testen finden machen haben werden gehen wissen '
+              'über für größer schön natürlich möchten gefällt nächste Grüße außerdem wünscht '
+              'Übersicht Lösung Fußball hören Schlüssel Tür Bücher fünf Größe müssen dürfen').split()
+# Graphic PETSCII characters used by diskmags as replacements for umlauts
+CUSTOM_UMLAUT_BYTES = {'ä': 0xba, 'ö': 0x7b, 'ü': 0x7d, 'ß': 0x7e, 'Ä': 0xa1, 'Ö': 0xa2, 'Ü': 0xa3}
+TRANSLITERATION = str.maketrans({'ä': 'ae', 'ö': 'oe', 'ü': 'ue', 'Ä': 'Ae', 'Ö': 'Oe', 'Ü': 'Ue', 'ß': 'ss'})
+
+
+@dataclass
+class SyntheticFile:
+    name: str
+    file_type: str
+    content: bytes
+    kind: str
+
+
+def german_text(rng: random.Random, size: int, line_length: Optional[int] = 40) -> str:
+    """
+    Generates German-like text from a fixed vocabulary
+    :param rng: Random number generator
+    :param size: Approximate number of characters
+    :param line_length: Width of the screen rows the text is padded to, no padding if None
+    :return: Text without newlines
+    """
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(VOCABULARY)
+        if rng.random() < 0.08:
+            word += rng.choice('.,!?')
+        words.append(word)
+        length += len(word) + 1
+    if not line_length:
+        return ' '.join(words)
+    rows = []
+    row = ''
+    for word in words:
+        if row and len(row) + len(word) + 1 > line_length:
+            rows.append(row.ljust(line_length))
+            row = word
+        else:
+            row = f'{row} {word}' if row else word
+    rows.append(row.ljust(line_length))
+    return ''.join(rows)
+
+
+def petscii_text(rng: random.Random, size: int) -> bytes:
+    line_length = rng.randint(40, 80)
+    return german_text(rng, size, line_length).translate(TRANSLITERATION).encode('petscii_c64en_lc', errors='replace')
+
+
+def ascii_text(rng: random.Random, size: int) -> bytes:
+    return '\n'.join(german_text(rng, size // 8, None) for _ in range(8)).translate(TRANSLITERATION).encode('ascii')
+
+
+def screencode_text(rng: random.Random, size: int) -> bytes:
+    return german_text(rng, size).translate(TRANSLITERATION).encode('screencode_c64_lc', errors='replace')
+
+
+def custom_umlaut_text(rng: random.Random, size: int) -> bytes:
+    content = bytearray()
+    for char in german_text(rng, size):
+        if char in CUSTOM_UMLAUT_BYTES:
+            content.append(CUSTOM_UMLAUT_BYTES[char])
+        else:
+            content += char.encode('petscii_c64en_lc', errors='replace')
+    return bytes(content)
+
+
+def compressed_blob(rng: random.Random, size: int) -> bytes:
+    return bytes(rng.getrandbits(8) for _ in range(size))
+
+
+def prg_code(rng: random.Random, size: int) -> bytes:
+    opcodes = (0xa9, 0xa2, 0xa0, 0x8d, 0x8e, 0xad, 0x20, 0x4c, 0x60, 0xd0, 0xf0, 0xe8, 0xc8, 0xca, 0x88)
+    operands = (0x00, 0x01, 0x02, 0x10, 0x20, 0xd0, 0xd0, 0xd0, 0xff, 0x04, 0x80, 0xc0)
+    code = bytearray((0x01, 0x08))
+    while len(code) < size:
+        code.append(rng.choice(opcodes))
+        code += bytes(rng.choice(operands) for _ in range(rng.randint(0, 2)))
+    return bytes(code[:size])
+
+
+CONTENT_GENERATORS = {'petscii': ('SEQ', petscii_text),
+                      'ascii': ('SEQ', ascii_text),
+                      'screencode': ('PRG', screencode_text),
+                      'custom_umlauts': ('SEQ', custom_umlaut_text),
+                      'compressed': ('PRG', compressed_blob),
+                      'prg_code': ('PRG', prg_code)}
+
+
+def synthetic_files(rng: random.Random, min_size: int = 1000, max_size: int = 12000) -> List[SyntheticFile]:
+    """
+    Generates one file of every content kind
+    :param rng: Random number generator
+    :param min_size: Minimal file size in bytes
+    :param max_size: Maximal file size in bytes
+    :return: Files in a random order
+    """
+    files = []
+    for kind, (file_type, generator) in CONTENT_GENERATORS.items():
+        content = generator(rng, rng.randint(min_size, max_size))
+        if file_type == 'PRG' and kind != 'prg_code':
+            content = bytes((0x00, 0x04)) + content
+        files.append(SyntheticFile(name=kind.replace('_', ' ').upper(), file_type=file_type, content=content, kind=kind))
+    rng.shuffle(files)
+    return files
+
+
+def build_d64(files: List[SyntheticFile], disk_name: str = 'SYNTHETIC', disk_id: str = '01') -> bytes:
+    """
+    Writes files to an empty 35 track D64 image
+    :param files: Files in the order of the directory
+    :param disk_name: Name of the disk in the header
+    :param disk_id: Two character disk id
+    :return: Content of the disk image
+    """
+    image = bytearray(TRACK_OFFSETS[35])
+    free = {track: list(range(TRACK_SECTORS[track - 1])) for track in range(1, 36) if track != DIR_TRACK}
+
+    def offset(track, sector):
+        return TRACK_OFFSETS[track - 1] + sector * SECTOR_SIZE
+
+    def allocate():
+        for track, sectors in free.items():
+            if sectors:
+                return track, sectors.pop(0)
+        raise ValueError('Disk full')
+
+    dir_sectors = (len(files) + DIR_ENTRIES_PER_SECTOR - 1) // DIR_ENTRIES_PER_SECTOR or 1
+    if dir_sectors >= TRACK_SECTORS[DIR_TRACK - 1]:
+        raise ValueError('Too many files for the directory track')
+    for index in range(dir_sectors):
+        start = offset(DIR_TRACK, index + 1)
+        image[start:start + 2] = bytes((DIR_TRACK, index + 2)) if index + 1 < dir_sectors else bytes((0, 0xff))
+
+    for index, file in enumerate(files):
+        chunks = [file.content[i:i + SECTOR_SIZE - 2] for i in range(0, len(file.content), SECTOR_SIZE - 2)] or [b'']
+        blocks = [allocate() for _ in chunks]
+        for position, (chunk, (track, sector)) in enumerate(zip(chunks, blocks)):
+            start = offset(track, sector)
+            if position + 1 < len(blocks):
+                image[start:start + 2] = bytes(blocks[position + 1])
+            else:
+                image[start:start + 2] = bytes((0, len(chunk) + 1))
+            image[start + 2:start + 2 + len(chunk)] = chunk
+        entry = offset(DIR_TRACK, index // DIR_ENTRIES_PER_SECTOR + 1) + (index % DIR_ENTRIES_PER_SECTOR) * 0x20
+        image[entry + 2] = 0x80 | FILE_TYPE_CODES[file.file_type]
+        image[entry + 3:entry + 5] = bytes(blocks[0])
+        image[entry + 5:entry + 0x15] = file.name.encode('ascii')[:16].ljust(16, b'\xa0')
+        image[entry + 0x1e:entry + 0x20] = len(blocks).to_bytes(2, 'little')
+
+    bam = offset(DIR_TRACK, 0)
+    image[bam:bam + 4] = bytes((DIR_TRACK, 1, 0x41, 0))
+    for track in range(1, 36):
+        sectors = TRACK_SECTORS[track - 1]
+        if track == DIR_TRACK:
+            free_sectors = set(range(dir_sectors + 1, sectors))
+        else:
+            free_sectors = set(free[track])
+        bits = sum(1 << sector for sector in free_sectors)
+        image[bam + 4 * track:bam + 4 * track + 4] = bytes((len(free_sectors), *bits.to_bytes(3, 'little')))
+    image[bam + 0x90:bam + 0xab] = b'\xa0' * 0x1b
+    image[bam + 0x90:bam + 0xa0] = disk_name.encode('ascii')[:16].ljust(16, b'\xa0')
+    image[bam + 0xa2:bam + 0xa4] = disk_id.encode('ascii')[:2]
+    image[bam + 0xa5:bam + 0xa7] = b'2A'
+    return bytes(image)
+
+
+def build_corpus(root: str, num_images: int, seed: int = 0, issues: Optional[List[str]] = None) -> Dict[str, List[SyntheticFile]]:
+    """
+    Creates a corpus of synthetic disk images in the directory layout magazine/issue/image.d64
+    :param root: Root directory of the corpus
+    :param num_images: Number of disk images
+    :param seed: Seed of the random number generator
+    :param issues: Normalized issue names which are used as directory names, so that the TEI headers can be created
+    :return: Files of every disk image by its path
+    """
+    rng = random.Random(seed)
+    if not issues:
+        issues = ['Synthetic No.1']
+    corpus = {}
+    for index in range(num_images):
+        issue = issues[index % len(issues)]
+        magazine = issue.rsplit(' ', 1)[0] or issue
+        directory = os.path.join(root, magazine, issue)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'image_{index:05d}.d64')
+        files = synthetic_files(rng)
+        with open(path, 'wb') as image:
+            image.write(build_d64(files, disk_name=f'SYNTH {index}'))
+        corpus[path] = files
+    return corpus
@@ -0,0 +1,120 @@
+import bz2
+import gzip
+import json
+import lzma
+import os
+from dataclasses import asdict
+from typing import Iterable, List, Optional, Tuple
+from c64_diskmag_converter.manifest import shard_name
+from c64_diskmag_converter.text_processing import TextMetaData
+
+
+EXPORT_NAME = 'texts'
+EXPORT_FORMATS = ('jsonl', 'parquet')
+JSONL_COMPRESSIONS = {'gzip': ('.gz', gzip.open), 'bz2': ('.bz2', bz2.open), 'xz': ('.xz', lzma.open)}
+RECORDS_PER_FILE = 10000
+
+
+def text_record(metadata: TextMetaData, image: str, magazine: str, issue: str) -> dict:
+    """
+    Collects an extracted file with its text for the export
+    :param metadata: Decoded file
+    :param image: Path of the disk image relative to the corpus root
+    :param magazine: Name of the magazine
+    :param issue: Name of the issue
+    :return: Fields of the TextMetaData record, preceded by disk image, magazine and issue
+    """
+    return {'image': image, 'magazine': magazine, 'issue': issue, **asdict(metadata)}
+
+
+class TextExportWriter:
+    """
+    Writes the records of the extracted files to numbered files of at most records_per_file records,
+    e.g. texts-00000.jsonl.gz. JSON lines files are written line by line, Parquet files are written when
+    they are full, so the memory usage does not depend on the size of the corpus. Every file is written
+    to a temporary name first and only appears under its final name when it is complete.
+    Parquet requires pyarrow, its umlaut mappings are stored as JSON strings
+    """
+    def __init__(self, output_dir: str, export_format: str = 'jsonl', compression: Optional[str] = None,
+                 records_per_file: int = RECORDS_PER_FILE, shard: Optional[Tuple[int, int]] = None):
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f'Unknown export format {export_format}, expected one of {", ".join(EXPORT_FORMATS)}')
+        if export_format == 'jsonl' and compression is not None and compression not in JSONL_COMPRESSIONS:
+            raise ValueError(f'Unknown compression {compression}, expected one of {", ".join(JSONL_COMPRESSIONS)}')
+        if export_format == 'parquet':
+            try:
+                import pyarrow  # noqa: F401
+            except ImportError:
+                raise ImportError('The Parquet export requires pyarrow, install it or export JSON lines')
+        self.output_dir = output_dir
+        self.export_format = export_format
+        self.compression = compression
+        self.records_per_file = records_per_file
+        self.prefix = shard_name(EXPORT_NAME, shard)
+        self.paths = []
+        self.records = 0
+        self.current = None
+        self.current_path = None
+        self.buffer = []
+        os.makedirs(output_dir, exist_ok=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def file_path(self, number: int) -> str:
+        if self.export_format == 'parquet':
+            ext = '.parquet'
+        else:
+            ext = '.jsonl' + (JSONL_COMPRESSIONS[self.compression][0] if self.compression else '')
+        return os.path.join(self.output_dir, f'{self.prefix}-{number:05d}{ext}')
+
+    def write(self, records: Iterable[dict]):
+        """
+        Appends records, see text_record, and starts a new file whenever the current one is full
+        :param records: Records of extracted files
+        """
+        for record in records:
+            if self.current_path is None:
+                self.open_file()
+            if self.export_format == 'parquet':
+                self.buffer.append({**record, 'mapping': json.dumps(record['mapping'], ensure_ascii=False)
+                                    if record.get('mapping') else None})
+            else:
+                self.current.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.records += 1
+            if self.records % self.records_per_file == 0:
+                self.close_file()
+
+    def open_file(self):
+        self.current_path = self.file_path(len(self.paths))
+        if self.export_format == 'jsonl':
+            opener = JSONL_COMPRESSIONS[self.compression][1] if self.compression else open
+            self.current = opener(f'{self.current_path}.tmp', 'wt', encoding='utf-8')
+
+    def close_file(self):
+        if self.current_path is None:
+            return
+        tmp_path = f'{self.current_path}.tmp'
+        if self.export_format == 'parquet':
+            import pyarrow
+            import pyarrow.parquet
+            pyarrow.parquet.write_table(pyarrow.Table.from_pylist(self.buffer), tmp_path,
+                                        compression=self.compression or 'snappy')
+            self.buffer = []
+        else:
+            self.current.close()
+            self.current = None
+        os.replace(tmp_path, self.current_path)
+        self.paths.append(self.current_path)
+        self.current_path = None
+
+    def close(self) -> List[str]:
+        """
+        Completes the last file
+        :return: Paths of the written files
+        """
+        self.close_file()
+        return self.paths
@@ -0,0 +1,263 @@
+import os
+import sqlite3
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+import regex
+from c64_diskmag_converter.manifest import shard_name
+
+
+TEXT_INDEX_NAME = 'text_index.sqlite'
+TOKEN_PATTERN = regex.compile(r'\w+')
+
+
+def text_index_name(shard: Optional[Tuple[int, int]] = None) -> str:
+    return shard_name(TEXT_INDEX_NAME, shard)
+
+
+def unwrap_lines(text: str, col_length: Optional[int]) -> str:
+    """
+    Removes the newlines inserted by insert_newlines, so that words split at the end of a row are joined again
+    :param text: Text with a newline after every row
+    :param col_length: Length of the rows, 0 or None if no newlines were inserted
+    :return: Text as it was decoded
+    """
+    if not col_length:
+        return text
+    return ''.join(text[i:i + col_length] for i in range(0, len(text), col_length + 1))
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def token_counts(text: Optional[str], col_length: Optional[int] = None) -> Dict[str, int]:
+    """
+    Counts the tokens of a decoded text
+    :param text: Text of an extracted file
+    :param col_length: Length of the rows of the text
+    :return: Number of occurrences per token
+    """
+    if not text:
+        return {}
+    return dict(Counter(tokenize(unwrap_lines(text, col_length))))
+
+
+def char_ngrams(token: str, size: int) -> set:
+    return {token[i:i + size] for i in range(len(token) - size + 1)}
+
+
+class TextIndex:
+    """
+    Inverted index of the texts extracted from the disk images of a corpus, stored in SQLite.
+    Every extracted file is a document, the postings count how often a token occurs in it.
+    The documents of a disk image are replaced as a whole when the image is converted again.
+    If an n-gram size is given, the character n-grams of the vocabulary are indexed as well,
+    so that tokens can be looked up by fragments
+    """
+    def __init__(self, path: str, ngram_size: Optional[int] = None, timeout: float = 30.0):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.executescript('''
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS images (image TEXT PRIMARY KEY) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS documents (doc_id INTEGER PRIMARY KEY, image TEXT NOT NULL, magazine TEXT,
+                                                  issue TEXT, xml_id INTEGER NOT NULL, filename TEXT);
+            CREATE INDEX IF NOT EXISTS documents_image ON documents (image);
+            CREATE TABLE IF NOT EXISTS postings (token TEXT NOT NULL, doc_id INTEGER NOT NULL, count INTEGER NOT NULL,
+                                                 PRIMARY KEY (token, doc_id)) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id);
+            CREATE TABLE IF NOT EXISTS vocabulary (token TEXT PRIMARY KEY, count INTEGER NOT NULL,
+                                                   documents INTEGER NOT NULL) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS token_grams (gram TEXT NOT NULL, token TEXT NOT NULL,
+                                                    PRIMARY KEY (gram, token)) WITHOUT ROWID;
+        ''')
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'ngram_size'").fetchone()
+        self.ngram_size = int(row[0]) if row and row[0] else None
+        if ngram_size is not None and ngram_size != self.ngram_size:
+            self.set_ngram_size(ngram_size)
+
+    @classmethod
+    def for_corpus(cls, corpus_path: str, shard: Optional[Tuple[int, int]] = None,
+                   ngram_size: Optional[int] = None) -> 'TextIndex':
+        return cls(os.path.join(corpus_path, text_index_name(shard)), ngram_size)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def set_ngram_size(self, ngram_size: int):
+        """
+        Rebuilds the n-gram index of the vocabulary
+        :param ngram_size: Number of characters per n-gram, 0 removes the n-gram index
+        """
+        with self.transaction():
+            self.connection.execute('DELETE FROM token_grams')
+            self.connection.execute("INSERT OR REPLACE INTO meta VALUES ('ngram_size', ?)", (str(ngram_size or ''),))
+            self.ngram_size = ngram_size or None
+            tokens = [token for token, in self.connection.execute('SELECT token FROM vocabulary')]
+            self._add_grams(tokens)
+
+    def transaction(self):
+        return _Transaction(self.connection)
+
+    @property
+    def images(self) -> set:
+        return {image for image, in self.connection.execute('SELECT image FROM images')}
+
+    def _add_grams(self, tokens: Iterable[str]):
+        if self.ngram_size:
+            self.connection.executemany('INSERT OR IGNORE INTO token_grams VALUES (?, ?)',
+                                        ((gram, token) for token in tokens
+                                         for gram in char_ngrams(token, self.ngram_size)))
+
+    def _remove_documents(self, images: Iterable[str]):
+        images = list(images)
+        doc_ids = [doc_id for image in images
+                   for doc_id, in self.connection.execute('SELECT doc_id FROM documents WHERE image = ?', (image,))]
+        removed = Counter()
+        documents = Counter()
+        for doc_id in doc_ids:
+            for token, count in self.connection.execute('SELECT token, count FROM postings WHERE doc_id = ?', (doc_id,)):
+                removed[token] += count
+                documents[token] += 1
+        self.connection.executemany('UPDATE vocabulary SET count = count - ?, documents = documents - ? WHERE token = ?',
+                                    ((removed[token], documents[token], token) for token in removed))
+        self.connection.executemany('DELETE FROM postings WHERE doc_id = ?', ((doc_id,) for doc_id in doc_ids))
+        self.connection.executemany('DELETE FROM documents WHERE image = ?', ((image,) for image in images))
+        self.connection.executemany('DELETE FROM images WHERE image = ?', ((image,) for image in images))
+        unused = [token for token in removed
+                  if self.connection.execute('SELECT documents FROM vocabulary WHERE token = ?', (token,)).fetchone()[0] <= 0]
+        self.connection.executemany('DELETE FROM vocabulary WHERE token = ?', ((token,) for token in unused))
+        if self.ngram_size:
+            self.connection.executemany('DELETE FROM token_grams WHERE gram = ? AND token = ?',
+                                        ((gram, token) for token in unused
+                                         for gram in char_ngrams(token, self.ngram_size)))
+
+    def replace_image(self, image: str, records: List[dict], tokens: List[Dict[str, int]]):
+        """
+        Replaces the documents of a disk image
+        :param image: Path of the disk image relative to the corpus root
+        :param records: Metadata of the extracted files, see metadata_index.file_record
+        :param tokens: Token counts of the extracted files in the same order
+        """
+        with self.transaction():
+            self._remove_documents([image])
+            self.connection.execute('INSERT INTO images VALUES (?)', (image,))
+            for record, counts in zip(records, tokens):
+                if not counts:
+                    continue
+                doc_id = self.connection.execute(
+                    'INSERT INTO documents (image, magazine, issue, xml_id, filename) VALUES (?, ?, ?, ?, ?)',
+                    (image, record.get('magazine'), record.get('issue'), record['xml_id'], record['filename'])).lastrowid
+                self.connection.executemany('INSERT INTO postings VALUES (?, ?, ?)',
+                                            ((token, doc_id, count) for token, count in counts.items()))
+                self.connection.executemany('INSERT INTO vocabulary VALUES (?, ?, 1) ON CONFLICT (token) '
+                                            'DO UPDATE SET count = count + excluded.count, documents = documents + 1',
+                                            counts.items())
+                self._add_grams(counts)
+
+    def retain(self, images: Iterable[str]):
+        """
+        Removes the documents of disk images which are no longer part of the corpus
+        :param images: Disk images which are kept
+        """
+        with self.transaction():
+            self._remove_documents(self.images - set(images))
+
+    def merge(self, other: 'TextIndex'):
+        """
+        Copies the documents of another index, e.g. of one shard of a distributed conversion.
+        Documents of the same disk images are replaced
+        :param other: Index which is copied
+        """
+        for image in sorted(other.images):
+            documents = other.connection.execute('SELECT doc_id, magazine, issue, xml_id, filename FROM documents '
+                                                 'WHERE image = ? ORDER BY xml_id', (image,)).fetchall()
+            records = [{'magazine': magazine, 'issue': issue, 'xml_id': xml_id, 'filename': filename}
+                       for _, magazine, issue, xml_id, filename in documents]
+            tokens = [dict(other.connection.execute('SELECT token, count FROM postings WHERE doc_id = ?', (doc_id,)))
+                      for doc_id, *_ in documents]
+            self.replace_image(image, records, tokens)
+
+    def search(self, query: str, match_all: bool = True, limit: Optional[int] = None) -> List[dict]:
+        """
+        Finds the extracted files which contain the tokens of a query
+        :param query: Words which are searched, case is ignored
+        :param match_all: Only return files which contain every token, otherwise any token
+        :param limit: Maximal number of results
+        :return: Files ordered by the number of occurrences, with magazine, issue, disk image and xml:id
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        return self._documents(tokens, len(tokens) if match_all else 1, limit)
+
+    def search_fragment(self, fragment: str, limit: Optional[int] = None) -> List[dict]:
+        """
+        Finds the extracted files which contain a token with the given fragment
+        :param fragment: Part of a word, case is ignored
+        :param limit: Maximal number of results
+        :return: Files ordered by the number of occurrences, see search
+        """
+        return self._documents(self.matching_tokens(fragment), 1, limit)
+
+    def matching_tokens(self, fragment: str) -> List[str]:
+        """
+        Looks up the tokens of the vocabulary which contain a fragment. The n-gram index is used
+        if it exists and the fragment is not shorter than the n-grams, otherwise the vocabulary is scanned
+        :param fragment: Part of a word, case is ignored
+        :return: Matching tokens
+        """
+        fragment = fragment.lower()
+        if self.ngram_size and len(fragment) >= self.ngram_size:
+            grams = sorted(char_ngrams(fragment, self.ngram_size))
+            placeholders = ', '.join('?' * len(grams))
+            candidates = self.connection.execute(f'SELECT token FROM token_grams WHERE gram IN ({placeholders}) '
+                                                 f'GROUP BY token HAVING COUNT(*) = ?', (*grams, len(grams)))
+        else:
+            candidates = self.connection.execute('SELECT token FROM vocabulary WHERE instr(token, ?) > 0', (fragment,))
+        return sorted(token for token, in candidates if fragment in token)
+
+    def _documents(self, tokens: List[str], min_tokens: int, limit: Optional[int]) -> List[dict]:
+        if not tokens:
+            return []
+        placeholders = ', '.join('?' * len(tokens))
+        rows = self.connection.execute(
+            f'SELECT d.magazine, d.issue, d.image, d.xml_id, d.filename, SUM(p.count) AS hits '
+            f'FROM postings p JOIN documents d ON d.doc_id = p.doc_id '
+            f'WHERE p.token IN ({placeholders}) GROUP BY p.doc_id HAVING COUNT(*) >= ? '
+            f'ORDER BY hits DESC, d.image, d.xml_id LIMIT ?',
+            (*tokens, min_tokens, -1 if limit is None else limit))
+        return [{'magazine': magazine, 'issue': issue, 'image': image, 'xml_id': f'file_{xml_id}',
+                 'filename': filename, 'hits': hits}
+                for magazine, issue, image, xml_id, filename, hits in rows]
+
+    def frequencies(self, limit: Optional[int] = None) -> Dict[str, int]:
+        """
+        Counts the tokens of the whole corpus
+        :param limit: Number of most frequent tokens, all tokens if not given
+        :return: Number of occurrences per token, most frequent first
+        """
+        rows = self.connection.execute('SELECT token, count FROM vocabulary ORDER BY count DESC, token LIMIT ?',
+                                       (-1 if limit is None else limit,))
+        return dict(rows)
+
+    def document_frequency(self, token: str) -> int:
+        row = self.connection.execute('SELECT documents FROM vocabulary WHERE token = ?', (token.lower(),)).fetchone()
+        return row[0] if row else 0
+
+
+class _Transaction:
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
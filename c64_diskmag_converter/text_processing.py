@@ -1,22 +1,17 @@
 import cbmcodecs2
 from collections import Counter
-import itertools
-import more_itertools
+import math
 import numpy as np
-import os
-import pandas as pd
 import re
 import regex
-from scipy.stats import entropy
+from c64_diskmag_converter import profiling
+from c64_diskmag_converter.decode_cache import DecodeCache
+from c64_diskmag_converter.lookup_tables import (begin_trigrams, umlaut_trigrams, load_beginning_trigrams,
+                                                 load_umlaut_trigrams, pack_trigrams)
 from dataclasses import dataclass, field
 from typing import Optional, Dict, Any, Tuple
 
 
-data_dir = os.path.join(os.path.dirname(__file__), 'data')
-begin_trigrams = os.path.join(data_dir, 'beginning_trigrams.csv')
-umlaut_trigrams = os.path.join(data_dir, 'umlaut_trigrams.csv')
-BEGINNINGS = pd.read_csv(begin_trigrams, encoding='utf-8')
-UMLAUT_TRIGRAMS = pd.read_csv(umlaut_trigrams, encoding='utf-8')
 # Regular expression for detecting trigrams with german umlauts and eszett
 UMLAUTS = list('äöüÄÖÜß')
 DOUBLE_UMLAUTS = {'ae': 'ä', 'Ae': 'Ä', 'oe': 'ö', 'Oe': 'Ö', 'ue': 'ü', 'Ue': 'ü'}
@@ -25,20 +20,97 @@ FIND_DOUBLE_UMLAUTS = re.compile('|'.join([f"{key}(?!$)" for key in DOUBLE_UMLAU
 FIND_UMLAUT_TRIGRAM = regex.compile(r'[a-zA-Z ]'
                                     r'([^\P{So}\N{CHECK MARK}\N{REPLACEMENT CHARACTER}]|[\uf110-\ufffc])'
                                     r'[a-zA-Z ,.:;\-"!?]')
-UMLAUTS_lookup = {trigram: percentage for trigram, percentage in zip(UMLAUT_TRIGRAMS['trigram'], UMLAUT_TRIGRAMS['percentage'])}
+UMLAUT_TRIGRAM_PUNCTUATION = str.maketrans(',.:;-"?!', ' ' * 8)
 # Regular expressions for detecting trigrams of line beginning
 REPLACE_UNRECOGNIZED_CHARS = regex.compile(r'[\x00-\x08\x0b-\x1f]')
 MATCH_BEGINNING_TRIGRAM = regex.compile(r'\p{Latin}[.,!?; ][\p{Latin} ]')
 MATCH_2ND_BEGINNING_TRIGRAM = regex.compile(r'[ \p{Latin}]{3}')
-BEGINNINGS_lookup = {trigram: percentage for trigram, percentage in zip(BEGINNINGS['trigram'], BEGINNINGS['percentage'])}
+# Code point arrays used by the vectorized line length detection
+MATCH_LATIN = regex.compile(r'\p{Latin}')
+SPACE_CODE = ord(' ')
+HYPHEN_CODE = ord('-')
+PUNCTUATION_CODES = np.array([ord(c) for c in '.,!?; '], dtype=np.int64)
 # Possible Commodore 64 encodings
 ENCODING_MAPPING = {0: ['petscii_c64en_lc', 'PETSCII'],
                     1: ['ascii', 'ASCII'],
                     2: ['screencode_c64_lc', 'Screencode']}
+# Byte values which are decoded to alphabetic characters in every encoding
+ALPHA_BYTES = np.array([[bytes([byte]).decode(encoding[0], errors='replace').isalpha() for byte in range(256)]
+                        for encoding in ENCODING_MAPPING.values()], dtype=np.int64)
 
 def char_to_c64_hex(char, encoding):
     return f'0x{ord(char):02X}'
 
+def byte_histogram(binary_text: bytes) -> np.ndarray:
+    """
+    Counts the occurrences of every byte value
+    :param binary_text: Binary version of some diskmag program
+    :return: Array with 256 counts
+    """
+    return np.bincount(np.frombuffer(binary_text, dtype=np.uint8), minlength=256)
+
+
+def normalize_petscii_newlines(binary_text: bytes) -> bytes:
+    return binary_text.replace(b'\n\r', b'\r').replace(b'\r\n', b'\r').replace(b'\n', b'\r')
+
+
+def decode_with_encoding(binary_text: bytes, encoding_index: int) -> str:
+    """
+    Decodes the binary text with one of the Commodore 64 encodings
+    :param binary_text: Binary version of some diskmag program
+    :param encoding_index: Key of ENCODING_MAPPING
+    :return: Decoded text
+    """
+    if encoding_index == 0:
+        decoded = normalize_petscii_newlines(binary_text)
+        decoded = decoded.decode(encoding='petscii_c64en_lc', errors='replace').replace('\r', '\n')
+    else:
+        decoded = binary_text.decode(encoding=ENCODING_MAPPING[encoding_index][0], errors='replace')
+    decoded = REPLACE_UNRECOGNIZED_CHARS.sub('\N{REPLACEMENT CHARACTER}', decoded)
+    decoded = decoded.replace(u'\xa0', ' ')
+    return decoded
+
+
+def encoding_scores(binary_text: bytes, histogram: np.ndarray) -> list:
+    """
+    Computes the proportion of alphabetic characters for every encoding without decoding the text.
+    All encodings decode one byte to one character, only the newline normalization
+    of PETSCII shortens the text
+    :param binary_text: Binary version of some diskmag program
+    :param histogram: Byte histogram of the binary text
+    :return: Proportion of alphabetic characters per encoding
+    """
+    alpha_chars = ALPHA_BYTES @ histogram
+    lengths = [len(binary_text)] * len(ENCODING_MAPPING)
+    if b'\n' in binary_text:
+        lengths[0] = len(normalize_petscii_newlines(binary_text))
+    return [int(alpha) / length for alpha, length in zip(alpha_chars, lengths)]
+
+
+def classify_binary(binary_text: bytes, threshold: float) -> Tuple[Optional[float], str, Optional[int], Optional[float]]:
+    """
+    Classifies a file by its entropy and the proportion of alphabetic characters without decoding it
+    :param binary_text: Binary version of some diskmag program
+    :param threshold: Minimal proportion of alphabetic characters for text files
+    :return: Entropy, filetype, key of the best encoding in ENCODING_MAPPING and its proportion of alphabetic characters
+    """
+    if not isinstance(binary_text, bytes) or len(binary_text) == 0:
+        return None, 'Nicht-binäre Datei', None, None
+    profiling.measure('bytes', len(binary_text))
+    with profiling.stage('entropy'):
+        histogram = byte_histogram(binary_text)
+        entr = check_entropy(binary_text, histogram)
+    if entr >= 7:
+        return entr, 'Komprimierte Datei/Assembler Code', None, None
+
+    with profiling.stage('classify'):
+        sum_chars = encoding_scores(binary_text, histogram)
+        best_encoding = int(np.argmax(np.array(sum_chars)))
+    if sum_chars[best_encoding] < threshold:
+        return entr, 'Programmcode', best_encoding, sum_chars[best_encoding]
+    return entr, 'Textdokument', best_encoding, sum_chars[best_encoding]
+
+
 def decode_text(binary_text: bytes, threshold: float):
     """
     The function converts the binary text to a string
@@ -46,46 +118,39 @@ def decode_text(binary_text: bytes, threshold: float):
     :param threshold:
     :return:
     """
-    if not isinstance(binary_text, bytes) or len(binary_text) == 0:
-        return None, None, None, 'Nicht-binäre Datei', None, None
-    entr = check_entropy(binary_text)
-    if entr >= 7:
-        return entr, None, None, 'Komprimierte Datei/Assembler Code', None, None
-
-    texts = []
-    sum_chars = []
-    for encoding_index, encoding in ENCODING_MAPPING.items():
-        if encoding_index == 0:
-            decoded = binary_text.replace(b'\n\r', b'\r').replace(b'\r\n', b'\r').replace(b'\n', b'\r')
-            decoded = decoded.decode(encoding='petscii_c64en_lc', errors='replace').replace('\r', '\n')
-        else:
-            decoded = binary_text.decode(encoding=encoding[0], errors='replace')
-        decoded = REPLACE_UNRECOGNIZED_CHARS.sub('\N{REPLACEMENT CHARACTER}', decoded)
-        decoded = decoded.replace(u'\xa0', ' ')
-        texts.append(decoded)
-        alpha_chars = sum(1 for character in decoded if character.isalpha())
-        sum_chars.append(alpha_chars / len(decoded))
-    best_encoding = np.argmax(np.array(sum_chars))
-    if max(sum_chars) < threshold:
-        return entr, None, None, 'Programmcode', None, ENCODING_MAPPING[best_encoding][1]
+    entr, filetype, best_encoding, _ = classify_binary(binary_text, threshold)
+    if best_encoding is None:
+        return entr, None, None, filetype, None, None
+    if filetype != 'Textdokument':
+        return entr, None, None, filetype, None, ENCODING_MAPPING[best_encoding][1]
     else:
-        text = texts[best_encoding]
-        text, mapping = replace_custom_umlauts(text)
+        with profiling.stage('decode'):
+            text = decode_with_encoding(binary_text, best_encoding)
+        with profiling.stage('umlauts'):
+            text, mapping = replace_custom_umlauts(text)
         mapping = {char_to_c64_hex(key, ENCODING_MAPPING[best_encoding][0]): value for key, value in mapping.items()}
-        text, best_line_length = insert_newlines(text)
+        with profiling.stage('newlines'):
+            text, best_line_length = insert_newlines(text)
+        profiling.measure('text_chars', len(text))
         return entr, text, best_line_length, 'Textdokument', mapping, ENCODING_MAPPING[best_encoding][1]
 
 
-def check_entropy(binary_text: bytes) -> int:
+def check_entropy(binary_text: bytes, histogram: Optional[np.ndarray] = None) -> float:
     """
     The function checks shannon's entropy of the binary file
     :param binary_text: Binary version of some diskmag program
+    :param histogram: Byte histogram of the binary text, computed if not given
     :return: Returns the entropy value
     """
+    if histogram is None:
+        histogram = byte_histogram(binary_text)
     binary_text_size = len(binary_text)
-    character_counts = Counter(binary_text)
-    dist = np.array(list(character_counts.values())) / binary_text_size
-    entropy_value = entropy(dist, base=2)
+    # Byte values in order of their first occurrence, so that the sum is computed in the same order as before
+    byte_values = sorted(np.flatnonzero(histogram).tolist(), key=binary_text.find)
+    dist = histogram[byte_values] / binary_text_size
+    # Same operations as scipy.stats.entropy(dist, base=2), which is too slow to import in every worker
+    dist = dist / np.sum(dist)
+    entropy_value = np.sum(np.array([-p * math.log(p) for p in dist.tolist()])) / math.log(2)
     return entropy_value
 
 
@@ -101,6 +166,59 @@ def replace_alt_umlauts(string: str) -> str:
     return fixed_string
 
 
+def umlaut_candidate_scores(trigrams: Counter, replacement_chars: list, options: list) -> np.ndarray:
+    """
+    Scores every replacement character against every umlaut. Each umlaut trigram
+    contains exactly one replacement character, so the score of a mapping is the
+    sum of the scores of its single character assignments
+    :param trigrams: Counts of the distinct umlaut trigrams
+    :param replacement_chars: Characters which possibly encode umlauts
+    :param options: Umlauts a character can be mapped to, None keeps the character
+    :return: Matrix with the log-probabilities of replacement characters and options
+    """
+    scores = np.zeros((len(replacement_chars), len(options)), dtype=np.float64)
+    rows = {char: index for index, char in enumerate(replacement_chars)}
+    umlauts_lookup = load_umlaut_trigrams().lookup
+    for trigram, count in trigrams.items():
+        row = rows[trigram[1]]
+        for column, option in enumerate(options):
+            candidate = trigram if option is None else f'{trigram[0]}{option}{trigram[2]}'
+            prob = umlauts_lookup.get(candidate, 0)
+            scores[row, column] += count * (np.log(prob) if prob else -50)
+    return scores
+
+
+def best_umlaut_assignment(scores: np.ndarray, options: list) -> Tuple[list, float]:
+    """
+    Finds the mapping with the highest score in which every umlaut is used at most once.
+    The best completion is computed for every set of used umlauts, ties are resolved
+    in favour of the first mapping in the order of the options
+    :param scores: Matrix returned by umlaut_candidate_scores
+    :param options: Umlauts a character can be mapped to, None keeps the character
+    :return: Best option for every replacement character and the score of the mapping
+    """
+    num_chars = len(scores)
+    masks = np.arange(1 << len(UMLAUTS))
+    bits = [0 if option is None else 1 << UMLAUTS.index(option) for option in options]
+    best = np.full((num_chars + 1, len(masks)), -np.inf)
+    best[num_chars] = 0
+    for row in range(num_chars - 1, -1, -1):
+        for column, bit in enumerate(bits):
+            values = np.where(masks & bit, -np.inf, scores[row, column] + best[row + 1, masks | bit])
+            np.maximum(best[row], values, out=best[row])
+
+    mapping = []
+    mask = 0
+    for row in range(num_chars):
+        tolerance = 1e-9 * max(1.0, abs(best[row, mask]))
+        for column, bit in enumerate(bits):
+            if not mask & bit and scores[row, column] + best[row + 1, mask | bit] >= best[row, mask] - tolerance:
+                mapping.append(options[column])
+                mask |= bit
+                break
+    return mapping, best[0, 0]
+
+
 def replace_custom_umlauts(text: str):
     """
     The function tries to replace special characters with german umlauts and scharf-s
@@ -113,74 +231,91 @@ def replace_custom_umlauts(text: str):
     if not matches:
         return text, {}
 
-    replacement_chars = set()
-    trigrams = list()
-    for m in matches:
-        replacement_chars.add(m.group(1))
-        trigrams.append(regex.sub(r'[,.:;\-"?!]', ' ', text[m.start(1) - 1:m.end(1) + 1]))
-
-    num_replacement_chars = len(replacement_chars)
-    if num_replacement_chars > 7:
-        return text, {}
-
-    mapping_logprobs = {}
-    for mapping in itertools.permutations(UMLAUTS, r=len(replacement_chars)):
-        trans = dict(zip(replacement_chars, mapping))
-        score = 0
-        translated_trigrams = (t.translate(str.maketrans(trans)) for t in trigrams)
-        for t in translated_trigrams:
-            prob = UMLAUTS_lookup.get(t, 0)
-            if prob:
-                score += np.log(prob)
-            else:
-                score += -50
-
-        mapping_logprobs[mapping] = score
-
-    best_mapping, best_logprob = max(mapping_logprobs.items(), key=lambda i: i[1])
-    if best_logprob < -50 * len(trigrams) * 2 / 3:
+    trigrams = Counter(m.group(0).translate(UMLAUT_TRIGRAM_PUNCTUATION) for m in matches)
+    replacement_chars = list(dict.fromkeys(m.group(1) for m in matches))
+    # With more replacement characters than umlauts some of them have to stay unchanged
+    options = UMLAUTS if len(replacement_chars) <= len(UMLAUTS) else [None] + UMLAUTS
+    profiling.measure('umlaut_trigrams', len(matches))
+    profiling.measure('replacement_chars', len(replacement_chars))
+    # Partial mappings evaluated by best_umlaut_assignment, one per character, set of used umlauts and option
+    profiling.measure('assignments_evaluated', len(replacement_chars) * (1 << len(UMLAUTS)) * len(options))
+    scores = umlaut_candidate_scores(trigrams, replacement_chars, options)
+    best_mapping, best_logprob = best_umlaut_assignment(scores, options)
+    if best_logprob < -50 * len(matches) * 2 / 3:
         return text, {}
 
-    trans = dict(zip(replacement_chars, best_mapping))
-    # substitutions = [(i, orig, trans[orig]) for i, orig in enumerate(text) if orig in trans.keys()]
+    trans = {char: umlaut for char, umlaut in zip(replacement_chars, best_mapping) if umlaut is not None}
     text = text.translate(str.maketrans(trans))
     return text, trans
 
 
+def trigram_keys(codes: np.ndarray) -> np.ndarray:
+    """
+    Packs every trigram of a code point array into a single integer
+    :param codes: Code points of a text
+    :return: Array with one key per trigram start position
+    """
+    return pack_trigrams(codes[:-2], codes[1:-1], codes[2:])
+
+
+def line_beginning_scores(codes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Scores every position of a text as a potential line beginning
+    :param codes: Code points of the text
+    :return: Score of every position and a mask of the positions which are scored at all
+    """
+    size = len(codes)
+    scores = np.zeros(size, dtype=np.float64)
+    valid = np.zeros(size, dtype=bool)
+    if size < 3:
+        return scores, valid
+
+    unique_codes = np.unique(codes)
+    latin_codes = np.array([c for c in unique_codes.tolist() if MATCH_LATIN.fullmatch(chr(c))], dtype=np.int64)
+    latin = np.isin(codes, latin_codes)
+    space = codes == SPACE_CODE
+    punctuation = np.isin(codes, PUNCTUATION_CODES)
+    latin_or_space = latin | space
+
+    # Same rules as MATCH_BEGINNING_TRIGRAM and MATCH_2ND_BEGINNING_TRIGRAM
+    beginning = latin[:-2] & punctuation[1:-1] & latin_or_space[2:]
+    candidate = (~beginning & latin_or_space[:-2] & latin_or_space[1:-1] & latin_or_space[2:]
+                 & ~(space[:-2] & space[1:-1] & space[2:]))
+
+    table = load_beginning_trigrams()
+    keys = trigram_keys(codes)[candidate]
+    logprobs = np.full(len(keys), -100, dtype=np.float64)
+    if len(table.keys):
+        index = np.minimum(np.searchsorted(table.keys, keys), len(table.keys) - 1)
+        found = table.keys[index] == keys
+        logprobs[found] = table.logprobs[index[found]]
+
+    scores[:-2][beginning] = -100
+    scores[:-2][candidate] = logprobs
+    valid[:-2] = beginning | candidate
+    # A row following a hyphenated row is not scored
+    valid[1:] &= codes[:-1] != HYPHEN_CODE
+    return scores, valid
+
+
 def insert_newlines(text: str):
     """
     :param text: Takes a text which should be splitted into lines
     :return: Returns a text with inserted newlines
     :author: Anton Ehrmanntraut
     """
+    codes = np.frombuffer(text.encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32).astype(np.int64)
+    scores, valid = line_beginning_scores(codes)
     logprobs = {}
     for col_len in range(40, 81):
-        rows = [''.join(x) for x in more_itertools.chunked(text, n=col_len)]
-        scores = []
-        for prev_row, row in zip(itertools.chain([None], rows), rows):
-            if prev_row is not None and prev_row.endswith('-'):
-                continue
-            trigram = row[:3]
-            if MATCH_BEGINNING_TRIGRAM.fullmatch(trigram):
-                scores.append(-100)
-                continue
-            if trigram == '   ' or not MATCH_2ND_BEGINNING_TRIGRAM.fullmatch(trigram):
-                continue
-
-            prob = BEGINNINGS_lookup.get(trigram, 0)
-            if prob:
-                scores.append(np.log(prob))
-            else:
-                scores.append(-100)
-        if scores:
-            logprobs[col_len] = np.mean(scores)
-        else:
-            continue
+        row_scores = scores[::col_len][valid[::col_len]]
+        if row_scores.size:
+            logprobs[col_len] = np.mean(row_scores)
 
     if not logprobs:
         return text, 0
     best_col_len, logprob = max(logprobs.items(), key=lambda i: i[1])
-    rows = [''.join(x) for x in more_itertools.chunked(text, n=best_col_len)]
+    rows = [text[i:i + best_col_len] for i in range(0, len(text), best_col_len)]
     return '\n'.join(rows), best_col_len
 
 
@@ -201,11 +336,21 @@ class TextMetaData:
                     xml_id: int,
                     file_ext: str,
                     content: bytes,
-                    char_threshold: float):
+                    char_threshold: float,
+                    decode_cache: Optional[DecodeCache] = None):
         if not content:
             return cls(filename, xml_id, file_ext, filetype='Beschädigte Datei')
 
-        entr, text, col_length, filetype, mapping, encoding = decode_text(content, char_threshold)
+        result = None
+        if decode_cache is not None:
+            with profiling.stage('decode_cache'):
+                result = decode_cache.get(content, char_threshold)
+            profiling.measure('cache_hits', result is not None)
+        if result is None:
+            result = decode_text(content, char_threshold)
+            if decode_cache is not None:
+                decode_cache.put(content, char_threshold, result)
+        entr, text, col_length, filetype, mapping, encoding = result
         return cls(filename=filename,
                    xml_id=xml_id,
                    file_ext=file_ext,
@@ -0,0 +1,205 @@
+import argparse
+import bz2
+import csv
+import gzip
+import lzma
+import os
+import re
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from c64_diskmag_converter.lookup_tables import pack_trigrams
+
+
+# Patterns of the notebook data/trigram_tables/create_trigram_tables.ipynb which created the shipped tables
+PATTERN_UMLAUT = re.compile(r'([a-zA-ZäöüÄÖÜ][äöüÄÖÜß][a-zA-ZäöüÄÖÜß]|[äöüÄÖÜß][a-zA-ZäöüÄÖÜß]{2})')
+PATTERN_BEGINNING = re.compile(r'\b([\wäöüÄÖÜß]{3})')
+INPUT_FORMATS = ('frequencies', 'text')
+OPENERS = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+CHUNK_LINES = 100000
+
+
+def open_text(path: str):
+    opener = OPENERS.get(os.path.splitext(path)[1], open)
+    return opener(path, 'rt', encoding='utf-8', errors='replace')
+
+
+def parse_line(line: str, input_format: str = 'frequencies') -> List[Tuple[str, int]]:
+    """
+    Reads the words of a line
+    :param line: Line of a frequency list or of a text
+    :param input_format: frequencies for tab separated frequency lists like the Leipzig corpora word lists,
+    whose last two columns are word and frequency, e.g. '1<TAB>word<TAB>42', text for plain text
+    :return: Words with their frequencies, empty for malformed lines of a frequency list
+    """
+    if input_format == 'text':
+        return [(word, 1) for word in line.split()]
+    fields = line.rstrip('\r\n').split('\t')
+    if len(fields) < 2 or not fields[-1].strip().isdigit():
+        return []
+    return [(fields[-2], int(fields[-1]))]
+
+
+def word_trigrams(word: str) -> Tuple[List[str], List[str]]:
+    """
+    Extracts the trigrams of a word which are counted in the tables, like the notebook which created the tables
+    :param word: Single word
+    :return: Trigrams at word boundaries and non-overlapping trigrams containing an umlaut or eszett
+    """
+    return PATTERN_BEGINNING.findall(word), PATTERN_UMLAUT.findall(word)
+
+
+def count_chunk(lines: List[str], input_format: str = 'frequencies') -> Tuple[Counter, Counter]:
+    """
+    Counts the beginning and umlaut trigrams of a chunk of lines
+    :param lines: Lines of a frequency list or text
+    :param input_format: frequencies or text, see parse_line
+    :return: Frequencies of the beginning trigrams and of the umlaut trigrams
+    """
+    beginnings = Counter()
+    umlauts = Counter()
+    for line in lines:
+        for word, frequency in parse_line(line, input_format):
+            beginning_trigrams, umlaut_trigrams = word_trigrams(word)
+            for trigram in beginning_trigrams:
+                beginnings[trigram] += frequency
+            for trigram in umlaut_trigrams:
+                umlauts[trigram] += frequency
+    return beginnings, umlauts
+
+
+def read_chunks(paths: Iterable[str], chunk_lines: int = CHUNK_LINES, skip_lines: int = 0) -> Iterator[List[str]]:
+    for path in paths:
+        with open_text(path) as text_file:
+            for _ in islice(text_file, skip_lines):
+                pass
+            while True:
+                lines = list(islice(text_file, chunk_lines))
+                if not lines:
+                    break
+                yield lines
+
+
+def count_trigrams(paths: Iterable[str], workers: int = 1, chunk_lines: int = CHUNK_LINES,
+                   input_format: str = 'frequencies', skip_lines: int = 0) -> Tuple[Counter, Counter]:
+    """
+    Counts the trigrams of word lists or texts chunk by chunk. At most two chunks per worker
+    are read ahead, so the memory usage does not depend on the size of the input
+    :param paths: Frequency lists or texts, optionally compressed with gzip, bzip2 or xz
+    :param workers: Number of worker processes, the chunks are counted serially if 1
+    :param chunk_lines: Number of lines per chunk
+    :param input_format: frequencies or text, see parse_line
+    :param skip_lines: Number of lines skipped at the beginning of every file, the shipped tables
+    skip the 48 most frequent entries of the Leipzig word list
+    :return: Frequencies of the beginning trigrams and of the umlaut trigrams
+    """
+    if input_format not in INPUT_FORMATS:
+        raise ValueError(f'Unknown input format {input_format}, expected one of {", ".join(INPUT_FORMATS)}')
+    beginnings = Counter()
+    umlauts = Counter()
+    chunks = read_chunks(paths, chunk_lines, skip_lines)
+    if workers <= 1:
+        for lines in chunks:
+            chunk_beginnings, chunk_umlauts = count_chunk(lines, input_format)
+            beginnings.update(chunk_beginnings)
+            umlauts.update(chunk_umlauts)
+        return beginnings, umlauts
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for lines in chunks:
+            pending.append(executor.submit(count_chunk, lines, input_format))
+            while len(pending) >= 2 * workers or (pending and pending[0].done()):
+                chunk_beginnings, chunk_umlauts = pending.popleft().result()
+                beginnings.update(chunk_beginnings)
+                umlauts.update(chunk_umlauts)
+        for future in pending:
+            chunk_beginnings, chunk_umlauts = future.result()
+            beginnings.update(chunk_beginnings)
+            umlauts.update(chunk_umlauts)
+    return beginnings, umlauts
+
+
+def sorted_trigrams(counts: Counter) -> List[Tuple[str, int]]:
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def write_trigram_csv(counts: Counter, path: str):
+    """
+    Writes a trigram table in the format of the tables in the data directory
+    :param counts: Frequencies of the trigrams
+    :param path: Path to the CSV file
+    """
+    total = sum(counts.values())
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as csv_file:
+        writer = csv.writer(csv_file, lineterminator='\n')
+        writer.writerow(['trigram', 'frequency', 'percentage'])
+        for trigram, frequency in sorted_trigrams(counts):
+            writer.writerow([trigram, frequency, frequency / total])
+    os.replace(tmp_path, path)
+
+
+def write_trigram_binary(counts: Counter, path: str):
+    """
+    Writes a trigram table as sorted packed trigram keys and frequencies, see lookup_tables.read_trigram_binary
+    :param counts: Frequencies of the trigrams
+    :param path: Path to the npz file
+    """
+    trigrams = [(trigram, frequency) for trigram, frequency in sorted_trigrams(counts) if len(trigram) == 3]
+    codes = np.array([[ord(c) for c in trigram] for trigram, _ in trigrams], dtype=np.int64).reshape(-1, 3)
+    keys = pack_trigrams(codes[:, 0], codes[:, 1], codes[:, 2])
+    frequencies = np.array([frequency for _, frequency in trigrams], dtype=np.int64)
+    order = np.argsort(keys, kind='stable')
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as binary_file:
+        np.savez(binary_file, keys=keys[order], frequencies=frequencies[order])
+    os.replace(tmp_path, path)
+
+
+def build_trigram_tables(paths: List[str], output_dir: str, workers: int = 1, chunk_lines: int = CHUNK_LINES,
+                         input_format: str = 'frequencies', skip_lines: int = 0) -> List[str]:
+    """
+    Builds the beginning and umlaut trigram tables from word lists or texts
+    :param paths: Frequency lists or texts
+    :param output_dir: Directory for the tables
+    :param workers: Number of worker processes
+    :param chunk_lines: Number of lines per chunk
+    :param input_format: frequencies or text, see parse_line
+    :param skip_lines: Number of lines skipped at the beginning of every file
+    :return: Paths of the written files
+    """
+    beginnings, umlauts = count_trigrams(paths, workers, chunk_lines, input_format, skip_lines)
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    for name, counts in (('beginning_trigrams', beginnings), ('umlaut_trigrams', umlauts)):
+        csv_path = os.path.join(output_dir, f'{name}.csv')
+        binary_path = os.path.join(output_dir, f'{name}.npz')
+        write_trigram_csv(counts, csv_path)
+        write_trigram_binary(counts, binary_path)
+        written.extend([csv_path, binary_path])
+    return written
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description='Builds the trigram tables used for line and umlaut detection')
+    parser.add_argument('inputs', nargs='+', help='Word frequency lists or plain texts, optionally compressed')
+    parser.add_argument('--output-dir', default='.', help='Directory for the CSV and npz tables')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of worker processes')
+    parser.add_argument('--chunk-lines', type=int, default=CHUNK_LINES, help='Number of lines per chunk')
+    parser.add_argument('--format', choices=INPUT_FORMATS, default='frequencies',
+                        help='Tab separated word frequency lists or plain texts')
+    parser.add_argument('--skip-lines', type=int, default=0,
+                        help='Lines skipped at the beginning of every input, 48 for the shipped tables')
+    args = parser.parse_args(argv)
+    for path in build_trigram_tables(args.inputs, args.output_dir, args.workers, args.chunk_lines,
+                                     args.format, args.skip_lines):
+        print(path, file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,12 @@
 from c64_diskmag_converter.text_processing import *
 from lxml import etree
 from datetime import datetime
-import pandas as pd
+from itertools import chain
+from typing import BinaryIO, Dict, Iterable, List, Optional
+
+
+TEI_NAMESPACE = 'http://www.tei-c.org/ns/1.0'
+INDENT = '  '
 
 
 def attach_header(root: etree.Element,
@@ -9,7 +14,7 @@ def attach_header(root: etree.Element,
                   series: str,
                   issue: str,
                   principal: str,
-                  record: pd.Series) -> etree.SubElement:
+                  record: List[Dict[str, Optional[str]]]) -> etree.SubElement:
     """
     Attaches a header to TEI document
     :param root:
@@ -17,7 +22,7 @@ def attach_header(root: etree.Element,
     :param series:
     :param issue:
     :param principal:
-    :param record:
+    :param record: Metadata rows of the issue
     :return:
     """
     header = etree.SubElement(root, 'teiHeader')
@@ -34,7 +39,7 @@ def attach_header(root: etree.Element,
     etree.SubElement(pubstmt, 'p').text = 'Erzeugt aus dem Abbild eines Diskettenmagazins'
     etree.SubElement(pubstmt, 'p').text = 'Nachnutzung eingeschränkt'
     sourcedesc = etree.SubElement(filedesc, 'sourceDesc')
-    for _, row in record.iterrows():
+    for row in record:
         bibl = etree.SubElement(sourcedesc, 'bibl', type='diskmag')
         etree.SubElement(bibl, 'title', level='j').text = row['issue']
         etree.SubElement(bibl, 'series').text = series
@@ -57,7 +62,7 @@ def attach_header(root: etree.Element,
                 etree.SubElement(bibl, 'ref', target=d)
 
     profiledesc = etree.SubElement(header, 'profileDesc')
-    language = record['language'].tolist()[0]
+    language = record[0]['language']
     langusage = etree.SubElement(profiledesc, 'langUsage')
     for lang in language.split('; '):
         if lang == 'German':
@@ -124,3 +129,56 @@ def attach_text_div(parent, metadata: TextMetaData) -> etree.SubElement:
         etree.SubElement(div, 'gap', reason='irrelevant')
 
     return div
+
+
+def write_indented(xml_writer, element: etree.Element, level: int):
+    """
+    Writes an element at the given indentation level of an incrementally written document
+    :param xml_writer: Writer returned by etree.xmlfile
+    :param element: Element which should be written with its children
+    :param level: Nesting depth of the element
+    """
+    xml_writer.write('\n' + INDENT * level)
+    etree.indent(element, space=INDENT, level=level)
+    element.tail = None
+    xml_writer.write(element)
+
+
+def write_tei(xml_file: BinaryIO, header: etree.Element, front: etree.Element, divs: Iterable[etree.Element]):
+    """
+    Writes a TEI document incrementally. Every element is serialized as soon as it is passed,
+    so that only one div of the body has to be kept in memory. The output is identical
+    to the indented serialization of the complete tree
+    :param xml_file: File opened in binary mode
+    :param header: teiHeader element
+    :param front: front element
+    :param divs: div elements of the body
+    :return: Start and end byte offsets of every div in the document
+    """
+    offsets = []
+    with etree.xmlfile(xml_file, encoding='UTF-8') as xml_writer:
+        xml_writer.write_declaration()
+        with xml_writer.element('TEI', xmlns=TEI_NAMESPACE):
+            write_indented(xml_writer, header, level=1)
+            xml_writer.write('\n' + INDENT)
+            with xml_writer.element('text'):
+                write_indented(xml_writer, front, level=2)
+                divs = iter(divs)
+                first_div = next(divs, None)
+                if first_div is None:
+                    write_indented(xml_writer, etree.Element('body'), level=2)
+                else:
+                    xml_writer.write('\n' + INDENT * 2)
+                    with xml_writer.element('body'):
+                        for div in chain([first_div], divs):
+                            xml_writer.flush()
+                            # The div starts after the newline and the indentation
+                            start = xml_file.tell() + 1 + len(INDENT) * 3
+                            write_indented(xml_writer, div, level=3)
+                            xml_writer.flush()
+                            offsets.append((start, xml_file.tell()))
+                        xml_writer.write('\n' + INDENT * 2)
+                xml_writer.write('\n' + INDENT)
+            xml_writer.write('\n')
+    xml_file.write(b'\n')
+    return offsets
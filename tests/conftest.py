@@ -0,0 +1,37 @@
+import random
+import pytest
+from c64_diskmag_converter.lookup_tables import load_issue_index
+from c64_diskmag_converter.synthetic import build_corpus, build_d64, synthetic_files
+
+NUM_IMAGES = 6
+
+
+@pytest.fixture
+def issues():
+    # The TEI header is only written for issues of the index
+    return sorted(load_issue_index())
+
+
+@pytest.fixture
+def corpus_root(tmp_path, issues):
+    """
+    Writes one synthetic disk image per issue to magazine/issue/image.d64
+    """
+    root = tmp_path / 'corpus'
+    build_corpus(str(root), NUM_IMAGES, seed=3, issues=issues[:NUM_IMAGES])
+    return root
+
+
+@pytest.fixture
+def disk_image(tmp_path, issues):
+    """
+    Writes synthetic disk images to magazine/issue/name.d64 below the temporary directory
+    """
+    def write(seed: int = 0, name: str = 'image', files=None):
+        issue = issues[0]
+        directory = tmp_path / issue.rsplit(' ', 1)[0] / issue
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'{name}.d64'
+        path.write_bytes(build_d64(files if files is not None else synthetic_files(random.Random(seed))))
+        return path
+    return write
@@ -0,0 +1,125 @@
+"""
+Reference implementations of the original text processing, used to check that the optimized
+functions produce the same results. Only the parts which decide the output are kept
+"""
+import itertools
+import os
+from collections import Counter
+import cbmcodecs2  # noqa: F401
+import more_itertools
+import numpy as np
+import pandas as pd
+import regex
+from scipy.stats import entropy
+
+
+data_dir = os.path.join(os.path.dirname(__file__), '..', 'c64_diskmag_converter', 'data')
+BEGINNINGS = pd.read_csv(os.path.join(data_dir, 'beginning_trigrams.csv'), encoding='utf-8')
+UMLAUT_TRIGRAMS = pd.read_csv(os.path.join(data_dir, 'umlaut_trigrams.csv'), encoding='utf-8')
+UMLAUTS = list('äöüÄÖÜß')
+FIND_UMLAUT_TRIGRAM = regex.compile(r'[a-zA-Z ]'
+                                    r'([^\P{So}\N{CHECK MARK}\N{REPLACEMENT CHARACTER}]|[\uf110-\ufffc])'
+                                    r'[a-zA-Z ,.:;\-"!?]')
+UMLAUTS_lookup = dict(zip(UMLAUT_TRIGRAMS['trigram'], UMLAUT_TRIGRAMS['percentage']))
+REPLACE_UNRECOGNIZED_CHARS = regex.compile(r'[\x00-\x08\x0b-\x1f]')
+MATCH_BEGINNING_TRIGRAM = regex.compile(r'\p{Latin}[.,!?; ][\p{Latin} ]')
+MATCH_2ND_BEGINNING_TRIGRAM = regex.compile(r'[ \p{Latin}]{3}')
+BEGINNINGS_lookup = dict(zip(BEGINNINGS['trigram'], BEGINNINGS['percentage']))
+ENCODING_MAPPING = {0: ['petscii_c64en_lc', 'PETSCII'],
+                    1: ['ascii', 'ASCII'],
+                    2: ['screencode_c64_lc', 'Screencode']}
+
+
+def check_entropy(binary_text: bytes) -> float:
+    dist = np.array(list(Counter(binary_text).values())) / len(binary_text)
+    return entropy(dist, base=2)
+
+
+def classify(binary_text: bytes, threshold: float):
+    """
+    Classification of the original decode_text before any text is processed
+    :return: Entropy, filetype and name of the best encoding
+    """
+    entr = check_entropy(binary_text)
+    if entr >= 7:
+        return entr, 'Komprimierte Datei/Assembler Code', None
+    texts, sum_chars = decoded_texts(binary_text)
+    best_encoding = int(np.argmax(np.array(sum_chars)))
+    filetype = 'Programmcode' if max(sum_chars) < threshold else 'Textdokument'
+    return entr, filetype, ENCODING_MAPPING[best_encoding][1]
+
+
+def decoded_texts(binary_text: bytes):
+    texts = []
+    sum_chars = []
+    for encoding_index, encoding in ENCODING_MAPPING.items():
+        if encoding_index == 0:
+            decoded = binary_text.replace(b'\n\r', b'\r').replace(b'\r\n', b'\r').replace(b'\n', b'\r')
+            decoded = decoded.decode(encoding='petscii_c64en_lc', errors='replace').replace('\r', '\n')
+        else:
+            decoded = binary_text.decode(encoding=encoding[0], errors='replace')
+        decoded = REPLACE_UNRECOGNIZED_CHARS.sub('\N{REPLACEMENT CHARACTER}', decoded)
+        decoded = decoded.replace(u'\xa0', ' ')
+        texts.append(decoded)
+        sum_chars.append(sum(1 for character in decoded if character.isalpha()) / len(decoded))
+    return texts, sum_chars
+
+
+def insert_newlines(text: str):
+    logprobs = {}
+    for col_len in range(40, 81):
+        rows = [''.join(x) for x in more_itertools.chunked(text, n=col_len)]
+        scores = []
+        for prev_row, row in zip(itertools.chain([None], rows), rows):
+            if prev_row is not None and prev_row.endswith('-'):
+                continue
+            trigram = row[:3]
+            if MATCH_BEGINNING_TRIGRAM.fullmatch(trigram):
+                scores.append(-100)
+                continue
+            if trigram == '   ' or not MATCH_2ND_BEGINNING_TRIGRAM.fullmatch(trigram):
+                continue
+            prob = BEGINNINGS_lookup.get(trigram, 0)
+            scores.append(np.log(prob) if prob else -100)
+        if scores:
+            logprobs[col_len] = np.mean(scores)
+    if not logprobs:
+        return text, 0
+    best_col_len, _ = max(logprobs.items(), key=lambda i: i[1])
+    rows = [''.join(x) for x in more_itertools.chunked(text, n=best_col_len)]
+    return '\n'.join(rows), best_col_len
+
+
+def umlaut_trigrams(text: str):
+    return [regex.sub(r'[,.:;\-"?!]', ' ', text[m.start(1) - 1:m.end(1) + 1])
+            for m in FIND_UMLAUT_TRIGRAM.finditer(text)]
+
+
+def mapping_score(trigrams, trans: dict) -> float:
+    score = 0
+    for t in trigrams:
+        prob = UMLAUTS_lookup.get(t.translate(str.maketrans(trans)), 0)
+        score += np.log(prob) if prob else -50
+    return score
+
+
+def replace_custom_umlauts(text: str):
+    """
+    Original search over all permutations of umlauts for the replacement characters
+    :return: Text with replaced umlauts, mapping and score of the mapping
+    """
+    matches = list(FIND_UMLAUT_TRIGRAM.finditer(text))
+    if not matches:
+        return text, {}, None
+    replacement_chars = set(m.group(1) for m in matches)
+    if len(replacement_chars) > 7:
+        return text, {}, None
+    trigrams = umlaut_trigrams(text)
+    mapping_logprobs = {}
+    for mapping in itertools.permutations(UMLAUTS, r=len(replacement_chars)):
+        mapping_logprobs[mapping] = mapping_score(trigrams, dict(zip(replacement_chars, mapping)))
+    best_mapping, best_logprob = max(mapping_logprobs.items(), key=lambda i: i[1])
+    if best_logprob < -50 * len(trigrams) * 2 / 3:
+        return text, {}, None
+    trans = dict(zip(replacement_chars, best_mapping))
+    return text.translate(str.maketrans(trans)), trans, best_logprob
@@ -0,0 +1,41 @@
+import os
+import zipfile
+from c64_diskmag_converter.archives import split_archive_path, tei_path_for
+from c64_diskmag_converter.corpus import Corpus
+
+
+def test_archived_images_are_converted_like_extracted_ones(tmp_path, disk_image, issues):
+    disk_image(0, name='disk1')
+    disk_image(1, name='disk2')
+    extracted = Corpus('test', str(tmp_path))
+    magazine, issue = issues[0].rsplit(' ', 1)[0], issues[0]
+    archive_root = tmp_path / 'archived'
+    archive = archive_root / magazine / f'{issue}.zip'
+    archive.parent.mkdir(parents=True)
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        for disk_image_path in extracted.files:
+            zip_file.write(disk_image_path, os.path.basename(disk_image_path))
+    archived = Corpus('test', str(archive_root))
+    assert archived.files == [os.path.join(str(archive), 'disk1.d64'), os.path.join(str(archive), 'disk2.d64')]
+    assert split_archive_path(archived.files[0]) == (str(archive), 'disk1.d64')
+
+    assert all(result.success for result in extracted.convert_files_to_tei(0.4, decode_cache=False))
+    assert all(result.success for result in archived.convert_files_to_tei(0.4, decode_cache=False))
+    for disk_image_path, member in zip(extracted.files, archived.files):
+        with open(tei_path_for(member), 'rb') as tei_file, open(tei_path_for(disk_image_path), 'rb') as expected:
+            assert tei_file.read() == expected.read()
+    assert sorted(os.listdir(archive.with_suffix(''))) == ['disk1.xml', 'disk2.xml']
+    assert all(result.skipped for result in archived.convert_files_to_tei(0.4, decode_cache=False))
+
+
+def test_archived_images_are_numbered_by_their_part(tmp_path, disk_image, issues):
+    archive = tmp_path / 'archived' / issues[0].rsplit(' ', 1)[0] / f'{issues[0]}.zip'
+    archive.parent.mkdir(parents=True)
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        for seed, name in enumerate(('disk_a', 'disk_b')):
+            zip_file.write(disk_image(seed, name=name), f'{name}.d64')
+    corpus = Corpus('test', str(archive.parent.parent))
+    assert all(result.success for result in corpus.convert_files_to_tei(0.4, decode_cache=False))
+    for part, member in enumerate(corpus.files, start=1):
+        with open(tei_path_for(member), 'rb') as tei_file:
+            assert f'>Teil {part}</title>'.encode('utf-8') in tei_file.read()
@@ -0,0 +1,26 @@
+import json
+import random
+from c64_diskmag_converter import benchmark
+from c64_diskmag_converter.d64_reader import D64Reader
+from c64_diskmag_converter.synthetic import build_d64, synthetic_files
+
+
+def test_synthetic_image_contains_the_files():
+    files = synthetic_files(random.Random(0))
+    reader = D64Reader(build_d64(files, disk_name='SYNTH 0'))
+    entries = reader.entries()
+    assert reader.header() == '0 "SYNTH 0         " 01 2A'
+    assert [(entry.name, entry.file_type) for entry in entries] == \
+        [(file.name.encode('ascii'), file.file_type) for file in files]
+    assert [reader.read(entry) for entry in entries] == [file.content for file in files]
+
+
+def test_benchmark_results(tmp_path, capsys):
+    output = tmp_path / 'results.json'
+    assert benchmark.main(['--images', '2', '--repeat', '1', '--output', str(output),
+                           '--workdir', str(tmp_path / 'corpus')]) == 0
+    results = json.loads(output.read_text(encoding='utf-8'))
+    assert list(results['stages']) == ['read', 'classify', 'decode', 'umlauts', 'newlines', 'tei']
+    assert results['end_to_end']['images'] == 2
+    assert results['end_to_end']['files'] == 12
+    assert 'ratio' in benchmark.compare(results, results)
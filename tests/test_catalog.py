@@ -0,0 +1,117 @@
+import os
+import zipfile
+import pytest
+from c64_diskmag_converter import catalog as catalog_module
+from c64_diskmag_converter.catalog import CorpusCatalog
+from c64_diskmag_converter.corpus import Corpus
+from c64_diskmag_converter.synthetic import build_d64
+
+
+def write_image(path, files=()):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(build_d64(list(files)))
+    return path
+
+
+def test_rescan_lists_changed_directories_only(tmp_path, monkeypatch):
+    first = write_image(tmp_path / 'Mag' / 'Mag 1' / 'a.d64')
+    write_image(tmp_path / 'Mag' / 'Mag 2' / 'a.d64')
+    assert CorpusCatalog.scan(str(tmp_path)).files == sorted(str(path) for path in tmp_path.glob('*/*/*.d64'))
+
+    listed = []
+    list_directory = CorpusCatalog.list_directory
+    monkeypatch.setattr(CorpusCatalog, 'list_directory',
+                        staticmethod(lambda path, mtime_ns: listed.append(path) or list_directory(path, mtime_ns)))
+    added = write_image(tmp_path / 'Mag' / 'Mag 1' / 'b.d64')
+    catalog = CorpusCatalog.scan(str(tmp_path))
+    # The root is listed again because the catalog itself is saved there
+    assert listed == [str(tmp_path), str(added.parent)]
+    assert [(image.path, image.is_partial, image.part) for image in catalog.issues()[('Mag', 'Mag 1')]] == \
+        [(str(first), True, 1), (str(added), True, 2)]
+
+    listed.clear()
+    os.remove(first)
+    catalog = CorpusCatalog.scan(str(tmp_path))
+    assert listed == [str(tmp_path), str(added.parent)]
+    assert str(first) not in catalog.files
+    assert not catalog.by_path[str(added)].is_partial
+
+
+def test_archive_members_are_grouped_by_archive(tmp_path):
+    archive = tmp_path / 'Mag' / 'Mag 3.zip'
+    archive.parent.mkdir(parents=True)
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('disk1.d64', build_d64([]))
+        zip_file.writestr('disk2.d64', build_d64([]))
+    catalog = CorpusCatalog.scan(str(tmp_path))
+    assert list(catalog.issues()) == [('Mag', 'Mag 3')]
+    assert [image.part for image in catalog.images] == [1, 2]
+    # Archived images keep their names
+    assert catalog.rename_plan() == []
+
+
+def test_rename_files(tmp_path):
+    issue = tmp_path / 'Mag' / 'Mag 1.88'
+    for name in ('b.d64', 'a.d64'):
+        write_image(issue / name)
+    write_image(tmp_path / 'Mag' / 'Mag 2' / 'single.d64')
+    corpus = Corpus('test', str(tmp_path))
+    expected = [(str(issue / 'a.d64'), str(issue / 'mag_1_88_1.d64')),
+                (str(issue / 'b.d64'), str(issue / 'mag_1_88_2.d64')),
+                (str(tmp_path / 'Mag' / 'Mag 2' / 'single.d64'), str(tmp_path / 'Mag' / 'Mag 2' / 'mag_2.d64'))]
+    assert corpus.rename_files(dry_run=True) == expected
+    assert os.path.exists(issue / 'a.d64')
+    assert corpus.rename_files() == expected
+    assert corpus.files == sorted(new for _, new in expected)
+    assert corpus.rename_files() == []
+
+
+def test_rename_does_not_overwrite_other_files(tmp_path):
+    issue = tmp_path / 'Mag' / 'Mag 1'
+    write_image(issue / 'a.d64')
+    (issue / 'mag_1.d64').mkdir()
+    with pytest.raises(ValueError):
+        Corpus('test', str(tmp_path)).rename_files()
+    assert os.path.exists(issue / 'a.d64')
+
+
+def test_catalog_of_a_read_only_corpus_is_not_saved(tmp_path, monkeypatch):
+    write_image(tmp_path / 'Mag' / 'Mag 1' / 'a.d64')
+    monkeypatch.setattr(catalog_module.os, 'replace', lambda *args: (_ for _ in ()).throw(PermissionError()))
+    assert len(CorpusCatalog.scan(str(tmp_path)).files) == 1
+    assert CorpusCatalog.load(str(tmp_path)) is None
+
+
+def test_images_are_numbered_in_natural_order(tmp_path):
+    issue = tmp_path / 'Mag' / 'Mag 5'
+    for name in ('x_10.d64', 'x_2.d64', 'b.d64', 'a.d64'):
+        write_image(issue / name)
+    archive = tmp_path / 'Mag' / 'Mag 6.zip'
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        for name in ('disk10.d64', 'disk2.d64'):
+            zip_file.writestr(name, build_d64([]))
+    catalog = CorpusCatalog.scan(str(tmp_path))
+    parts = {os.path.basename(image.path): image.part for image in catalog.images}
+    assert parts == {'x_2.d64': 1, 'x_10.d64': 2, 'a.d64': 3, 'b.d64': 4, 'disk2.d64': 1, 'disk10.d64': 2}
+
+
+def test_renaming_twice_changes_nothing(tmp_path):
+    issue = tmp_path / 'Mag' / 'Mag 7'
+    for number in range(12):
+        write_image(issue / f'disk{number}.d64')
+    corpus = Corpus('test', str(tmp_path))
+    plan = corpus.rename_files()
+    assert {os.path.basename(old): os.path.basename(new) for old, new in plan} == \
+        {f'disk{number}.d64': f'mag_7_{number + 1}.d64' for number in range(12)}
+    assert Corpus('test', str(tmp_path)).rename_files(dry_run=True) == []
+
+
+def test_numbered_images_keep_their_names(tmp_path):
+    issue = tmp_path / 'Mag' / 'Mag 8'
+    for name in ('mag_8_2.d64', 'mag_8_10.d64', 'extra.d64', 'mag_8_01.d64'):
+        write_image(issue / name)
+    catalog = CorpusCatalog.scan(str(tmp_path))
+    assert {os.path.basename(image.path): image.part for image in catalog.images} == \
+        {'mag_8_2.d64': 2, 'mag_8_10.d64': 10, 'mag_8_01.d64': 1, 'extra.d64': 3}
+    assert [(os.path.basename(old), os.path.basename(new)) for old, new in catalog.rename_plan()] == \
+        [('extra.d64', 'mag_8_3.d64'), ('mag_8_01.d64', 'mag_8_1.d64')]
@@ -0,0 +1,36 @@
+import random
+import pytest
+from c64_diskmag_converter.cli import main, read_report
+from c64_diskmag_converter.corpus import Corpus
+from c64_diskmag_converter.synthetic import build_d64, synthetic_files
+
+
+def test_shards_partition_the_corpus(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    shards = [corpus.shard_files(index, 3) for index in range(3)]
+    assert sorted(file for shard in shards for file in shard) == corpus.files
+    # Existing images keep their shard when images are added
+    (corpus_root / 'Neu' / 'Neu 1').mkdir(parents=True)
+    (corpus_root / 'Neu' / 'Neu 1' / 'neu.d64').write_bytes(build_d64(synthetic_files(random.Random(0))))
+    grown = Corpus('test', str(corpus_root))
+    for index, shard in enumerate(shards):
+        assert set(shard) <= set(grown.shard_files(index, 3))
+
+
+def test_sharded_conversion_and_merged_report(corpus_root, tmp_path):
+    reports = [str(tmp_path / f'report-{index}.jsonl') for index in range(3)]
+    for index, report in enumerate(reports):
+        assert main(['convert', str(corpus_root), '--shard', f'{index}/3', '--report', report]) == 0
+    merged = str(tmp_path / 'report.jsonl')
+    assert main(['merge', *reports, '--output', merged]) == 0
+    records = read_report(merged)
+    corpus = Corpus('test', str(corpus_root))
+    assert [record['path'] for record in records] == corpus.files
+    assert all(record['success'] and not record['skipped'] for record in records)
+    assert len(list(corpus_root.rglob('*.xml'))) == len(corpus.files)
+
+
+@pytest.mark.parametrize('shard', ['3/3', '1', 'a/b'])
+def test_invalid_shard(corpus_root, shard):
+    with pytest.raises(SystemExit):
+        main(['convert', str(corpus_root), '--shard', shard])
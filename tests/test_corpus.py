@@ -0,0 +1,131 @@
+import os
+import random
+import shutil
+import numpy as np
+import pytest
+from c64_diskmag_converter import corpus as corpus_module
+from c64_diskmag_converter.corpus import Corpus
+from c64_diskmag_converter.manifest import MANIFEST_NAME, ConversionManifest
+from c64_diskmag_converter.synthetic import build_d64, synthetic_files
+
+
+def tei_files(root):
+    return {path.relative_to(root): path.read_bytes() for path in sorted(root.rglob('*.xml'))}
+
+
+def test_parallel_conversion_matches_serial(corpus_root, tmp_path):
+    parallel_root = tmp_path / 'parallel'
+    shutil.copytree(corpus_root, parallel_root)
+    serial = Corpus('test', str(corpus_root)).convert_files_to_tei(0.4)
+    parallel = Corpus('test', str(parallel_root)).convert_files_to_tei(0.4, workers=2)
+    assert all(result.success for result in serial + parallel)
+    # Results are reported in the order of the corpus files
+    assert [os.path.relpath(result.path, corpus_root) for result in serial] == \
+        [os.path.relpath(result.path, parallel_root) for result in parallel]
+    assert tei_files(corpus_root) == tei_files(parallel_root)
+    assert len(tei_files(corpus_root)) == len(serial)
+
+
+def test_rerun_skips_unchanged_images(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    converted = tei_files(corpus_root)
+    results = corpus.convert_files_to_tei(0.4)
+    assert all(result.success and result.skipped for result in results)
+    assert tei_files(corpus_root) == converted
+
+
+def test_changed_inputs_are_converted_again(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    changed = corpus.files[2]
+    with open(changed, 'wb') as image:
+        image.write(build_d64(synthetic_files(random.Random(100))))
+    results = corpus.convert_files_to_tei(0.4)
+    assert [result.path for result in results if not result.skipped] == [changed]
+    # The threshold determines the content of every TEI file
+    assert not any(result.skipped for result in corpus.convert_files_to_tei(0.5))
+
+
+def test_truncated_manifest_line_is_ignored(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    # A run which was killed while appending to the manifest
+    with open(corpus_root / MANIFEST_NAME, 'a', encoding='utf-8') as manifest:
+        manifest.write('{"image": "Magazin/Ausgabe/ima')
+    results = corpus.convert_files_to_tei(0.4)
+    assert all(result.skipped for result in results)
+    lines = (corpus_root / MANIFEST_NAME).read_text(encoding='utf-8').splitlines()
+    assert len(lines) == len(corpus.files)
+
+
+def test_interrupted_conversion_resumes(corpus_root, monkeypatch):
+    convert_disk_image = corpus_module.convert_disk_image
+    converted = []
+
+    def interrupted(*args):
+        if len(converted) == 4:
+            raise KeyboardInterrupt
+        converted.append(args[0])
+        return convert_disk_image(*args)
+
+    monkeypatch.setattr(corpus_module, 'convert_disk_image', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        Corpus('test', str(corpus_root)).convert_files_to_tei(0.4)
+    monkeypatch.setattr(corpus_module, 'convert_disk_image', convert_disk_image)
+
+    corpus = Corpus('test', str(corpus_root))
+    results = corpus.convert_files_to_tei(0.4)
+    assert all(result.success for result in results)
+    # Only the images which were not finished before the interruption are converted again
+    assert sorted(result.path for result in results if result.skipped) == sorted(converted)
+    manifest = ConversionManifest(str(corpus_root), 0.4)
+    assert len(manifest.entries) == len(corpus.files)
+    assert corpus.metadata_index().images == set(manifest.entries)
+    with corpus.text_index() as text_index:
+        assert text_index.images == set(manifest.entries)
+
+
+def test_merged_shards_match_unsharded_conversion(corpus_root, tmp_path):
+    full_root = tmp_path / 'full'
+    shutil.copytree(corpus_root, full_root)
+    corpus = Corpus('test', str(corpus_root))
+    for index in range(3):
+        corpus.convert_files_to_tei(0.4, shard=(index, 3), ngram_size=3)
+    assert corpus.merge_shards() == 3
+    full = Corpus('test', str(full_root))
+    full.convert_files_to_tei(0.4, ngram_size=3)
+
+    merged_columns = corpus.metadata_index().columns
+    full_columns = full.metadata_index().columns
+    assert merged_columns.keys() == full_columns.keys()
+    for name, column in full_columns.items():
+        if column.dtype.kind == 'f':
+            np.testing.assert_allclose(merged_columns[name], column, equal_nan=True)
+        else:
+            np.testing.assert_array_equal(merged_columns[name], column)
+    with corpus.text_index() as merged_index, full.text_index() as full_index:
+        assert merged_index.images == full_index.images
+        assert merged_index.ngram_size == full_index.ngram_size
+        assert merged_index.frequencies() == full_index.frequencies()
+        assert merged_index.search('die') == full_index.search('die')
+
+
+def test_images_are_converted_again_when_their_issue_changes(disk_image):
+    first = disk_image(0, name='a_1')
+    root = first.parent.parent.parent
+    Corpus('test', str(root)).convert_files_to_tei(0.4)
+    assert b'>Teil 1<' not in first.with_suffix('.xml').read_bytes()
+
+    second = disk_image(1, name='b')
+    results = Corpus('test', str(root)).convert_files_to_tei(0.4)
+    # The first image becomes part 1 of the issue
+    assert not any(result.skipped for result in results)
+    assert b'>Teil 1<' in first.with_suffix('.xml').read_bytes()
+    assert b'>Teil 2<' in second.with_suffix('.xml').read_bytes()
+    assert all(result.skipped for result in Corpus('test', str(root)).convert_files_to_tei(0.4))
+
+    os.remove(second)
+    results = Corpus('test', str(root)).convert_files_to_tei(0.4)
+    assert [result.skipped for result in results] == [False]
+    assert b'>Teil 1<' not in first.with_suffix('.xml').read_bytes()
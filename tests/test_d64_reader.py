@@ -0,0 +1,64 @@
+import random
+import pytest
+from c64_diskmag_converter.corpus import convert_disk_image
+from c64_diskmag_converter.d64_reader import DIR_TRACK, SECTOR_SIZE, TRACK_OFFSETS, D64Reader
+from c64_diskmag_converter.diskmag import DiskmagC64
+from c64_diskmag_converter.synthetic import SyntheticFile, build_d64, synthetic_files
+
+# Offset of the first directory sector 18/1, which starts with the link to the next one
+DIR_SECTOR_OFFSET = TRACK_OFFSETS[DIR_TRACK - 1] + SECTOR_SIZE
+
+
+def corrupt_directory_link(path, track: int, sector: int):
+    image = bytearray(path.read_bytes())
+    image[DIR_SECTOR_OFFSET:DIR_SECTOR_OFFSET + 2] = bytes((track, sector))
+    path.write_bytes(bytes(image))
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_directory_and_contents_match_d64_library(tmp_path, seed):
+    d64 = pytest.importorskip('d64')
+    from d64.file import File
+    rng = random.Random(seed)
+    # More than eight files need a second directory sector
+    files = synthetic_files(rng, max_size=4000) + synthetic_files(rng, max_size=4000)
+    files.append(SyntheticFile(name='EMPTY', file_type='SEQ', content=b'', kind='petscii'))
+    path = tmp_path / 'image.d64'
+    path.write_bytes(build_d64(files, disk_name=f'SYNTH {seed}'))
+    with d64.DiskImage(path, mode='w') as image:
+        # A deleted file keeps its directory slot
+        image.path(files[rng.randrange(len(files))].name.encode('ascii')).unlink()
+
+    with d64.DiskImage(path) as image:
+        expected_directory = list(image.directory())
+        expected_contents = [File(entry.entry, 'r').read() for entry in image.glob(b'*')]
+    with D64Reader.from_path(path) as reader:
+        entries = reader.entries()
+        assert reader.directory(entries) == expected_directory
+        assert [reader.read(entry) for entry in entries] == expected_contents
+
+
+def test_circular_directory_chain(disk_image):
+    path = disk_image()
+    corrupt_directory_link(path, DIR_TRACK, 1)
+    diskmag = DiskmagC64(str(path), is_partial=False)
+    assert diskmag.directory is None
+    # The memory map is released although the error traceback referenced its sectors
+    assert diskmag.reader.buffer.closed
+
+
+def test_directory_link_to_invalid_track(disk_image):
+    path = disk_image()
+    corrupt_directory_link(path, 40, 0)
+    diskmag = DiskmagC64(str(path), is_partial=False)
+    assert diskmag.directory is None
+    assert diskmag.reader.buffer.closed
+
+
+def test_corrupt_directory_is_reported_as_error(disk_image):
+    path = disk_image()
+    corrupt_directory_link(path, 40, 0)
+    result = convert_disk_image(str(path), 0.4)
+    assert not result.success
+    assert result.error.startswith('Error while creating tei file')
+    assert not list(path.parent.glob('*.xml'))
@@ -0,0 +1,82 @@
+import itertools
+import random
+import shutil
+from types import SimpleNamespace
+from c64_diskmag_converter import decode_cache as decode_cache_module
+from c64_diskmag_converter import text_processing
+from c64_diskmag_converter.corpus import Corpus
+from c64_diskmag_converter.decode_cache import DECODE_CACHE_NAME, DecodeCache
+from c64_diskmag_converter.synthetic import german_text
+from c64_diskmag_converter.text_processing import TextMetaData
+
+
+def counting_decoder(monkeypatch):
+    calls = []
+    decode_text = text_processing.decode_text
+
+    def counted(content, char_threshold):
+        calls.append(content)
+        return decode_text(content, char_threshold)
+
+    monkeypatch.setattr(text_processing, 'decode_text', counted)
+    return calls
+
+
+def test_identical_files_are_decoded_once(tmp_path, monkeypatch):
+    calls = counting_decoder(monkeypatch)
+    content = german_text(random.Random(0), 2000).encode('petscii_c64en_lc', errors='replace')
+    with DecodeCache(str(tmp_path / DECODE_CACHE_NAME)) as cache:
+        first = TextMetaData.from_binary('A', 1, 'SEQ', content, 0.4, decode_cache=cache)
+        second = TextMetaData.from_binary('B', 2, 'SEQ', content, 0.4, decode_cache=cache)
+        assert len(calls) == 1
+        assert (second.text, second.mapping, second.col_length) == (first.text, first.mapping, first.col_length)
+        # The threshold is part of the key
+        TextMetaData.from_binary('A', 1, 'SEQ', content, 0.5, decode_cache=cache)
+        assert len(calls) == 2
+    assert first == TextMetaData.from_binary('A', 1, 'SEQ', content, 0.4)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path, monkeypatch):
+    clock = itertools.count()
+    monkeypatch.setattr(decode_cache_module, 'time', SimpleNamespace(time=lambda: next(clock)))
+    result = (1.0, 'x' * 100, 40, 'Textdokument', {}, 'PETSCII')
+    with DecodeCache(str(tmp_path / DECODE_CACHE_NAME), max_bytes=300) as cache:
+        for content in (b'a', b'b', b'c'):
+            cache.put(content, 0.4, result)
+        assert cache.get(b'a', 0.4) == result
+        assert cache.evict() == 1
+        assert cache.size() <= 300
+        assert cache.get(b'b', 0.4) is None
+        assert cache.get(b'a', 0.4) == result and cache.get(b'c', 0.4) == result
+
+
+def test_cached_conversion_matches_uncached(corpus_root, tmp_path, monkeypatch):
+    plain_root = tmp_path / 'plain'
+    shutil.copytree(corpus_root, plain_root)
+    Corpus('test', str(plain_root)).convert_files_to_tei(0.4, decode_cache=False)
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    calls = counting_decoder(monkeypatch)
+    corpus.convert_files_to_tei(0.4, incremental=False)
+    # Every file of the second run was decoded before
+    assert calls == []
+    assert not (plain_root / DECODE_CACHE_NAME).exists()
+    for tei_path in plain_root.rglob('*.xml'):
+        assert tei_path.read_bytes() == (corpus_root / tei_path.relative_to(plain_root)).read_bytes()
+
+
+def test_shards_only_use_a_given_cache(corpus_root, tmp_path, monkeypatch):
+    corpus = Corpus('test', str(corpus_root))
+    for index in range(2):
+        corpus.convert_files_to_tei(0.4, shard=(index, 2))
+    # The corpus root may be on a network file system shared by the shards
+    assert not (corpus_root / DECODE_CACHE_NAME).exists()
+
+    local_cache = tmp_path / 'node' / 'decode.sqlite'
+    local_cache.parent.mkdir()
+    for index in range(2):
+        corpus.convert_files_to_tei(0.4, incremental=False, shard=(index, 2), cache_path=str(local_cache))
+    assert local_cache.exists() and not (corpus_root / DECODE_CACHE_NAME).exists()
+    calls = counting_decoder(monkeypatch)
+    corpus.convert_files_to_tei(0.4, incremental=False, cache_path=str(local_cache))
+    assert calls == []
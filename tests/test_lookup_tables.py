@@ -0,0 +1,49 @@
+from collections import Counter
+import numpy as np
+import pytest
+from c64_diskmag_converter import lookup_tables
+from c64_diskmag_converter.lookup_tables import compile_trigram_table, load_compiled, pack_trigrams
+from c64_diskmag_converter.trigram_builder import write_trigram_binary
+
+
+def test_compiled_table_is_cached_until_the_csv_changes(tmp_path, monkeypatch):
+    monkeypatch.setattr(lookup_tables, 'CACHE_DIR', str(tmp_path / 'cache'))
+    csv_path = tmp_path / 'trigrams.csv'
+    csv_path.write_text('trigram,frequency,percentage\nDer,10,0.5\nDie,10,0.5\n', encoding='utf-8')
+    compiled = []
+
+    def compile_table(path):
+        compiled.append(path)
+        return compile_trigram_table(path)
+
+    table = load_compiled(str(csv_path), compile_table)
+    assert table.lookup == {'Der': 0.5, 'Die': 0.5}
+    assert load_compiled(str(csv_path), compile_table).lookup == table.lookup
+    assert len(compiled) == 1
+    csv_path.write_text('trigram,frequency,percentage\nDas,10,1.0\n', encoding='utf-8')
+    assert load_compiled(str(csv_path), compile_table).lookup == {'Das': 1.0}
+    assert len(compiled) == 2
+
+
+def test_compiled_keys_find_the_logprobs():
+    table = lookup_tables.load_beginning_trigrams()
+    assert np.all(np.diff(table.keys) > 0)
+    for trigram in ('ver', 'Sch', 'sch'):
+        codes = [np.array([ord(char)]) for char in trigram]
+        position = np.searchsorted(table.keys, pack_trigrams(*codes)[0])
+        assert table.logprobs[position] == np.log(table.lookup[trigram])
+
+
+def test_rows_read_as_missing_by_pandas_are_skipped(tmp_path):
+    csv_path = tmp_path / 'trigrams.csv'
+    csv_path.write_text('trigram,frequency,percentage\nnan,2,0.2\nNan,3,0.3\nNaN,1,0.1\nder,4,0.4\n',
+                        encoding='utf-8')
+    table = compile_trigram_table(str(csv_path))
+    assert table.lookup == {'Nan': 0.3, 'der': 0.4}
+    assert len(table.keys) == len(table.logprobs) == 2
+    npz_path = tmp_path / 'trigrams.npz'
+    write_trigram_binary(Counter({'nan': 2, 'Nan': 3, 'NaN': 1, 'der': 4}), str(npz_path))
+    binary = compile_trigram_table(str(npz_path))
+    assert binary.lookup == pytest.approx(table.lookup)
+    np.testing.assert_array_equal(binary.keys, table.keys)
+    np.testing.assert_allclose(binary.logprobs, table.logprobs)
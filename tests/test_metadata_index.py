@@ -0,0 +1,29 @@
+import os
+from c64_diskmag_converter.corpus import Corpus
+
+
+def test_index_has_one_row_per_file(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    rows = corpus.query_files()
+    # Every synthetic image holds six files
+    assert len(rows) == 6 * len(corpus.files)
+    for row in rows:
+        tei = (corpus_root / row['image']).with_suffix('.xml').read_bytes()
+        div = tei[row['div_start']:row['div_end']].decode('utf-8')
+        assert div.startswith('<div') and div.endswith('</div>')
+        assert f'>{row["filetype"]}<' in div
+    texts = corpus.query_files(['image', 'line_length'], filetype='Textdokument')
+    assert texts and all(set(row) == {'image', 'line_length'} for row in texts)
+    assert corpus.metadata_index().value_counts('filetype')['Textdokument'] == len(texts)
+
+
+def test_index_follows_removed_images(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    removed = corpus.files[0]
+    os.remove(removed)
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    assert os.path.relpath(removed, corpus_root).replace(os.sep, '/') not in corpus.metadata_index().images
+    assert len(corpus.metadata_index().images) == len(corpus.files)
@@ -0,0 +1,33 @@
+import json
+import shutil
+import pytest
+from c64_diskmag_converter.corpus import Corpus
+
+
+def test_profiled_conversion(corpus_root, tmp_path):
+    plain_root = tmp_path / 'plain'
+    shutil.copytree(corpus_root, plain_root)
+    corpus = Corpus('test', str(corpus_root))
+    results = corpus.convert_files_to_tei(0.4, profile=True)
+    Corpus('test', str(plain_root)).convert_files_to_tei(0.4)
+
+    totals = corpus.stats['totals']
+    assert totals['images'] == len(corpus.files)
+    # Every synthetic image holds six files
+    assert totals['files'] == sum(len(result.stats['files']) for result in results) == 6 * len(corpus.files)
+    assert {'read_directory', 'entropy', 'decode', 'umlauts', 'newlines', 'xml'} <= set(totals['stages'])
+    assert totals['measures']['bytes'] > 0
+    # Profiling does not change the output
+    for tei_path in corpus_root.rglob('*.xml'):
+        assert tei_path.read_bytes() == (plain_root / tei_path.relative_to(corpus_root)).read_bytes()
+
+    stats_path = tmp_path / 'stats.json'
+    corpus.export_stats(str(stats_path))
+    assert json.loads(stats_path.read_text(encoding='utf-8'))['totals'] == totals
+
+
+def test_conversion_without_profiling(corpus_root, tmp_path):
+    corpus = Corpus('test', str(corpus_root))
+    assert all(result.stats is None for result in corpus.convert_files_to_tei(0.4))
+    with pytest.raises(ValueError):
+        corpus.export_stats(str(tmp_path / 'stats.json'))
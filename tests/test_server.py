@@ -0,0 +1,95 @@
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlencode
+import pytest
+from c64_diskmag_converter.corpus import convert_disk_image
+from c64_diskmag_converter.server import ConversionService, create_server
+
+
+@pytest.fixture(scope='module')
+def service():
+    service = ConversionService(workers=1, queue_size=1)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def request_service(service):
+    server = create_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    def request(method: str, path: str, params=None, body=None):
+        connection = http.client.HTTPConnection(*server.server_address[:2], timeout=30)
+        try:
+            connection.request(method, f'{path}?{urlencode(params or {})}', body=body)
+            response = connection.getresponse()
+            return response.status, response.read()
+        finally:
+            connection.close()
+    yield request
+    server.shutdown()
+    server.server_close()
+
+
+def test_converted_path_matches_tei_file(request_service, disk_image):
+    path = disk_image(seed=4)
+    status, body = request_service('POST', '/convert', {'path': str(path)})
+    assert status == 200
+    assert convert_disk_image(str(path), 0.4).success
+    assert body == path.with_suffix('.xml').read_bytes()
+
+
+def test_metadata_of_sent_disk_image(request_service, disk_image):
+    path = disk_image(seed=5)
+    params = {'format': 'metadata', 'magazine': 'Mag', 'issue': 'Mag 1', 'name': 'disk'}
+    status, body = request_service('POST', '/convert', params, body=path.read_bytes())
+    assert status == 200
+    metadata = json.loads(body)
+    assert (metadata['magazine'], metadata['issue'], metadata['image']) == ('Mag', 'Mag 1', 'disk')
+    assert [file['xml_id'] for file in metadata['files']] == list(range(1, 7))
+    # Issues outside the issue index have no TEI header
+    params['format'] = 'tei'
+    assert request_service('POST', '/convert', params, body=path.read_bytes())[0] == 422
+
+
+def test_invalid_requests(request_service, service):
+    assert request_service('GET', '/unknown')[0] == 404
+    assert request_service('POST', '/convert')[0] == 400
+    assert request_service('POST', '/convert', {'path': 'x.d64', 'format': 'html'})[0] == 400
+    assert request_service('POST', '/convert', {'path': 'x.d64', 'threshold': 'high'})[0] == 400
+    assert request_service('POST', '/convert', {'path': 'missing.d64'})[0] == 422
+    status, body = request_service('GET', '/status')
+    assert status == 200 and json.loads(body)['requests'] == 0
+
+
+def test_requests_beyond_the_queue_are_rejected(service):
+    # Occupies the slots of the worker and of the queue
+    for _ in range(service.workers + service.queue_size):
+        assert service.slots.acquire(blocking=False)
+    try:
+        assert service.convert('x.d64')[0] == 503
+    finally:
+        for _ in range(service.workers + service.queue_size):
+            service.slots.release()
+
+
+def test_timed_out_requests_keep_their_slot():
+    service = ConversionService(workers=1, queue_size=1, timeout=0.1)
+    try:
+        # Keeps the only worker busy, so that the conversions wait in the pool
+        busy = service.pool.apply_async(time.sleep, (1,))
+        assert service.convert('missing.d64')[0] == 504
+        assert service.convert('missing.d64')[0] == 504
+        assert service.convert('missing.d64')[0] == 503
+        busy.wait()
+        deadline = time.monotonic() + 10
+        while service.status()['requests'] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert service.status()['requests'] == 0
+        service.timeout = None
+        assert service.convert('missing.d64')[0] == 422
+    finally:
+        service.close()
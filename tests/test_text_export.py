@@ -0,0 +1,59 @@
+import gzip
+import json
+import pytest
+from c64_diskmag_converter.cli import main
+from c64_diskmag_converter.corpus import Corpus
+from c64_diskmag_converter.text_export import TextExportWriter
+
+
+def read_jsonl(paths):
+    records = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as export_file:
+            records.extend(json.loads(line) for line in export_file)
+    return sorted(records, key=lambda record: (record['image'], record['xml_id']))
+
+
+def test_export_matches_the_metadata_index(corpus_root, tmp_path):
+    corpus = Corpus('test', str(corpus_root))
+    paths, errors = corpus.export_texts(str(tmp_path / 'export'), 0.4, compression='gzip', records_per_file=10)
+    assert errors == {}
+    assert [path.rsplit('/', 1)[1] for path in paths] == [f'texts-{number:05d}.jsonl.gz' for number in range(4)]
+    records = read_jsonl(paths)
+    # The export does not write TEI
+    assert not list(corpus_root.rglob('*.xml'))
+
+    corpus.convert_files_to_tei(0.4)
+    rows = corpus.query_files(['image', 'xml_id', 'filename', 'filetype', 'line_length', 'text_chars'])
+    assert len(records) == len(rows)
+    for record, row in zip(records, rows):
+        assert (record['image'], record['xml_id'], record['filename'], record['filetype'], record['col_length']) == \
+            (row['image'], row['xml_id'], row['filename'], row['filetype'], row['line_length'])
+        assert (len(record['text']) if record['text'] else None) == row['text_chars']
+
+
+def test_conversion_exports_the_same_records(corpus_root, tmp_path):
+    corpus = Corpus('test', str(corpus_root))
+    exported = read_jsonl(corpus.export_texts(str(tmp_path / 'export'), 0.4, workers=2)[0])
+    assert main(['convert', str(corpus_root), '--export', str(tmp_path / 'convert'), '--report',
+                 str(tmp_path / 'report.jsonl')]) == 0
+    assert read_jsonl([str(path) for path in (tmp_path / 'convert').iterdir()]) == exported
+
+
+def test_parquet_export(corpus_root, tmp_path):
+    parquet = pytest.importorskip('pyarrow.parquet')
+    corpus = Corpus('test', str(corpus_root))
+    jsonl = read_jsonl(corpus.export_texts(str(tmp_path / 'jsonl'), 0.4)[0])
+    paths, _ = corpus.export_texts(str(tmp_path / 'parquet'), 0.4, export_format='parquet')
+    records = [row for path in paths for row in parquet.read_table(path).to_pylist()]
+    for record in records:
+        record['mapping'] = json.loads(record['mapping']) if record['mapping'] else None
+    assert sorted(records, key=lambda record: (record['image'], record['xml_id'])) == jsonl
+
+
+def test_invalid_export_options(tmp_path):
+    with pytest.raises(ValueError):
+        TextExportWriter(str(tmp_path), 'csv')
+    with pytest.raises(ValueError):
+        TextExportWriter(str(tmp_path), 'jsonl', compression='zip')
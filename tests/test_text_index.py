@@ -0,0 +1,56 @@
+import os
+from c64_diskmag_converter import diskmag as diskmag_module
+from c64_diskmag_converter.corpus import Corpus, convert_disk_image
+from c64_diskmag_converter.text_index import token_counts, unwrap_lines
+
+
+def test_token_counts_join_wrapped_lines():
+    assert unwrap_lines('abcd\nefgh\nij', 4) == 'abcdefghij'
+    assert token_counts('Die Diskette\nist da, die\nnächste', None) == {'die': 2, 'diskette': 1, 'ist': 1,
+                                                                          'da': 1, 'nächste': 1}
+    assert token_counts(None) == {}
+
+
+def test_search_finds_the_extracted_texts(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4, ngram_size=3)
+    hits = corpus.search('die')
+    assert hits
+    assert [hit['hits'] for hit in hits] == sorted((hit['hits'] for hit in hits), reverse=True)
+    with corpus.text_index() as index:
+        assert index.images == corpus.metadata_index().images
+        assert index.document_frequency('DIE') == len(hits)
+        assert index.frequencies()['die'] == sum(hit['hits'] for hit in hits)
+        tokens = index.matching_tokens('skett')
+        assert 'diskette' in tokens and all('skett' in token for token in tokens)
+        assert index.search_fragment('skett') == index.search(' '.join(tokens), match_all=False)
+    assert len(corpus.search('die', limit=1)) == 1
+    assert corpus.search('die kein_wort') == []
+    assert corpus.search('die kein_wort', match_all=False) == hits
+
+
+def test_removed_images_leave_the_index(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    with corpus.text_index() as index:
+        frequencies = index.frequencies()
+    removed = corpus.files[0]
+    os.remove(removed)
+    corpus = Corpus('test', str(corpus_root))
+    corpus.convert_files_to_tei(0.4)
+    image = os.path.relpath(removed, corpus_root).replace(os.sep, '/')
+    with corpus.text_index() as index:
+        assert image not in index.images
+        assert all(hit['image'] != image for hit in index.search('die'))
+        assert sum(index.frequencies().values()) < sum(frequencies.values())
+
+
+def test_tokens_are_only_counted_for_the_index(corpus_root, monkeypatch):
+    corpus = Corpus('test', str(corpus_root))
+    assert convert_disk_image(corpus.files[0], 0.4).tokens is None
+    assert len(convert_disk_image(corpus.files[0], 0.4, count_tokens=True).tokens) == 6
+
+    def tokenize(*args):
+        raise AssertionError('tokenized without text index')
+    monkeypatch.setattr(diskmag_module, 'token_counts', tokenize)
+    assert all(result.success for result in corpus.convert_files_to_tei(0.4, text_index=False))
@@ -0,0 +1,106 @@
+import random
+import pytest
+from c64_diskmag_converter import text_processing
+from c64_diskmag_converter.synthetic import german_text, synthetic_files
+
+reference = pytest.importorskip('reference', reason='The reference implementations require scipy and pandas')
+
+
+def sample_texts(seed: int, count: int):
+    rng = random.Random(seed)
+    alphabet = 'abcdefghijklmnopqrstuvwxyzäöüßABCDEÜ     .,!?;-\n"ŁŦ─1'
+    texts = ['', 'a', 'ab', 'abc', 'a b', ' - ']
+    for index in range(count):
+        if index % 2:
+            texts.append(''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 3000))))
+        else:
+            texts.append(german_text(rng, rng.randint(0, 3000), rng.randint(40, 80)))
+    return texts
+
+
+def sample_binaries(seed: int, count: int):
+    rng = random.Random(seed)
+    binaries = [b'\n', b'\n\r\n', b'\r\n\r', b'a', b'\x00']
+    for _ in range(count // 6):
+        binaries += [file.content for file in synthetic_files(rng, max_size=3000)]
+    for _ in range(count):
+        pool = rng.choice([b'abcdefgh \n\r', bytes(range(256)), b'ABCxyz\n\r\n\r.,', b'\x00\x01\xa9\x8d'])
+        binaries.append(bytes(rng.choice(pool) for _ in range(rng.randint(1, 3000))))
+    return binaries
+
+
+@pytest.mark.parametrize('text', sample_texts(seed=1, count=60))
+def test_insert_newlines_matches_reference(text):
+    assert text_processing.insert_newlines(text) == reference.insert_newlines(text)
+
+
+def custom_umlaut_texts(seed: int, count: int):
+    rng = random.Random(seed)
+    glyphs = list('─┼│▒▌▄▔▁▏▕├▗└┐▂┌┴┬┤▎▍▃✓▖▝┘▘▚')
+    for _ in range(count):
+        umlauts = rng.sample(list('äöüÄÜß'), rng.randint(1, 6))
+        table = dict(zip(umlauts, rng.sample(glyphs, len(umlauts))))
+        yield ''.join(table.get(char, char) for char in german_text(rng, rng.randint(50, 1500)))
+
+
+def test_replace_custom_umlauts_finds_optimal_mapping():
+    for text in custom_umlaut_texts(seed=3, count=100):
+        expected_text, expected_mapping, expected_score = reference.replace_custom_umlauts(text)
+        replaced, mapping = text_processing.replace_custom_umlauts(text)
+        if not expected_mapping:
+            assert (replaced, mapping) == (text, {})
+            continue
+        # Mappings with the same score are equally good, only the score has to be optimal
+        trigrams = reference.umlaut_trigrams(text)
+        assert reference.mapping_score(trigrams, mapping) == pytest.approx(expected_score, rel=1e-9)
+        assert replaced == text.translate(str.maketrans(mapping))
+        if mapping == expected_mapping:
+            assert replaced == expected_text
+
+
+def test_replace_custom_umlauts_without_candidates():
+    text = 'Ein Text ohne Ersatzzeichen'
+    assert text_processing.replace_custom_umlauts(text) == (text, {})
+
+
+def test_more_replacement_characters_than_umlauts():
+    table = {'ä': '▒', 'ö': '│', 'ü': '┼', 'ß': '▌'}
+    text = ''.join(table.get(char, char) for char in german_text(random.Random(4), 3000))
+    text += ' ' + ' '.join(f'a{glyph}b' for glyph in '▔▁▏▕├▗└┐')
+    _, mapping = text_processing.replace_custom_umlauts(text)
+    # The characters which fit worst stay unchanged, every umlaut is used at most once
+    assert len(mapping) <= len(text_processing.UMLAUTS)
+    assert len(set(mapping.values())) == len(mapping)
+    assert {mapping.get(glyph) for glyph in table.values()} == set(table)
+
+
+@pytest.mark.parametrize('binary_text', sample_binaries(seed=5, count=60))
+def test_classification_matches_reference(binary_text):
+    entropy, _, _, filetype, _, encoding = text_processing.decode_text(binary_text, 0.4)
+    assert (entropy, filetype, encoding) == reference.classify(binary_text, 0.4)
+
+
+def test_decoding_matches_reference():
+    for binary_text in sample_binaries(seed=7, count=12):
+        _, _, encoding = reference.classify(binary_text, 0.4)
+        if encoding is None:
+            continue
+        texts, _ = reference.decoded_texts(binary_text)
+        encoding_index = [name for _, name in text_processing.ENCODING_MAPPING.values()].index(encoding)
+        assert text_processing.decode_with_encoding(binary_text, encoding_index) == texts[encoding_index]
+
+
+def na_trigram_texts(seed: int, count: int):
+    rng = random.Random(seed)
+    for _ in range(count):
+        chars = list(german_text(rng, rng.randint(500, 3000), rng.randint(40, 80)).replace('\n', ''))
+        col_length = rng.randint(40, 80)
+        # pandas reads the trigram rows 'nan' and 'NaN' of the table as missing values
+        for start in range(0, len(chars) - 3, col_length):
+            chars[start:start + 3] = rng.choice(['nan', 'NaN', 'Nan'])
+        yield ''.join(chars)
+
+
+@pytest.mark.parametrize('text', list(na_trigram_texts(seed=0, count=20)))
+def test_insert_newlines_ignores_missing_trigrams(text):
+    assert text_processing.insert_newlines(text) == reference.insert_newlines(text)
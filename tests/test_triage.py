@@ -0,0 +1,39 @@
+import pytest
+from c64_diskmag_converter.cli import main, read_report
+from c64_diskmag_converter.corpus import Corpus
+
+
+def test_triage_matches_the_conversion(corpus_root):
+    corpus = Corpus('test', str(corpus_root))
+    rows = corpus.triage(0.4)
+    corpus.convert_files_to_tei(0.4, decode_cache=False)
+    columns = ['image', 'xml_id', 'filename', 'filetype', 'encoding', 'entropy']
+    converted = corpus.query_files(columns)
+    assert len(rows) == len(converted)
+    for row, record in zip(rows, converted):
+        assert {column: row[column] for column in columns[:-1]} == {column: record[column] for column in columns[:-1]}
+        if record['entropy'] is None:
+            assert row['entropy'] is None
+        else:
+            assert row['entropy'] == pytest.approx(record['entropy'])
+    assert not any(row['sampled'] for row in rows)
+
+
+def test_sampled_triage(corpus_root):
+    rows = Corpus('test', str(corpus_root)).triage(0.4, workers=2, sample_size=256)
+    assert all(row['sampled'] == (row['size'] > 256) for row in rows)
+    assert any(row['sampled'] for row in rows)
+
+
+def test_triage_command(corpus_root, tmp_path):
+    unreadable = corpus_root / 'Neu' / 'Neu 1' / 'neu.d64'
+    unreadable.parent.mkdir(parents=True)
+    unreadable.write_bytes(b'no disk image')
+    report = tmp_path / 'triage.jsonl'
+    assert main(['triage', str(corpus_root), '--report', str(report)]) == 0
+    rows = read_report(str(report))
+    assert rows == Corpus('test', str(corpus_root)).triage(0.4)
+    assert [row for row in rows if 'error' in row] == [{'image': 'Neu/Neu 1/neu.d64',
+                                                       'error': 'Error reading the directory of the disk image'}]
+    # Triage does not write TEI files
+    assert not list(corpus_root.rglob('*.xml'))
@@ -0,0 +1,76 @@
+import csv
+import gzip
+import re
+from collections import Counter
+import numpy as np
+import pytest
+from c64_diskmag_converter.lookup_tables import compile_trigram_table
+from c64_diskmag_converter.trigram_builder import build_trigram_tables, count_trigrams
+
+# Patterns of data/trigram_tables/create_trigram_tables.ipynb, which created the shipped tables
+NOTEBOOK_UMLAUT = re.compile(r'([a-zA-ZäöüÄÖÜ][äöüÄÖÜß][a-zA-ZäöüÄÖÜß]|[äöüÄÖÜß][a-zA-ZäöüÄÖÜß]{2})')
+NOTEBOOK_BEGINNING = re.compile(r'\b([\wäöüÄÖÜß]{3})')
+WORDS = [('Spiel', 40), ('Spiele', 25), ('schön', 12), ('Tür', 9), ('Grafik', 7), ('Maße', 5), ('für', 30)]
+
+
+@pytest.fixture
+def word_list(tmp_path):
+    path = tmp_path / 'words.txt.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as word_file:
+        for rank, (word, frequency) in enumerate(WORDS, start=1):
+            word_file.write(f'{rank}\t{word}\t{frequency}\n')
+    return str(path)
+
+
+def test_counts_of_a_frequency_list(word_list):
+    beginnings, umlauts = count_trigrams([word_list])
+    assert beginnings == {'Spi': 65, 'sch': 12, 'Tür': 9, 'Gra': 7, 'Maß': 5, 'für': 30}
+    assert umlauts == {'hön': 12, 'Tür': 9, 'aße': 5, 'für': 30}
+    # Chunks counted in worker processes give the same frequencies
+    assert count_trigrams([word_list], workers=2, chunk_lines=2) == (beginnings, umlauts)
+
+
+def test_binary_table_matches_csv_table(word_list, tmp_path):
+    output_dir = tmp_path / 'tables'
+    written = build_trigram_tables([word_list], str(output_dir), chunk_lines=3)
+    assert sorted(written) == sorted(str(output_dir / name) for name in (
+        'beginning_trigrams.csv', 'beginning_trigrams.npz', 'umlaut_trigrams.csv', 'umlaut_trigrams.npz'))
+    with open(output_dir / 'beginning_trigrams.csv', encoding='utf-8', newline='') as csv_file:
+        rows = list(csv.DictReader(csv_file))
+    assert [row['trigram'] for row in rows] == ['Spi', 'für', 'sch', 'Tür', 'Gra', 'Maß']
+    assert sum(float(row['percentage']) for row in rows) == pytest.approx(1)
+    for name in ('beginning_trigrams', 'umlaut_trigrams'):
+        from_csv = compile_trigram_table(str(output_dir / f'{name}.csv'))
+        from_binary = compile_trigram_table(str(output_dir / f'{name}.npz'))
+        np.testing.assert_array_equal(from_binary.keys, from_csv.keys)
+        np.testing.assert_allclose(from_binary.logprobs, from_csv.logprobs)
+        assert from_binary.lookup == pytest.approx(from_csv.lookup)
+
+
+def test_counts_match_the_notebook(tmp_path):
+    words = [('der', 900), ('Grüße', 14), ('US-Präsident', 11), ('2ä3x', 3), ('Öl', 6), ('Fußball-WM', 8),
+             ('Größe', 5), ('"Spiel"', 4), ('über', 20)]
+    path = tmp_path / 'words.txt'
+    path.write_text(''.join(f'{rank}\t{word}\t{frequency}\n' for rank, (word, frequency) in enumerate(words, start=1)),
+                    encoding='utf-8')
+    beginnings, umlauts = Counter(), Counter()
+    # The notebook skips the most frequent entries
+    for word, frequency in words[1:]:
+        for trigram in NOTEBOOK_BEGINNING.findall(word):
+            beginnings[trigram] += frequency
+        for trigram in NOTEBOOK_UMLAUT.findall(word):
+            umlauts[trigram] += frequency
+    assert count_trigrams([str(path)], skip_lines=1) == (beginnings, umlauts)
+    assert umlauts['röß'] == 5 and 'öße' not in umlauts
+
+
+def test_text_input(tmp_path):
+    path = tmp_path / 'text.txt'
+    path.write_text('Die Tür ist 42\nschön\n', encoding='utf-8')
+    beginnings, umlauts = count_trigrams([str(path)], input_format='text')
+    assert beginnings == {'Die': 1, 'Tür': 1, 'ist': 1, 'sch': 1}
+    assert umlauts == {'Tür': 1, 'hön': 1}
+    # Lines of a text are no frequency rows
+    assert count_trigrams([str(path)]) == (Counter(), Counter())
+    with pytest.raises(ValueError):
+        count_trigrams([str(path)], input_format='csv')
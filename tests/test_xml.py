@@ -0,0 +1,71 @@
+import pytest
+from lxml import etree
+from c64_diskmag_converter import diskmag as diskmag_module
+from c64_diskmag_converter.diskmag import DiskmagC64
+from c64_diskmag_converter.text_processing import TextMetaData
+from c64_diskmag_converter.xml_markup_creator import TEI_NAMESPACE, attach_front, attach_header, attach_text_div
+
+
+def tree_serialization(diskmag: DiskmagC64, char_threshold: float) -> bytes:
+    """
+    Serializes the complete TEI tree at once, as the converter did before writing it incrementally
+    """
+    root = etree.Element('TEI', xmlns=TEI_NAMESPACE)
+    attach_header(root, diskmag.image_number, diskmag.diskmag, diskmag.issue, 'Tomash Shtohryn', diskmag.record)
+    text_elem = etree.SubElement(root, 'text')
+    attach_front(text_elem, diskmag.directory)
+    body = etree.SubElement(text_elem, 'body')
+    for index, (filename, file_ext, content) in enumerate(diskmag.contents):
+        attach_text_div(body, TextMetaData.from_binary(filename=filename, xml_id=index + 1, file_ext=file_ext,
+                                                       content=content, char_threshold=char_threshold))
+    tree = etree.ElementTree(root)
+    etree.indent(tree)
+    return etree.tostring(tree, pretty_print=True, xml_declaration=True, encoding='UTF-8', method='xml')
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_streamed_tei_matches_tree_serialization(disk_image, seed):
+    path = disk_image(seed)
+    assert DiskmagC64(str(path)).convert_to_tei(0.4) is None
+    assert path.with_suffix('.xml').read_bytes() == tree_serialization(DiskmagC64(str(path)), 0.4)
+
+
+def test_tei_of_partial_image(disk_image):
+    disk_image(0, name='image_1')
+    path = disk_image(1, name='image_2')
+    diskmag = DiskmagC64(str(path))
+    assert diskmag.image_number == 2
+    assert diskmag.convert_to_tei(0.4) is None
+    assert path.with_suffix('.xml').read_bytes() == tree_serialization(DiskmagC64(str(path)), 0.4)
+
+
+def test_part_of_the_catalog_names_the_image(disk_image):
+    disk_image(0, name='disk_a')
+    path = disk_image(1, name='disk_b')
+    assert DiskmagC64(str(path)).image_number is None
+    diskmag = DiskmagC64(str(path), is_partial=True, part=2)
+    assert diskmag.image_number == 2
+    assert diskmag.convert_to_tei(0.4) is None
+    assert b'>Teil 2</title>' in path.with_suffix('.xml').read_bytes()
+    # Standalone images are numbered by all trailing digits of their name
+    assert DiskmagC64(str(disk_image(2, name='image_12')), is_partial=True).image_number == 12
+
+
+def test_tei_without_files(disk_image):
+    path = disk_image(files=[])
+    assert DiskmagC64(str(path)).convert_to_tei(0.4) is None
+    assert path.with_suffix('.xml').read_bytes() == tree_serialization(DiskmagC64(str(path)), 0.4)
+
+
+def test_failed_conversion_keeps_previous_tei(disk_image, monkeypatch):
+    path = disk_image()
+    DiskmagC64(str(path)).convert_to_tei(0.4)
+    converted = path.with_suffix('.xml').read_bytes()
+
+    def broken_div(parent, metadata):
+        raise RuntimeError('broken')
+
+    monkeypatch.setattr(diskmag_module, 'attach_text_div', broken_div)
+    assert DiskmagC64(str(path)).convert_to_tei(0.4) == 'Error accessing disk image: broken'
+    assert path.with_suffix('.xml').read_bytes() == converted
+    assert sorted(file.name for file in path.parent.iterdir()) == ['image.d64', 'image.xml']